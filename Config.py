@@ -32,11 +32,26 @@ class AppConfig:
     EMAIL_HOST_USER: str = ''
     EMAIL_HOST_PASSWORD: str = ''
     EMAIL_PORT = 587
+    EMAIL_FILE_PATH: str = ''
+    EMAIL_QUEUE_RATE: float = 5.0
+    EMAIL_QUEUE_BATCH_SIZE: int = 100
+    EMAIL_QUEUE_MAX_ATTEMPTS: int = 5
+    EMAIL_QUEUE_RETRY_DELAY: int = 60
     AWS_ACCESS_KEY_ID: str = ''
     AWS_SECRET_ACCESS_KEY: str = ''
     AWS_STORAGE_BUCKET_NAME: str = ''
     AWS_S3_ENDPOINT_URL: str = ''
     AWS_LOCATION: str = ''
+    STATIC_ROOT: str = ''
+    MEDIA_CACHE_DIR: str = ''
+    MEDIA_CACHE_MAX_MB: int = 1024
+    MEDIA_CACHE_REVALIDATE: int = 60
+    CACHE_URL: str = 'locmem://necrotopia'
+    CACHE_TIMEOUT: int = 300
+    CACHE_KEY_PREFIX: str = 'necrotopia'
+    CACHE_VERSION: int = 1
+    CACHE_LOCAL_SIZE: int = 1024
+    CACHE_LOCAL_TIMEOUT: int = 5
 
 
     """
@@ -1,2 +1,3 @@
 python manage.py makemigrations
-python manage.py migrate
\ No newline at end of file
+python manage.py migrate
+python manage.py rebuild_search_index
\ No newline at end of file
@@ -1,5 +1,9 @@
+from array import array
+
+from django.utils.translation import gettext as _translate
+
+from necrotopia.crafting import BillOfMaterials, CraftingLoopError
 from necrotopia.models import Grade
-from necrotopia.tools import DictionaryTool
 
 
 class Component:
@@ -37,42 +41,176 @@ class Component:
     def add(self, sub_component: "Component"):
         self.components[sub_component.name] = sub_component
 
-    def collapse(self) -> {}:
-        result = {}
-        my_name = self.name
-
-        for component in self.components.values():
-            if len(component.components) > 0:
-                sub_modules = component.collapse()
-                result = DictionaryTool.mergeDictionary(result, sub_modules)
-            else:
-                if DictionaryTool.contains_key(component.name, result):
-                    result[component.name] += component.quantity
-                else:
-                    result[component.name] = component.quantity
+    def evaluate(self) -> BillOfMaterials:
+        return ComponentEvaluator().evaluate(self)
 
-        return result
+    def collapse(self) -> {}:
+        return dict(self.evaluate().resources)
 
     def get_total_time(self) -> int:
-        result = self.time
+        return self.evaluate().time
+
+    def get_total_mind(self) -> int:
+        return self.evaluate().mind
 
-        for key in self.components:
-            sub_component = self.components[key]
-            sub_time = sub_component.get_total_time()
-            result += sub_time
 
-        return result
+class ComponentEvaluator:
+    """
+        Computes the raw resources, total mind and total time of a component tree in a single post-order pass over an
+        explicit stack, so deep trees are not limited by the interpreter's recursion limit. A sub-assembly needed
+        several times multiplies everything beneath it.
 
-    def get_total_mind(self) -> int:
-        result = self.mind
+        Sub-assemblies are memoized twice: by identity, so a Component instance added in several places is walked
+        once, and by structure, so identical sub-trees built separately (the repeated basic and proficient frames of
+        a master blueprint, for instance) only have their totals merged once.
+    """
 
-        for key in self.components:
-            sub_component = self.components[key]
-            sub_mind = sub_component.get_total_mind()
-            result += sub_mind
+    def __init__(self):
+        self._results = dict()
+        self._evaluated = []
+        self._signatures = dict()
+        self._interned = dict()
+        self._by_signature = dict()
+
+    def evaluate(self, component: Component) -> BillOfMaterials:
+        active = set()
+        stack = [(component, False)]
+
+        while len(stack) > 0:
+            node, children_done = stack.pop()
+            if id(node) in self._results:
+                continue
+
+            if not children_done:
+                active.add(id(node))
+                stack.append((node, True))
+                for child in node.components.values():
+                    if len(child.components) > 0 and id(child) not in self._results:
+                        if id(child) in active:
+                            raise CraftingLoopError(
+                                _translate('{name} requires itself to be crafted').format(name=child.name))
+                        stack.append((child, False))
+                continue
+
+            signature = (node.name, node.grade, node.mind, node.time, tuple(
+                (self._signatures[id(child)], child.quantity) if len(child.components) > 0
+                else (child.name, child.quantity, child.mind, child.time)
+                for child in node.components.values()))
+            signature_id = self._interned.setdefault(signature, len(self._interned))
+
+            bill = self._by_signature.get(signature_id)
+            if bill is None:
+                bill = BillOfMaterials(node.name, node.grade)
+                bill.mind = node.mind
+                bill.time = node.time
+
+                for child in node.components.values():
+                    if len(child.components) > 0:
+                        bill.add_bill(self._results[id(child)], child.quantity)
+                    else:
+                        bill.add_resource(child.name, child.quantity)
+                        bill.mind += child.mind * child.quantity
+                        bill.time += child.time * child.quantity
+
+                self._by_signature[signature_id] = bill
+
+            active.discard(id(node))
+            # results are keyed by id(), so the components must outlive the evaluator to keep their ids unique
+            self._evaluated.append(node)
+            self._signatures[id(node)] = signature_id
+            self._results[id(node)] = bill
+
+        return self._results[id(component)]
+
+
+class ComponentArray:
+    """
+        A compact, flat representation of a component tree for bulk crafting simulations. Instead of one object and
+        one dictionary per node, the tree is held as parallel arrays (parent index, interned name, quantity, grade,
+        mind, time) with every node stored after its parent, so it can be totalled in a single forward pass.
+    """
+    __slots__ = ('names', 'name_ids', 'name', 'parent', 'quantity', 'grade', 'mind', 'time', 'child_count')
+
+    def __init__(self, names: list = None, name_ids: dict = None):
+        # several arrays may share one name table to keep interned names unique across a whole simulation
+        self.names = names if names is not None else []
+        self.name_ids = name_ids if name_ids is not None else dict()
+        self.name = array('i')
+        self.parent = array('i')
+        self.quantity = array('i')
+        self.grade = array('b')
+        self.mind = array('i')
+        self.time = array('i')
+        self.child_count = array('i')
+
+    def __len__(self):
+        return len(self.parent)
+
+    def intern(self, name: str) -> int:
+        result = self.name_ids.get(name)
+        if result is None:
+            result = len(self.names)
+            self.names.append(name)
+            self.name_ids[name] = result
 
         return result
 
+    def append(self, parent: int, name: str, quantity: int = 1, grade: Grade = Grade.Ungraded, mind: int = 0,
+               time: int = 0) -> int:
+        """
+            Add a node below an existing one and return its index. The root is added with a parent of -1.
+        """
+        index = len(self.parent)
+        if parent >= index or (parent < 0 and index > 0):
+            raise ValueError(_translate('A component must be added after its parent'))
+
+        self.name.append(self.intern(name))
+        self.parent.append(parent)
+        self.quantity.append(quantity)
+        self.grade.append(grade)
+        self.mind.append(mind)
+        self.time.append(time)
+        self.child_count.append(0)
+        if parent >= 0:
+            self.child_count[parent] += 1
+
+        return index
+
+    def evaluate(self) -> BillOfMaterials:
+        result = BillOfMaterials()
+        if len(self.parent) == 0:
+            return result
+
+        names, name, parent, quantity, mind, time, child_count = \
+            self.names, self.name, self.parent, self.quantity, self.mind, self.time, self.child_count
+        result.name = names[name[0]]
+        result.grade = Grade(self.grade[0])
+        result.mind = mind[0]
+        result.time = time[0]
+
+        # how many of each node one root needs; the root itself always counts once
+        multiplier = [1] * len(parent)
+        resources = result.resources
+        for index in range(1, len(parent)):
+            count = multiplier[parent[index]] * quantity[index]
+            multiplier[index] = count
+            result.mind += mind[index] * count
+            result.time += time[index] * count
+            if child_count[index] == 0:
+                resource_name = names[name[index]]
+                resources[resource_name] = resources.get(resource_name, 0) + count
+
+        return result
+
+    def collapse(self) -> {}:
+        return self.evaluate().resources
+
+    def get_total_time(self) -> int:
+        return self.evaluate().time
+
+    def get_total_mind(self) -> int:
+        return self.evaluate().mind
+
 
 class ComponentFactory:
     @staticmethod
@@ -85,3 +223,16 @@ class ComponentFactory:
         result.time = time
 
         return result
+
+    @staticmethod
+    def compact(component: Component, names: list = None, name_ids: dict = None) -> ComponentArray:
+        result = ComponentArray(names, name_ids)
+        stack = [(component, -1)]
+
+        while len(stack) > 0:
+            node, parent = stack.pop()
+            index = result.append(parent, node.name, node.quantity, node.grade, node.mind, node.time)
+            for child in reversed(list(node.components.values())):
+                stack.append((child, index))
+
+        return result
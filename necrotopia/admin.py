@@ -1,4 +1,3 @@
-import io
 from datetime import datetime, timedelta
 from typing import cast
 
@@ -9,17 +8,19 @@ from django.contrib.admin.checks import InlineModelAdminChecks
 from django.contrib.admin.helpers import ActionForm
 from django.contrib.admin.options import InlineModelAdmin
 from django.contrib.auth.admin import UserAdmin
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.exceptions import PermissionDenied
 from django.db import models
 from django.forms import TextInput, Textarea
 from django.http import HttpResponseRedirect, HttpResponse
-from django.shortcuts import render
+from django.shortcuts import render, get_object_or_404
+from django.urls import path, reverse
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 from django.utils.timezone import make_aware
 from imagekit.admin import AdminThumbnail
 from nested_admin.nested import NestedModelAdmin, NestedTabularInline
 from rolldice import rolldice
-from pypdf import PdfReader, PdfWriter, PdfMerger
 from tagging.forms import TagField
 from tagging.models import TaggedItem, Tag, TagManager
 
@@ -27,43 +28,36 @@ from necrotopia.forms import RegisterUserForm
 from necrotopia.models import UserProfile, Title, Gender, TimeUnits, \
     ResourceItem, RatedSkillItem, SkillRatings, SkillItem, SkillCategory, RulePicture, Rule, \
     ItemPicture, ModuleGrade, ModuleGradeResource, ModuleGradeSubAssembly, ModuleAssembly, ItemPdf, \
-    Advertisement, Wallet, WalletResource, WalletItem, ProxyUser, ItemCard, ItemCardFace
+    Advertisement, Wallet, WalletResource, WalletItem, ProxyUser, ItemCard, ItemCardFace, BackgroundJob, \
+    OutboundEmail
+from necrotopia.jobs import JobQueue
+from necrotopia.uploads import DirectUploadAdminMixin
 from django import forms
 from django.contrib.auth.models import Group as DjangoGroup
 from django.contrib.auth.admin import GroupAdmin as BaseGroupAdmin
 from django.utils.translation import gettext_lazy as _translate
 from django.contrib import messages
-from necrotopia.views import send_registration_email
 from necrotopia_project.settings import GLOBAL_SITE_NAME
 from functools import partial as curry
 from django.contrib.auth.models import AbstractUser
 
 
-@admin.action(description='Set the tags of all selected items.')
-def bulk_tagging(self, request, queryset):
-    replace = False
+def redirect_to_job(job: BackgroundJob) -> HttpResponseRedirect:
+    return HttpResponseRedirect(reverse('admin:necrotopia_backgroundjob_progress', args=(job.pk,)))
 
-    if 'replace' in request.POST:
-        replace = request.POST.get('replace')
 
+@admin.action(description='Set the tags of all selected items.')
+def bulk_tagging(self, request, queryset):
     if 'apply' in request.POST:
-        new_tag_string = request.POST.get('new_tags')
-        new_tags_list = tagging.models.parse_tag_input(new_tag_string)
-
-        for tagged_item in queryset:
-            Tag.objects.update_tags(tagged_item, None)
-            if not replace:
-                old_tags_list = tagging.models.parse_tag_input(tagged_item.tags)
-                new_tags_list = list(set(new_tags_list) | set(old_tags_list))
-                new_tag_string = ", ".join(new_tags_list)
-
-            Tag.objects.update_tags(tagged_item, new_tags_list)
-            tagged_item.tags = new_tag_string
-            tagged_item.save()
+        pks = list(queryset.values_list('pk', flat=True))
+        job = JobQueue.enqueue('bulk_tagging', {'model': queryset.model._meta.label_lower, 'pks': pks,
+                                                'tags': request.POST.get('new_tags'),
+                                                'replace': bool(request.POST.get('replace'))},
+                               request.user, total=len(pks))
 
         self.message_user(request, level=messages.SUCCESS,
-                          message="Changed tags on {} items".format(queryset.count()))
-        return HttpResponseRedirect(request.get_full_path())
+                          message="Changing tags on {} items".format(len(pks)))
+        return redirect_to_job(job)
     elif 'cancel' in request.POST:
         self.message_user(request, level=messages.ERROR, message="Action cancelled")
         return HttpResponseRedirect(request.get_full_path())
@@ -84,10 +78,13 @@ def resend_registration_email(modeladmin, request, queryset):
     resend_registration_email.short_description = 'Resend Activation Email'
 
     queryset.update(is_active=False)
-    for user in queryset:
-        send_registration_email(request, user)
+    user_ids = list(queryset.values_list('pk', flat=True))
+    job = JobQueue.enqueue('resend_registration_email',
+                           {'user_ids': user_ids, 'domain': get_current_site(request).domain},
+                           request.user, total=len(user_ids))
 
-    messages.success(request, _translate('Registration email resent'))
+    messages.success(request, _translate('Registration email queued'))
+    return redirect_to_job(job)
 
 
 class CustomUserAdmin(UserAdmin):
@@ -155,6 +152,9 @@ class RatedSkillInline(NestedTabularInline):
     model = RatedSkillItem
     fields = ('mind', 'time', 'grade', 'skill', 'one_use_per_game')
 
+    def get_queryset(self, request):
+        return super(RatedSkillInline, self).get_queryset(request).with_skill()
+
 
 class SkillRatingInline(NestedTabularInline):
     extra = 0
@@ -178,7 +178,7 @@ class ResourceItemAdmin(NestedModelAdmin):
     fieldsets = (
         (None,
          {
-             'fields': ('name', 'expiration_units', 'time_units', 'tags')
+             'fields': ('name', 'expiration_units', 'time_units', 'rated_skills', 'tags')
          }),
         ('Registration', {
             'classes': ('collapse',),
@@ -187,6 +187,11 @@ class ResourceItemAdmin(NestedModelAdmin):
     )
     actions = [bulk_tagging]
 
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'rated_skills':
+            kwargs['queryset'] = RatedSkillItem.objects.with_skill()
+        return super(ResourceItemAdmin, self).formfield_for_foreignkey(db_field, request, **kwargs)
+
     def expiration(self, obj):
         if obj.time_units != TimeUnits.No_Expiration:
             x = TimeUnits(obj.time_units).name
@@ -219,6 +224,9 @@ class SkillItemAdmin(NestedModelAdmin):
         SkillRatingInline,
     ]
 
+    def get_queryset(self, request):
+        return super(SkillItemAdmin, self).get_queryset(request).with_first_rating()
+
     def get_changeform_initial_data(self, request):
         get_data = {'registrar': request.user.pk}
         return get_data
@@ -245,7 +253,7 @@ class SkillItemAdmin(NestedModelAdmin):
     set_skill_category.short_description = 'Change Category'
 
 
-class RulePictureInLine(NestedTabularInline):
+class RulePictureInLine(DirectUploadAdminMixin, NestedTabularInline):
     model = RulePicture
     extra = 0
     fields = ('picture', 'image_preview')
@@ -265,6 +273,7 @@ class RuleAdminForm(forms.ModelForm):
 class RuleAdmin(NestedModelAdmin):
     list_display = ('name', 'partial_slug', 'last_update_date', 'registrar', 'registration_date', 'reference', 'tags')
     list_display_links = list_display
+    list_select_related = ('registrar',)
     inlines = [
         RulePictureInLine,
     ]
@@ -295,13 +304,13 @@ class RuleAdmin(NestedModelAdmin):
             return obj.pictures.count()
 
 
-class ItemPdfInLine(NestedTabularInline):
+class ItemPdfInLine(DirectUploadAdminMixin, NestedTabularInline):
     model = ItemPdf
     extra = 0
     fields = ('pdf',)
 
 
-class ItemPictureInLine(NestedTabularInline):
+class ItemPictureInLine(DirectUploadAdminMixin, NestedTabularInline):
     model = ItemPicture
     extra = 0
     fields = ('picture', 'image_preview')
@@ -337,6 +346,8 @@ class ModuleAssemblyAdmin(NestedModelAdmin):
     list_display = (
     'name', 'item_type', 'checked', 'published', 'has_image', 'has_pdf', 'last_update_date', 'expiration', 'tags')
     list_display_links = list_display
+    # selecting all of a filtered list prints the same print pack build_print_packs prepared for it
+    list_filter = ('published', 'item_type', 'crafting_tree')
     ordering = ('name',)
     search_fields = ('name', 'published', 'checked', )
     inlines = [
@@ -376,23 +387,9 @@ class ModuleAssemblyAdmin(NestedModelAdmin):
     @admin.action(description="Print the PDFs of all selected items")
     def print_pdfs(self, request, queryset):
         if 'proceed' in request.POST:
-            output_file = PdfWriter()
-            try:
-                for item in queryset:
-                    for module_pdf in ItemPdf.objects.filter(pdf_assembly_item_id=item.pk):
-                        reader = PdfReader(module_pdf.pdf.open("rb"))
-                        number_of_pages = len(reader.pages)
-                        for page_number in range(number_of_pages):
-                            page = reader.pages[page_number]
-                            output_file.add_page(page)
-
-                with io.BytesIO() as pdf:
-                    output_file.write(pdf)
-                    response = HttpResponse(pdf.getbuffer(), content_type='application/pdf')
-                    response['Content-Disposition'] = 'filename=%s' % 'output.pdf'
-                    return response
-            finally:
-                output_file.close()
+            job = JobQueue.enqueue('print_pdfs', {'assembly_ids': list(queryset.values_list('pk', flat=True))},
+                                   request.user, total=queryset.count())
+            return redirect_to_job(job)
 
         elif 'cancel' in request.POST:
             self.message_user(request, level=messages.ERROR, message="Action cancelled")
@@ -403,11 +400,14 @@ class ModuleAssemblyAdmin(NestedModelAdmin):
                 "items": queryset,
             })
 
-    @admin.display(description='Has image', boolean=True)
+    def get_queryset(self, request):
+        return super(ModuleAssemblyAdmin, self).get_queryset(request).with_media()
+
+    @admin.display(description='Has image', boolean=True, ordering='picture_exists')
     def has_image(self, obj: ModuleAssembly) -> bool:
         return obj.has_image()
 
-    @admin.display(description='Has PDF', boolean=True)
+    @admin.display(description='Has PDF', boolean=True, ordering='pdf_exists')
     def has_pdf(self, obj: ModuleAssembly) -> bool:
         return obj.has_pdf()
 
@@ -454,14 +454,18 @@ class ModuleAssemblyAdmin(NestedModelAdmin):
 
 
 @admin.register(Advertisement)
-class AdvertisementCarouselAdmin(admin.ModelAdmin):
-    list_display = ('name', 'published', 'is_active', 'start_date', 'end_date')
+class AdvertisementCarouselAdmin(DirectUploadAdminMixin, admin.ModelAdmin):
+    list_display = ('name', 'preview', 'published', 'is_active', 'start_date', 'end_date')
     list_display_links = ('name',)
+    readonly_fields = ('image_preview', )
+
+    preview = AdminThumbnail(image_field='thumbnail')
+    preview.short_description = 'Image'
 
     fieldsets = (
         (None,
          {
-             'fields': ('name', 'slug', 'link', 'image', 'published', 'start_date', 'end_date', )
+             'fields': ('name', 'slug', 'link', 'image', 'image_preview', 'published', 'start_date', 'end_date', )
          }),
         ('Registrar', {
             'classes': ('collapse',),
@@ -500,6 +504,7 @@ class WalletAdmin(NestedModelAdmin):
     models = Wallet
     list_display = ('name', 'owner_link', 'creation_date', 'count_of_resources', 'count_of_items')
     list_display_links = ('name',)
+    list_select_related = ('owner_link',)
     readonly_fields = ["creation_date"]
 
     # change_form_template = "admin/necrotopia/wallet/change_form.html"
@@ -520,15 +525,16 @@ class WalletAdmin(NestedModelAdmin):
         }),
     )
 
-    @admin.display(description='Resources')
+    def get_queryset(self, request):
+        return super(WalletAdmin, self).get_queryset(request).with_counts()
+
+    @admin.display(description='Resources', ordering='resource_count')
     def count_of_resources(self, obj: Wallet) -> int:
-        resources = WalletResource.objects.filter(wallet_link=obj)
-        return resources.count()
+        return obj.resource_count
 
-    @admin.display(description='Items')
+    @admin.display(description='Items', ordering='item_count')
     def count_of_items(self, obj: Wallet) -> int:
-        items = WalletItem.objects.filter(wallet_link=obj)
-        return items.count()
+        return obj.item_count
 
     def get_changeform_initial_data(self, request):
         get_data = super(WalletAdmin, self).get_changeform_initial_data(request)
@@ -538,7 +544,7 @@ class WalletAdmin(NestedModelAdmin):
         return get_data
 
 
-class ItemCardInLine(NestedTabularInline):
+class ItemCardInLine(DirectUploadAdminMixin, NestedTabularInline):
     model = ItemCardFace
     extra = 0
     fields = ('card_side', 'image', 'image_preview')
@@ -550,6 +556,7 @@ class ItemCardAdmin(NestedModelAdmin):
     models = ItemCard
     list_display = ('item_type', 'published', 'has_front', 'has_back', 'registrar', 'registry_date')
     list_display_links = ('item_type', )
+    list_select_related = ('registrar',)
     readonly_fields = ['registry_date', 'has_front', 'has_back']
 
     inlines = [ItemCardInLine, ]
@@ -565,11 +572,14 @@ class ItemCardAdmin(NestedModelAdmin):
         }),
     )
 
-    @admin.display(description='Has Front', boolean=True)
+    def get_queryset(self, request):
+        return super(ItemCardAdmin, self).get_queryset(request).with_faces()
+
+    @admin.display(description='Has Front', boolean=True, ordering='front_exists')
     def has_front(self, obj: ItemCard) -> bool:
         return obj.has_front()
 
-    @admin.display(description='Has Back', boolean=True)
+    @admin.display(description='Has Back', boolean=True, ordering='back_exists')
     def has_back(self, obj: ItemCard) -> bool:
         return obj.has_back()
 
@@ -579,3 +589,64 @@ class ItemCardAdmin(NestedModelAdmin):
         get_data['registry_date'] = timezone.now()
 
         return get_data
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'status', 'progress', 'total', 'requested_by', 'created_date', 'finished_date')
+    list_display_links = ('kind', )
+    list_filter = ('status', 'kind')
+    readonly_fields = ('kind', 'arguments', 'status', 'progress', 'total', 'message', 'result', 'attempts',
+                       'requested_by', 'created_date', 'started_date', 'heartbeat_date', 'finished_date')
+
+    # seconds between reloads of the progress page while the job runs
+    refresh = 2
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        queryset = super(BackgroundJobAdmin, self).get_queryset(request)
+        if not request.user.is_superuser:
+            # a job's result can hold anything its requester could see, so other staff don't get to it
+            queryset = queryset.filter(requested_by=request.user)
+
+        return queryset
+
+    def get_urls(self):
+        urls = [
+            path('<int:job_id>/progress/', self.admin_site.admin_view(self.progress_view),
+                 name='necrotopia_backgroundjob_progress'),
+        ]
+
+        return urls + super(BackgroundJobAdmin, self).get_urls()
+
+    def progress_view(self, request, job_id: int):
+        job = get_object_or_404(self.get_queryset(request), pk=job_id)
+        if not self.has_view_permission(request, job):
+            raise PermissionDenied
+
+        return render(request, 'necrotopia/admin_job_progress.html', context=dict(
+            self.admin_site.each_context(request),
+            title=str(job),
+            job=job,
+            refresh=BackgroundJobAdmin.refresh,
+        ))
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'created_date', 'sent_date')
+    list_filter = ('status', )
+    search_fields = ('subject', 'to')
+    readonly_fields = ('subject', 'body', 'content_subtype', 'from_email', 'to', 'status', 'attempts', 'last_error',
+                       'created_date', 'next_attempt_date', 'sent_date')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
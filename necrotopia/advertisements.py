@@ -0,0 +1,90 @@
+from datetime import datetime, time, timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from necrotopia.caching import get_media_timeout
+from necrotopia.images import ResponsiveImage
+from necrotopia.models import Advertisement
+
+
+class ActiveAdvertisement:
+    """
+        What the carousel shows of an advertisement, with the image URLs already resolved so rendering it needs
+        neither the database nor the storage backend.
+    """
+
+    def __init__(self, name: str, slug: str, link: str, image: ResponsiveImage):
+        self.name = name
+        self.slug = slug
+        self.link = link
+        self.image = image
+
+    @property
+    def image_url(self) -> str:
+        return self.image.src
+
+    @classmethod
+    def from_advertisement(cls, advertisement: Advertisement) -> "ActiveAdvertisement":
+        return cls(advertisement.name, advertisement.slug, advertisement.link, advertisement.get_responsive_image())
+
+    def __str__(self):
+        return self.name
+
+
+class AdvertisementCache:
+    """
+        The published advertisements running today, cached under a key holding today's date in SERVER_TIMEZONE.
+        The set only changes at midnight, when the key changes and the old entry expires, or when an advertisement
+        is edited, when signals.py drops the entry. When the media storage signs its URLs the entry is also
+        refreshed well before the signatures expire.
+
+        An advertisement whose renditions are still being made by the render_images job is shown by its carousel
+        thumbnail, made when the image was saved, and the entry holding it is only kept for pending_timeout seconds,
+        so the renditions are picked up soon after they are made whether or not the drop from the worker reached
+        this cache.
+    """
+
+    key_prefix = 'necrotopia.advertisements.active'
+
+    pending_timeout = 60
+
+    @staticmethod
+    def get_key(date) -> str:
+        return '{prefix}.{date}'.format(prefix=AdvertisementCache.key_prefix, date=date.isoformat())
+
+    @staticmethod
+    def get_seconds_to_midnight(now: datetime) -> int:
+        midnight = datetime.combine(now.date() + timedelta(days=1), time.min, tzinfo=now.tzinfo)
+
+        # compared as timestamps, so a daylight saving change overnight is accounted for
+        return max(int(midnight.timestamp() - now.timestamp()), 1)
+
+    @staticmethod
+    def get_timeout(now: datetime) -> int:
+        return get_media_timeout(AdvertisementCache.get_seconds_to_midnight(now))
+
+    @staticmethod
+    def get_active() -> list:
+        now = timezone.localtime()
+        today = now.date()
+
+        pending = []
+
+        def get_advertisements():
+            advertisements = Advertisement.objects.filter(published=True, start_date__lte=today, end_date__gte=today)
+            pending.extend(advertisement.pk for advertisement in advertisements if not advertisement.has_renditions())
+
+            return [ActiveAdvertisement.from_advertisement(advertisement) for advertisement in advertisements]
+
+        key = AdvertisementCache.get_key(today)
+        timeout = AdvertisementCache.get_timeout(now)
+        active = cache.get_or_set(key, get_advertisements, timeout)
+        if len(pending) > 0:
+            cache.touch(key, min(timeout, AdvertisementCache.pending_timeout))
+
+        return active
+
+    @staticmethod
+    def invalidate():
+        cache.delete(AdvertisementCache.get_key(timezone.localdate()))
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate, pre_migrate
 
 
 class NecrotopiaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'necrotopia'
+
+    def ready(self):
+        from necrotopia import checks, signals
+
+        pre_migrate.connect(signals.create_search_extensions, sender=self)
+        post_migrate.connect(signals.create_tag_indexes, sender=self)
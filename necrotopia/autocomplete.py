@@ -0,0 +1,197 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from django.urls import reverse
+
+from necrotopia.models import ModuleAssembly, ResourceItem, Rule, SkillItem
+
+
+class PrefixCache:
+    """
+        A least recently used cache of recent autocomplete results that also expire after ttl seconds.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class PrefixIndex:
+    """
+        An in-process index of the names of blueprints, rules, skills and resources for search-as-you-type.
+
+        Names are held in two sorted arrays searched with bisect: one of whole names, so names starting with the
+        typed text come first, and one of every later word onwards ("auto frame", "frame"), so typing any word of
+        a name finds it. The index is loaded on first use, kept current by the save and delete signals of this
+        process, and reloaded after max_age seconds to pick up changes saved by other processes.
+    """
+
+    # searchable model, result type, and the view showing a row of it
+    sources = (
+        (ModuleAssembly, 'blueprint', 'blueprint_view'),
+        (Rule, 'rule', 'rule_view'),
+        (SkillItem, 'skill', 'skill_view'),
+        (ResourceItem, 'resource', 'resource_view'),
+    )
+
+    def __init__(self, max_age: float = 15 * 60, cache: PrefixCache = None):
+        self.max_age = max_age
+        self.cache = cache if cache is not None else PrefixCache()
+        self.loaded = None
+        self._names = []
+        self._words = []
+        self._items = dict()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def get_key(text: str) -> str:
+        return ' '.join(text.lower().split())
+
+    @staticmethod
+    def get_source(model):
+        return next(source for source in PrefixIndex.sources if source[0] is model)
+
+    def reset(self):
+        with self._lock:
+            self.loaded = None
+            self._names = []
+            self._words = []
+            self._items = dict()
+            self.cache.clear()
+
+    def load(self):
+        names, words, items = [], [], dict()
+        for model, item_type, view_name in PrefixIndex.sources:
+            for pk, name in model.objects.values_list('pk', 'name'):
+                item_id = (item_type, pk)
+                items[item_id] = self.get_item(item_type, view_name, pk, name)
+                name_keys, word_keys = self.get_keys(name)
+                names.extend((key, item_type, pk) for key in name_keys)
+                words.extend((key, item_type, pk) for key in word_keys)
+
+        names.sort()
+        words.sort()
+        with self._lock:
+            self._names, self._words, self._items = names, words, items
+            self.loaded = time.monotonic()
+            self.cache.clear()
+
+    def get_item(self, item_type: str, view_name: str, pk: int, name: str) -> dict:
+        return {'type': item_type, 'id': pk, 'name': name, 'url': reverse(view_name, args=[pk])}
+
+    def get_keys(self, name: str) -> tuple:
+        words = self.get_key(name).split(' ')
+        if len(words) == 0 or words == ['']:
+            return [], []
+
+        return [' '.join(words)], [' '.join(words[index:]) for index in range(1, len(words))]
+
+    def is_stale(self) -> bool:
+        return self.loaded is None or time.monotonic() - self.loaded > self.max_age
+
+    def remove(self, model, pk: int):
+        if self.loaded is None:
+            return
+
+        item_type = self.get_source(model)[1]
+        with self._lock:
+            item = self._items.pop((item_type, pk), None)
+            if item is not None:
+                name_keys, word_keys = self.get_keys(item['name'])
+                self._remove_keys(self._names, name_keys, item_type, pk)
+                self._remove_keys(self._words, word_keys, item_type, pk)
+            self.cache.clear()
+
+    def update(self, model, pk: int, name: str):
+        if self.loaded is None:
+            return
+
+        model, item_type, view_name = self.get_source(model)
+        with self._lock:
+            self.remove(model, pk)
+            self._items[(item_type, pk)] = self.get_item(item_type, view_name, pk, name)
+            name_keys, word_keys = self.get_keys(name)
+            for key in name_keys:
+                insort(self._names, (key, item_type, pk))
+            for key in word_keys:
+                insort(self._words, (key, item_type, pk))
+
+    @staticmethod
+    def _remove_keys(entries: list, keys: list, item_type: str, pk: int):
+        for key in keys:
+            index = bisect_left(entries, (key, item_type, pk))
+            if index < len(entries) and entries[index] == (key, item_type, pk):
+                del entries[index]
+
+    @staticmethod
+    def _collect(entries: list, prefix: str, limit: int, found: dict):
+        index = bisect_left(entries, (prefix,))
+        while index < len(entries) and len(found) < limit:
+            key, item_type, pk = entries[index]
+            if not key.startswith(prefix):
+                break
+            found.setdefault((item_type, pk), None)
+            index += 1
+
+    def search(self, text: str, limit: int = 10) -> list:
+        """
+            The items whose name, or any word of it onwards, starts with text: whole name matches first, each group
+            in alphabetical order.
+
+        :return: a list of dictionaries of type, id, name and url
+        """
+        prefix = self.get_key(text)
+        if len(prefix) == 0:
+            return []
+
+        if self.is_stale():
+            self.load()
+
+        key = (prefix, limit)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        with self._lock:
+            found = dict()
+            self._collect(self._names, prefix, limit, found)
+            self._collect(self._words, prefix, limit, found)
+            result = [self._items[item_id] for item_id in found]
+            self.cache.set(key, result)
+
+        return result
+
+
+AUTOCOMPLETE_INDEX = PrefixIndex()
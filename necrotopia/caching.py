@@ -0,0 +1,353 @@
+import pickle
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlsplit
+
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT, InvalidCacheBackendError
+
+# Django cache backend for each scheme of a CACHE_URL
+CACHE_SCHEMES = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+    'dummy': 'django.core.cache.backends.dummy.DummyCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'rediss': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+}
+
+SHARED_CACHE_ALIAS = 'shared'
+
+_missing = object()
+
+# Django makes a cache backend per thread, so what its threads share is held here, by the alias of the shared cache
+_tiers = dict()
+_tiers_lock = threading.Lock()
+
+
+def parse_cache_url(url: str) -> dict:
+    """
+        A CACHES entry from a URL such as locmem://necrotopia, file:///var/tmp/necrotopia, db://cache_table,
+        redis://cache:6379/0 or memcached://cache:11211. Query string parameters become OPTIONS, so
+        redis://cache:6379/0?db=1 passes db to the backend.
+
+    :return: a dictionary holding the BACKEND, LOCATION and OPTIONS of the cache
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in CACHE_SCHEMES:
+        raise InvalidCacheBackendError('Unknown cache URL scheme "{scheme}" in "{url}"'.format(scheme=parts.scheme,
+                                                                                             url=url))
+
+    if parts.scheme in ('locmem', 'db'):
+        location = parts.netloc + parts.path
+    elif parts.scheme == 'file':
+        location = parts.path
+    elif parts.scheme == 'memcached':
+        location = parts.netloc
+    elif parts.scheme == 'dummy':
+        location = ''
+    else:
+        location = '{scheme}://{netloc}{path}'.format(scheme=parts.scheme, netloc=parts.netloc, path=parts.path)
+
+    options = dict()
+    for name, value in parse_qsl(parts.query):
+        options[name] = int(value) if value.isdigit() else value
+
+    return {'BACKEND': CACHE_SCHEMES[parts.scheme], 'LOCATION': location, 'OPTIONS': options}
+
+
+def get_cache_settings(url: str, timeout: int, key_prefix: str, version: int, local_size: int,
+                       local_timeout: int) -> dict:
+    """
+        The CACHES setting: the cache named by url as the shared tier, behind a TieredCache as the default cache.
+        Setting local_size to 0 leaves out the in-process tier.
+    """
+    shared = parse_cache_url(url)
+    shared.update({'TIMEOUT': timeout, 'KEY_PREFIX': key_prefix, 'VERSION': version})
+
+    if local_size <= 0:
+        return {'default': shared}
+
+    return {
+        'default': {
+            'BACKEND': 'necrotopia.caching.TieredCache',
+            'LOCATION': SHARED_CACHE_ALIAS,
+            'TIMEOUT': timeout,
+            'OPTIONS': {'LOCAL_SIZE': local_size, 'LOCAL_TIMEOUT': local_timeout},
+        },
+        SHARED_CACHE_ALIAS: shared,
+    }
+
+
+def get_media_timeout(timeout: int, storage=None) -> int:
+    """
+        timeout, shortened when the media storage signs its URLs so that a cached page or value holding media URLs
+        is refreshed well before their signatures expire.
+    """
+    storage = default_storage if storage is None else storage
+    if getattr(storage, 'querystring_auth', False):
+        timeout = min(timeout, max(storage.querystring_expire // 2, 1))
+
+    return timeout
+
+
+class CacheStats:
+    """
+        Hit and miss counters of a cache in this process.
+    """
+
+    names = ('local_hits', 'shared_hits', 'misses', 'fills', 'lock_waits')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = dict.fromkeys(CacheStats.names, 0)
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def __getattr__(self, name: str) -> int:
+        if name in CacheStats.names:
+            return self._counts[name]
+
+        raise AttributeError(name)
+
+    @property
+    def HitRate(self) -> float:
+        hits = self.local_hits + self.shared_hits
+        total = hits + self.misses
+
+        return hits / total if total > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+
+class LocalCache:
+    """
+        A least recently used cache of pickled values in this process, each kept for at most max_age seconds.
+    """
+
+    def __init__(self, max_size: int, max_age: float):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+
+        # values are stored pickled, so callers changing what they get back do not change the cache
+        return pickle.loads(value)
+
+    def set(self, key: str, value, max_age: float = None):
+        max_age = self.max_age if max_age is None else min(max_age, self.max_age)
+        if max_age <= 0:
+            self.delete(key)
+            return
+
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + max_age, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TieredCache(BaseCache):
+    """
+        A cache backend keeping recently read entries in an in-process LocalCache in front of a shared cache,
+        which is the cache named by LOCATION and holds the key prefix, version and default timeout.
+
+        Writes and deletes go to both tiers, but another process only sees them once its local copy expires, so
+        LOCAL_TIMEOUT bounds how stale a read can be and should stay short. get_or_set() also protects against
+        stampedes: when a missing entry is being computed, other threads and processes asking for it wait for
+        that result instead of computing it again.
+
+        Options:
+            LOCAL_SIZE: the most entries held in the process, 1024 by default
+            LOCAL_TIMEOUT: the most seconds an entry is held in the process, 5 by default
+            LOCK_TIMEOUT: the most seconds a computation holds its lock, 30 by default
+            LOCK_WAIT: the most seconds to wait for another computation before doing it anyway, 10 by default
+    """
+
+    lock_stripes = 64
+
+    def __init__(self, location: str, params: dict):
+        options = params.get('OPTIONS', {})
+        super(TieredCache, self).__init__(params)
+        self.shared_alias = location
+        self.lock_timeout = int(options.get('LOCK_TIMEOUT', 30))
+        self.lock_wait = float(options.get('LOCK_WAIT', 10))
+        self.lock_poll = float(options.get('LOCK_POLL', 0.05))
+        with _tiers_lock:
+            if location not in _tiers:
+                _tiers[location] = (LocalCache(int(options.get('LOCAL_SIZE', 1024)),
+                                               float(options.get('LOCAL_TIMEOUT', 5))),
+                                    CacheStats(), [threading.Lock() for _ in range(TieredCache.lock_stripes)])
+            self.local, self.stats, self._locks = _tiers[location]
+
+    @property
+    def shared(self) -> BaseCache:
+        return caches[self.shared_alias]
+
+    def get_local_key(self, key: str, version: int = None) -> str:
+        return self.shared.make_and_validate_key(key, version=version)
+
+    def get_local_timeout(self, timeout):
+        """
+            How long to keep a value just written to the shared cache, which is at most LOCAL_TIMEOUT seconds.
+        """
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.shared.default_timeout
+
+        return self.local.max_age if timeout is None else timeout
+
+    def get_key_lock(self, local_key: str) -> threading.Lock:
+        return self._locks[zlib.crc32(local_key.encode('utf-8')) % TieredCache.lock_stripes]
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version)
+        if added:
+            self.local.set(self.get_local_key(key, version), value, self.get_local_timeout(timeout))
+
+        return added
+
+    def lookup(self, key, version=None) -> tuple:
+        """
+            Find key in the local cache, then in the shared one, without counting the lookup.
+
+        :return: the name of the count the lookup falls under, and the value or _missing
+        """
+        local_key = self.get_local_key(key, version)
+        value = self.local.get(local_key, _missing)
+        if value is not _missing:
+            return 'local_hits', value
+
+        value = self.shared.get(key, _missing, version)
+        if value is _missing:
+            return 'misses', value
+
+        self.local.set(local_key, value)
+
+        return 'shared_hits', value
+
+    def get(self, key, default=None, version=None):
+        name, value = self.lookup(key, version)
+        self.stats.count(name)
+
+        return default if value is _missing else value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version)
+        self.local.set(self.get_local_key(key, version), value, self.get_local_timeout(timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        # the in-process copy would otherwise outlive a shortened timeout
+        self.local.delete(self.get_local_key(key, version))
+
+        return self.shared.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        self.local.delete(self.get_local_key(key, version))
+
+        return self.shared.delete(key, version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version) is not _missing
+
+    def incr(self, key, delta=1, version=None):
+        self.local.delete(self.get_local_key(key, version))
+
+        return self.shared.incr(key, delta, version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+            The value of key, or else the value of default, which is stored under key. When default is a callable
+            only one caller at a time computes it: the others wait for it, holding a lock in this process and an
+            entry added to the shared cache, for up to LOCK_WAIT seconds.
+        """
+        value = self.get(key, _missing, version)
+        if value is not _missing:
+            return value
+
+        if not callable(default):
+            self.set(key, default, timeout, version)
+            return default
+
+        local_key = self.get_local_key(key, version)
+        with self.get_key_lock(local_key):
+            # another thread may have filled it meanwhile; the lookup above already counted this one
+            _, value = self.lookup(key, version)
+            if value is not _missing:
+                return value
+
+            lock_key = '{key}:lock'.format(key=key)
+            locked = self.shared.add(lock_key, 1, self.lock_timeout, version)
+            if not locked:
+                value = self.wait_for(key, lock_key, version)
+                if value is not _missing:
+                    return value
+
+            try:
+                value = default()
+                self.stats.count('fills')
+                self.set(key, value, timeout, version)
+            finally:
+                if locked:
+                    self.shared.delete(lock_key, version)
+
+        return value
+
+    def wait_for(self, key, lock_key, version=None):
+        """
+            Polls the shared cache while another process computes key, until the value appears, the other process
+            releases its lock, or LOCK_WAIT seconds pass.
+        """
+        self.stats.count('lock_waits')
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            time.sleep(self.lock_poll)
+            value = self.shared.get(key, _missing, version)
+            if value is not _missing:
+                self.local.set(self.get_local_key(key, version), value)
+                self.stats.count('shared_hits')
+                return value
+            if not self.shared.has_key(lock_key, version):
+                break
+
+        return _missing
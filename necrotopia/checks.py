@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+        The web server, run_jobs and send_queued_mail run in separate processes, and what one of them drops from the
+        cache, such as the fragments and advertisements dropped after an edit, has to be gone for all of them.
+    """
+    caches = getattr(settings, 'CACHES', {})
+    shared = caches.get('shared', caches.get('default', {}))
+    if settings.DEBUG or shared.get('BACKEND') != 'django.core.cache.backends.locmem.LocMemCache':
+        return []
+
+    return [Warning('The shared cache is kept in the memory of each process.',
+                    hint='Set CACHE_URL to a cache every process reaches, e.g. redis://cache:6379/0.',
+                    id='necrotopia.W001')]
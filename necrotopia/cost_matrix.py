@@ -0,0 +1,172 @@
+import csv
+from collections import deque
+
+import numpy
+from django.utils.translation import gettext as _translate
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+
+from necrotopia.crafting import BillOfMaterials, CraftingGraph, CraftingLoopError
+from necrotopia.models import Grade
+
+
+class CraftingCostMatrix:
+    """
+        The raw resources, mind and time needed for every grade of every blueprint, solved for the whole catalogue
+        at once. With S the sparse (grade x grade) matrix of sub-assembly quantities and R the (grade x resource)
+        matrix of direct resource quantities, the fully expanded requirements T satisfy T = R + S T, so a single
+        sparse solve of (I - S) T = R replaces one tree walk per blueprint. Mind and time ride along as two extra
+        right-hand-side columns.
+    """
+
+    def __init__(self, nodes: list, names: dict, resources: list, requirements, mind, time):
+        self.nodes = nodes
+        self.names = names
+        self.resources = resources
+        self.requirements = requirements
+        self.mind = mind
+        self.time = time
+        self.rows = {node: index for index, node in enumerate(nodes)}
+
+    @staticmethod
+    def order_nodes(graph: CraftingGraph) -> list:
+        """
+            Order the blueprint grades so that every grade comes before the sub-assemblies it needs.
+        """
+        waiting = {key: 0 for key in graph.nodes}
+        children = dict()
+        for key, node in graph.nodes.items():
+            children[key] = [sub_key for sub_key in CraftingCostMatrix.get_sub_keys(graph, node)
+                             if sub_key[1] is not None]
+            for sub_key in children[key]:
+                waiting[sub_key] += 1
+
+        ready = deque(key for key, count in waiting.items() if count == 0)
+        result = []
+        while len(ready) > 0:
+            key = ready.popleft()
+            result.append(key)
+            for sub_key in children[key]:
+                waiting[sub_key] -= 1
+                if waiting[sub_key] == 0:
+                    ready.append(sub_key)
+
+        if len(result) < len(graph.nodes):
+            looping = next(key for key, count in waiting.items() if count > 0)
+            raise CraftingLoopError(
+                _translate('{name} requires itself to be crafted').format(name=graph.names.get(looping[0], looping[0])))
+
+        return result
+
+    @staticmethod
+    def get_sub_keys(graph: CraftingGraph, node) -> list:
+        return [(sub_assembly_id, graph.resolve_grade(sub_assembly_id, sub_grade))
+                for sub_assembly_id, sub_grade, quantity in node.sub_assemblies]
+
+    @classmethod
+    def from_graph(cls, graph: CraftingGraph) -> "CraftingCostMatrix":
+        nodes = CraftingCostMatrix.order_nodes(graph)
+        rows = {node: index for index, node in enumerate(nodes)}
+        columns = dict()
+
+        def get_column(name: str) -> int:
+            return columns.setdefault(name, len(columns))
+
+        sub_rows, sub_columns, sub_values = [], [], []
+        resource_rows, resource_columns, resource_values = [], [], []
+        mind = numpy.zeros(len(nodes))
+        time = numpy.zeros(len(nodes))
+
+        for row, key in enumerate(nodes):
+            node = graph.nodes[key]
+            mind[row] = node.mind
+            time[row] = node.time
+
+            for name, quantity in node.resources:
+                resource_rows.append(row)
+                resource_columns.append(get_column(name))
+                resource_values.append(quantity)
+
+            for (sub_assembly_id, sub_grade), (_, _, quantity) in zip(CraftingCostMatrix.get_sub_keys(graph, node),
+                                                                      node.sub_assemblies):
+                if sub_grade is None:
+                    # a blueprint without grades is a raw part in its own right
+                    resource_rows.append(row)
+                    resource_columns.append(get_column(graph.names.get(sub_assembly_id, '')))
+                    resource_values.append(quantity)
+                else:
+                    sub_rows.append(row)
+                    sub_columns.append(rows[(sub_assembly_id, sub_grade)])
+                    sub_values.append(quantity)
+
+        size = len(nodes)
+        sub_assemblies = sparse.csc_matrix((sub_values, (sub_rows, sub_columns)), shape=(size, size), dtype=float)
+        direct = sparse.csc_matrix((resource_values, (resource_rows, resource_columns)), shape=(size, len(columns)),
+                                   dtype=float)
+
+        if size > 0:
+            right_hand_side = numpy.column_stack([direct.toarray(), mind, time])
+            solved = spsolve((sparse.identity(size, format='csc') - sub_assemblies).tocsc(), right_hand_side)
+            solved = numpy.rint(solved.reshape(size, len(columns) + 2)).astype(numpy.int64)
+        else:
+            solved = numpy.zeros((0, len(columns) + 2), dtype=numpy.int64)
+
+        return cls(nodes, dict(graph.names), list(columns.keys()), solved[:, :len(columns)], solved[:, -2],
+                   solved[:, -1])
+
+    @classmethod
+    def build(cls) -> "CraftingCostMatrix":
+        return cls.from_graph(CraftingGraph.load_all())
+
+    def get_row(self, assembly_id: int, grade: int):
+        if grade == Grade.Ungraded:
+            grades = sorted(node_grade for node_assembly_id, node_grade in self.nodes
+                            if node_assembly_id == assembly_id)
+            grade = grades[0] if len(grades) > 0 else grade
+
+        return self.rows.get((assembly_id, int(grade)))
+
+    def get_bill(self, assembly_id: int, grade: int) -> BillOfMaterials:
+        result = BillOfMaterials(self.names.get(assembly_id, ''), Grade(grade))
+        row = self.get_row(assembly_id, grade)
+        if row is None:
+            return result
+
+        result.grade = Grade(self.nodes[row][1])
+        result.mind = int(self.mind[row])
+        result.time = int(self.time[row])
+        for column in numpy.flatnonzero(self.requirements[row]):
+            result.add_resource(self.resources[column], int(self.requirements[row, column]))
+
+        return result
+
+    def get_header(self) -> list:
+        return ['blueprint_id', 'blueprint', 'grade', 'mind', 'time'] + self.resources
+
+    def get_sorted_rows(self) -> list:
+        return sorted(range(len(self.nodes)), key=lambda row: (self.names.get(self.nodes[row][0], ''), self.nodes[row]))
+
+    def write_csv(self, stream):
+        writer = csv.writer(stream)
+        writer.writerow(self.get_header())
+        for row in self.get_sorted_rows():
+            assembly_id, grade = self.nodes[row]
+            writer.writerow([assembly_id, self.names.get(assembly_id, ''), Grade(grade).name, int(self.mind[row]),
+                             int(self.time[row])] + self.requirements[row].tolist())
+
+    def write_parquet(self, path):
+        import pyarrow
+        import pyarrow.parquet
+
+        rows = self.get_sorted_rows()
+        columns = {
+            'blueprint_id': [self.nodes[row][0] for row in rows],
+            'blueprint': [self.names.get(self.nodes[row][0], '') for row in rows],
+            'grade': [Grade(self.nodes[row][1]).name for row in rows],
+            'mind': self.mind[rows],
+            'time': self.time[rows],
+        }
+        for column, name in enumerate(self.resources):
+            columns[name] = self.requirements[rows, column]
+
+        pyarrow.parquet.write_table(pyarrow.table(columns), path)
@@ -0,0 +1,397 @@
+import uuid
+
+from django.db import connection, transaction
+from django.utils.translation import gettext as _translate
+
+from necrotopia.models import Grade, ModuleAssembly, ModuleGrade, ModuleGradeResource, ModuleGradeSubAssembly, \
+    ModuleAssemblyPartsList
+
+
+class CraftingLoopError(Exception):
+    pass
+
+
+class BillOfMaterials:
+    def __init__(self, name: str = '', grade: Grade = Grade.Ungraded):
+        self.name = name
+        self.grade = grade
+        self.resources = dict()
+        self.mind = 0
+        self.time = 0
+
+    @property
+    def Name(self) -> str:
+        return self.name
+
+    @property
+    def Resources(self) -> dict:
+        return self.resources
+
+    @property
+    def Mind(self) -> int:
+        return self.mind
+
+    @property
+    def Time(self) -> int:
+        return self.time
+
+    def get_grade_name(self) -> str:
+        return Grade(self.grade).name
+
+    def add_resource(self, name: str, quantity: int):
+        self.resources[name] = self.resources.get(name, 0) + quantity
+
+    def add_bill(self, other: "BillOfMaterials", quantity: int = 1):
+        for name, amount in other.resources.items():
+            self.add_resource(name, amount * quantity)
+
+        self.mind += other.mind * quantity
+        self.time += other.time * quantity
+
+    def __str__(self):
+        return "{name} ({grade})".format(name=self.name, grade=self.get_grade_name())
+
+
+class CraftingNode:
+    def __init__(self, assembly_id: int, grade: int, mind: int = 0, time: int = 0):
+        self.assembly_id = assembly_id
+        self.grade = grade
+        self.mind = mind
+        self.time = time
+        self.resources = []
+        self.sub_assemblies = []
+
+    @property
+    def key(self) -> tuple:
+        return self.assembly_id, self.grade
+
+
+class CraftingGraph:
+    """
+        An in-memory copy of the blueprint crafting graph: every ModuleGrade reachable from a set of blueprints,
+        together with its raw resources and crafted sub-assemblies. Once loaded, any number of blueprint grades can
+        be expanded without touching the database, and each (blueprint, grade) is only ever expanded once.
+    """
+
+    def __init__(self):
+        self.names = dict()
+        self.nodes = dict()
+        self.grades = dict()
+        self._expanded = dict()
+
+    def add_assembly(self, assembly_id: int, name: str):
+        self.names[assembly_id] = name
+
+    def add_grade(self, assembly_id: int, grade: int, mind: int = 0, time: int = 0) -> CraftingNode:
+        key = (assembly_id, int(grade))
+        node = self.nodes.get(key)
+
+        # a blueprint may carry several rows for the same grade; like the admin inline, the first one wins
+        if node is None:
+            node = CraftingNode(assembly_id, int(grade), mind or 0, time or 0)
+            self.nodes[key] = node
+            self.grades[assembly_id] = sorted(self.grades.get(assembly_id, []) + [int(grade)])
+
+        return node
+
+    def add_resource(self, assembly_id: int, grade: int, name: str, quantity: int):
+        self.nodes[(assembly_id, int(grade))].resources.append((name, quantity))
+
+    def add_sub_assembly(self, assembly_id: int, grade: int, sub_assembly_id: int, sub_grade: int, quantity: int):
+        self.nodes[(assembly_id, int(grade))].sub_assemblies.append((sub_assembly_id, int(sub_grade), quantity))
+
+    def get_grades(self, assembly_id: int) -> list:
+        return self.grades.get(assembly_id, [])
+
+    def resolve_grade(self, assembly_id: int, grade: int):
+        """
+            An ungraded sub-assembly is satisfied by the lowest grade the blueprint defines. Returns None when the
+            blueprint has no such grade, in which case the sub-assembly is treated as a raw part in its own right.
+        """
+        if grade == Grade.Ungraded:
+            grades = self.get_grades(assembly_id)
+            return grades[0] if len(grades) > 0 else None
+
+        return grade if (assembly_id, grade) in self.nodes else None
+
+    def expand(self, assembly_id: int, grade: int) -> BillOfMaterials:
+        """
+            Expand a blueprint grade into its raw resources, total mind and total time. Sub-assembly quantities
+            multiply everything beneath them. The walk uses an explicit stack, so the depth of the tree is not bound
+            by the interpreter's recursion limit, and results are memoized per (blueprint, grade).
+
+        :param assembly_id: the line_id of the ModuleAssembly
+        :param grade: the Grade to expand
+        :return: the BillOfMaterials for that grade
+        """
+        root = (assembly_id, self.resolve_grade(assembly_id, int(grade)))
+        if root[1] is None:
+            return BillOfMaterials(self.names.get(assembly_id, ''), Grade(grade))
+
+        active = set()
+        stack = [(root, False)]
+
+        while len(stack) > 0:
+            key, children_done = stack.pop()
+            if key in self._expanded:
+                continue
+
+            node = self.nodes[key]
+            if not children_done:
+                active.add(key)
+                stack.append((key, True))
+                for sub_assembly_id, sub_grade, quantity in node.sub_assemblies:
+                    sub_key = (sub_assembly_id, self.resolve_grade(sub_assembly_id, sub_grade))
+                    if sub_key[1] is not None and sub_key not in self._expanded:
+                        if sub_key in active:
+                            raise CraftingLoopError(
+                                _translate('{name} requires itself to be crafted').format(
+                                    name=self.names.get(sub_assembly_id, sub_assembly_id)))
+                        stack.append((sub_key, False))
+                continue
+
+            bill = BillOfMaterials(self.names.get(node.assembly_id, ''), Grade(node.grade))
+            bill.mind = node.mind
+            bill.time = node.time
+
+            for name, quantity in node.resources:
+                bill.add_resource(name, quantity)
+
+            for sub_assembly_id, sub_grade, quantity in node.sub_assemblies:
+                sub_key = (sub_assembly_id, self.resolve_grade(sub_assembly_id, sub_grade))
+                if sub_key[1] is None:
+                    bill.add_resource(self.names.get(sub_assembly_id, ''), quantity)
+                else:
+                    bill.add_bill(self._expanded[sub_key], quantity)
+
+            active.discard(key)
+            self._expanded[key] = bill
+
+        return self._expanded[root]
+
+    def flatten(self, assembly_id: int) -> dict:
+        return {Grade(grade): self.expand(assembly_id, grade) for grade in self.get_grades(assembly_id)}
+
+    @staticmethod
+    def _walk_assemblies(assembly_ids, upwards: bool) -> dict:
+        assembly_ids = [int(assembly_id) for assembly_id in assembly_ids]
+        if len(assembly_ids) == 0:
+            return dict()
+
+        quote = connection.ops.quote_name
+        if upwards:
+            step = "SELECT g.{grade_assembly} FROM {sub} s " \
+                   "INNER JOIN {grade} g ON s.{sub_parent} = g.{grade_pk} " \
+                   "INNER JOIN reachable r ON s.{sub_assembly} = r.line_id " \
+                   "WHERE g.{grade_assembly} IS NOT NULL"
+        else:
+            step = "SELECT s.{sub_assembly} FROM {sub} s " \
+                   "INNER JOIN {grade} g ON s.{sub_parent} = g.{grade_pk} " \
+                   "INNER JOIN reachable r ON g.{grade_assembly} = r.line_id " \
+                   "WHERE s.{sub_assembly} IS NOT NULL"
+
+        sql = """
+            WITH RECURSIVE reachable (line_id) AS (
+                SELECT a.{assembly_pk} FROM {assembly} a WHERE a.{assembly_pk} IN ({placeholders})
+                UNION
+                """ + step + """
+            )
+            SELECT a.{assembly_pk}, a.{assembly_name} FROM {assembly} a
+                INNER JOIN reachable r ON a.{assembly_pk} = r.line_id
+        """
+        sql = sql.format(
+            assembly=quote(ModuleAssembly._meta.db_table),
+            assembly_pk=quote(ModuleAssembly._meta.pk.column),
+            assembly_name=quote(ModuleAssembly._meta.get_field('name').column),
+            sub=quote(ModuleGradeSubAssembly._meta.db_table),
+            sub_assembly=quote(ModuleGradeSubAssembly._meta.get_field('assembly').column),
+            sub_parent=quote(ModuleGradeSubAssembly._meta.get_field('parent_grade').column),
+            grade=quote(ModuleGrade._meta.db_table),
+            grade_pk=quote(ModuleGrade._meta.pk.column),
+            grade_assembly=quote(ModuleGrade._meta.get_field('module_assembly').column),
+            placeholders=', '.join(['%s'] * len(assembly_ids)),
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, assembly_ids)
+            return dict(cursor.fetchall())
+
+    @staticmethod
+    def get_reachable_assemblies(assembly_ids) -> dict:
+        """
+            Walk the sub-assembly edges in the database with a single recursive query, returning the line_id and
+            name of every blueprint reachable from the given ones (including themselves).
+        """
+        return CraftingGraph._walk_assemblies(assembly_ids, upwards=False)
+
+    @staticmethod
+    def get_dependent_assemblies(assembly_ids) -> dict:
+        """
+            The reverse of get_reachable_assemblies: every blueprint that uses one of the given ones somewhere down
+            its tree (including themselves), found with a single recursive query.
+        """
+        return CraftingGraph._walk_assemblies(assembly_ids, upwards=True)
+
+    @classmethod
+    def load(cls, assembly_ids) -> "CraftingGraph":
+        """
+            Load the part of the crafting graph reachable from the given blueprints using a fixed number of queries,
+            however deep or wide the blueprints are.
+        """
+        names = CraftingGraph.get_reachable_assemblies(assembly_ids)
+        if len(names) == 0:
+            return cls()
+
+        return cls._load(names, ModuleGrade.objects.filter(module_assembly_id__in=names.keys()))
+
+    @classmethod
+    def load_all(cls) -> "CraftingGraph":
+        """
+            Load the crafting graph of the whole catalogue with four queries.
+        """
+        names = dict(ModuleAssembly.objects.values_list('line_id', 'name'))
+
+        return cls._load(names, ModuleGrade.objects.filter(module_assembly__isnull=False))
+
+    @classmethod
+    def _load(cls, names: dict, grades) -> "CraftingGraph":
+        result = cls()
+        for assembly_id, name in names.items():
+            result.add_assembly(assembly_id, name)
+
+        grade_keys = dict()
+        seen = set()
+        for grade_id, assembly_id, grade, mind, time in grades.order_by('pk') \
+                .values_list('pk', 'module_assembly_id', 'grade', 'mind', 'time'):
+            node = result.add_grade(assembly_id, grade, mind, time)
+            # only the row that won add_grade() contributes parts, duplicates are ignored
+            if node.key not in seen:
+                seen.add(node.key)
+                grade_keys[grade_id] = node.key
+
+        resources = ModuleGradeResource.objects.filter(parent_grade__in=grades, resource__isnull=False) \
+            .order_by('pk').values_list('parent_grade_id', 'resource__name', 'quantity')
+        for grade_id, name, quantity in resources:
+            if grade_id in grade_keys:
+                result.add_resource(*grade_keys[grade_id], name, quantity)
+
+        sub_assemblies = ModuleGradeSubAssembly.objects.filter(parent_grade__in=grades, assembly__isnull=False) \
+            .order_by('pk').values_list('parent_grade_id', 'assembly_id', 'grade', 'quantity')
+        for grade_id, sub_assembly_id, sub_grade, quantity in sub_assemblies:
+            if grade_id in grade_keys:
+                result.add_sub_assembly(*grade_keys[grade_id], sub_assembly_id, sub_grade, quantity)
+
+        return result
+
+
+class PartsListCache:
+    """
+        Expanded parts lists are stored per (blueprint, grade) in ModuleAssemblyPartsList, stamped with the
+        blueprint's last_update_date and parts_revision. A stored list is used as long as both match; editing
+        anything in a blueprint's tree gives that blueprint and every blueprint above it a new parts_revision and
+        deletes their stored lists (see signals.py). A list expanded while such an edit was under way is not stored,
+        since the revision it was read under is no longer current by the time it would be written.
+        A blueprint without grades stores a single empty Ungraded row, so it isn't expanded again on every read.
+    """
+
+    @staticmethod
+    def to_bill(parts_list: ModuleAssemblyPartsList, name: str = '') -> BillOfMaterials:
+        result = BillOfMaterials(name, Grade(parts_list.grade))
+        result.mind = parts_list.mind
+        result.time = parts_list.time
+        for resource_name, quantity in parts_list.resources:
+            result.add_resource(resource_name, quantity)
+
+        return result
+
+    @staticmethod
+    def is_empty_marker(parts_list: ModuleAssemblyPartsList) -> bool:
+        return parts_list.grade == Grade.Ungraded and len(parts_list.resources) == 0 and parts_list.mind == 0 \
+            and parts_list.time == 0
+
+    @staticmethod
+    def get_many(assemblies, raise_loops: bool = False) -> dict:
+        """
+            Read the parts lists of several blueprints at once, expanding and storing the ones that are missing or
+            out of date in a single batch.
+
+        :param assemblies: ModuleAssembly instances
+        :param raise_loops: raise CraftingLoopError instead of leaving a looping blueprint without a parts list
+        :return: a dictionary of line_id to a dictionary of Grade to BillOfMaterials
+        """
+        assemblies = {assembly.line_id: assembly for assembly in assemblies}
+        result = {line_id: dict() for line_id in assemblies}
+        if len(assemblies) == 0:
+            return result
+
+        stale = set(assemblies.keys())
+        for parts_list in ModuleAssemblyPartsList.objects.filter(module_assembly_id__in=assemblies.keys()):
+            assembly = assemblies[parts_list.module_assembly_id]
+            if parts_list.version == assembly.last_update_date and parts_list.revision == assembly.parts_revision:
+                if not PartsListCache.is_empty_marker(parts_list):
+                    result[assembly.line_id][Grade(parts_list.grade)] = PartsListCache.to_bill(parts_list,
+                                                                                                assembly.name)
+                stale.discard(assembly.line_id)
+
+        if len(stale) == 0:
+            return result
+
+        revisions = dict(ModuleAssembly.objects.filter(pk__in=stale).values_list('line_id', 'parts_revision'))
+        graph = CraftingGraph.load(stale)
+        rows = []
+        for line_id in stale:
+            try:
+                bills = graph.flatten(line_id)
+            except CraftingLoopError:
+                if raise_loops:
+                    raise
+                continue
+
+            result[line_id] = bills
+            if len(bills) == 0:
+                rows.append(ModuleAssemblyPartsList(module_assembly_id=line_id, grade=Grade.Ungraded,
+                                                    version=assemblies[line_id].last_update_date,
+                                                    revision=revisions.get(line_id)))
+            for grade, bill in bills.items():
+                rows.append(ModuleAssemblyPartsList(module_assembly_id=line_id, grade=grade,
+                                                    resources=list(bill.resources.items()), mind=bill.mind,
+                                                    time=bill.time, version=assemblies[line_id].last_update_date,
+                                                    revision=revisions.get(line_id)))
+
+        with transaction.atomic():
+            # locking the blueprints waits out an invalidate() under way, then only the lists expanded under the
+            # revision still current are written
+            current = dict(ModuleAssembly.objects.select_for_update().filter(pk__in=stale)
+                           .values_list('line_id', 'parts_revision'))
+            stale = [line_id for line_id in stale if current.get(line_id) == revisions.get(line_id)]
+            rows = [row for row in rows if row.module_assembly_id in stale]
+
+            ModuleAssemblyPartsList.objects.filter(module_assembly_id__in=stale).delete()
+            ModuleAssemblyPartsList.objects.bulk_create(rows, update_conflicts=True,
+                                                        unique_fields=['module_assembly', 'grade'],
+                                                        update_fields=['resources', 'mind', 'time', 'version',
+                                                                       'revision'])
+
+        return result
+
+    @staticmethod
+    def get(assembly: ModuleAssembly) -> dict:
+        return PartsListCache.get_many([assembly], raise_loops=True)[assembly.line_id]
+
+    @staticmethod
+    def invalidate(assembly_ids):
+        """
+            Forget the stored parts lists of the given blueprints and of every blueprint that depends on them, and
+            give those blueprints a new parts_revision, so a list being expanded meanwhile is not stored.
+
+        :return: the line_ids of the blueprints whose parts lists were forgotten
+        """
+        assembly_ids = [assembly_id for assembly_id in assembly_ids if assembly_id is not None]
+        if len(assembly_ids) == 0:
+            return []
+
+        dependents = CraftingGraph.get_dependent_assemblies(assembly_ids)
+        ModuleAssembly.objects.filter(pk__in=dependents.keys()).update(parts_revision=uuid.uuid4())
+        ModuleAssemblyPartsList.objects.filter(module_assembly_id__in=dependents.keys()).delete()
+
+        return list(dependents.keys())
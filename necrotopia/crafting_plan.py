@@ -0,0 +1,219 @@
+from django.utils.translation import gettext as _translate
+
+from necrotopia.crafting import CraftingGraph, CraftingLoopError
+from necrotopia.models import Grade, WalletItem, WalletResource
+
+
+class WalletInventory:
+    def __init__(self, wallet_id: int = None):
+        self.wallet_id = wallet_id
+        self.resources = dict()
+        self.items = dict()
+
+    def add_resource(self, name: str, quantity: int):
+        self.resources[name] = self.resources.get(name, 0) + quantity
+
+    def add_item(self, assembly_id: int, grade: int, quantity: int):
+        key = (assembly_id, int(grade))
+        self.items[key] = self.items.get(key, 0) + quantity
+
+    def get_item_count(self, assembly_id: int) -> int:
+        return sum(quantity for (item_assembly_id, grade), quantity in self.items.items()
+                   if item_assembly_id == assembly_id)
+
+    @staticmethod
+    def load_many(wallet_ids) -> dict:
+        """
+            Read the contents of several wallets with two queries.
+
+        :return: a dictionary of wallet id to WalletInventory
+        """
+        result = {wallet_id: WalletInventory(wallet_id) for wallet_id in wallet_ids}
+
+        resources = WalletResource.objects.filter(wallet_link_id__in=result.keys()) \
+            .values_list('wallet_link_id', 'resource_link__name', 'quantity')
+        for wallet_id, name, quantity in resources:
+            result[wallet_id].add_resource(name, quantity)
+
+        items = WalletItem.objects.filter(wallet_link_id__in=result.keys()) \
+            .values_list('wallet_link_id', 'module_link_id', 'grade', 'quantity')
+        for wallet_id, assembly_id, grade, quantity in items:
+            result[wallet_id].add_item(assembly_id, grade, quantity)
+
+        return result
+
+    @staticmethod
+    def load(wallet_id: int) -> "WalletInventory":
+        return WalletInventory.load_many([wallet_id])[wallet_id]
+
+
+class CraftingStep:
+    def __init__(self, assembly_id: int, name: str, grade: Grade, count: int, mind: int, time: int):
+        self.assembly_id = assembly_id
+        self.name = name
+        self.grade = grade
+        self.count = count
+        self.mind = mind
+        self.time = time
+
+    def get_grade_name(self) -> str:
+        return Grade(self.grade).name
+
+    def __str__(self):
+        return "{count}x {name} ({grade})".format(count=self.count, name=self.name, grade=self.get_grade_name())
+
+
+class CraftingPlan:
+    def __init__(self):
+        self.steps = []
+        self.used_items = dict()
+        self.used_resources = dict()
+        self.missing = dict()
+        self.mind = 0
+        self.time = 0
+
+    @property
+    def can_build(self) -> bool:
+        return len(self.missing) == 0
+
+
+class CraftingPlanner:
+    """
+        Plans how a wallet can produce a blueprint grade. Owned sub-assemblies are used before anything is crafted,
+        starting from the top of the tree: an owned item saves its whole sub-tree, so handing items out parent
+        before child never crafts anything that an owned item already covers, and the remaining crafts are the
+        cheapest in mind and time. The crafting order and direct requirements of each target are worked out once
+        and shared by every wallet planned against the same graph.
+    """
+
+    def __init__(self, graph: CraftingGraph):
+        self.graph = graph
+        self._orders = dict()
+        self._children = dict()
+
+    @classmethod
+    def load(cls, assembly_ids) -> "CraftingPlanner":
+        return cls(CraftingGraph.load(assembly_ids))
+
+    def get_children(self, key: tuple) -> list:
+        """
+            The crafted sub-assemblies of a blueprint grade, and the blueprints without grades it uses as parts.
+        """
+        result = self._children.get(key)
+        if result is None:
+            result = [((sub_assembly_id, self.graph.resolve_grade(sub_assembly_id, sub_grade)), quantity)
+                      for sub_assembly_id, sub_grade, quantity in self.graph.nodes[key].sub_assemblies]
+            self._children[key] = result
+
+        return result
+
+    def get_order(self, root: tuple) -> list:
+        """
+            Every blueprint grade reachable from root, each one listed before the sub-assemblies it needs.
+        """
+        result = self._orders.get(root)
+        if result is not None:
+            return result
+
+        result = []
+        active = set()
+        finished = set()
+        stack = [(root, False)]
+        while len(stack) > 0:
+            key, children_done = stack.pop()
+            if key in finished:
+                continue
+
+            if children_done:
+                active.discard(key)
+                finished.add(key)
+                result.append(key)
+                continue
+
+            active.add(key)
+            stack.append((key, True))
+            for child, quantity in self.get_children(key):
+                if child[1] is None or child in finished:
+                    continue
+                if child in active:
+                    raise CraftingLoopError(
+                        _translate('{name} requires itself to be crafted').format(
+                            name=self.graph.names.get(child[0], child[0])))
+                stack.append((child, False))
+
+        result.reverse()
+        self._orders[root] = result
+
+        return result
+
+    def plan(self, inventory: WalletInventory, assembly_id: int, grade: int, quantity: int = 1) -> CraftingPlan:
+        result = CraftingPlan()
+        root = (assembly_id, self.graph.resolve_grade(assembly_id, int(grade)))
+        if root[1] is None:
+            result.missing[self.graph.names.get(assembly_id, '')] = quantity
+            return result
+
+        demand = {root: quantity}
+        needed = dict()
+        parts = dict()
+
+        for key in self.get_order(root):
+            wanted = demand.get(key, 0)
+            if wanted == 0:
+                continue
+
+            owned = inventory.items.get(key, 0)
+            used = min(owned, wanted)
+            if used > 0:
+                result.used_items[key] = used
+
+            crafted = wanted - used
+            if crafted == 0:
+                continue
+
+            node = self.graph.nodes[key]
+            result.steps.append(CraftingStep(key[0], self.graph.names.get(key[0], ''), Grade(key[1]), crafted,
+                                             node.mind * crafted, node.time * crafted))
+            result.mind += node.mind * crafted
+            result.time += node.time * crafted
+
+            for name, amount in node.resources:
+                needed[name] = needed.get(name, 0) + amount * crafted
+
+            for child, amount in self.get_children(key):
+                if child[1] is None:
+                    # a blueprint without grades can't be crafted, it is a part the wallet has to hold
+                    parts[child[0]] = parts.get(child[0], 0) + amount * crafted
+                else:
+                    demand[child] = demand.get(child, 0) + amount * crafted
+
+        for name, amount in needed.items():
+            owned = inventory.resources.get(name, 0)
+            if owned > 0:
+                result.used_resources[name] = min(owned, amount)
+            if amount > owned:
+                result.missing[name] = amount - owned
+
+        for part_assembly_id, amount in parts.items():
+            owned = inventory.get_item_count(part_assembly_id)
+            if owned > 0:
+                result.used_items[(part_assembly_id, Grade.Ungraded)] = min(owned, amount)
+            if amount > owned:
+                name = self.graph.names.get(part_assembly_id, '')
+                result.missing[name] = result.missing.get(name, 0) + amount - owned
+
+        # craft from the bottom of the tree up
+        result.steps.reverse()
+
+        return result
+
+    def plan_many(self, wallet_ids, assembly_id: int, grade: int, quantity: int = 1) -> dict:
+        """
+            Plan the same blueprint grade for several wallets with a fixed number of queries.
+
+        :return: a dictionary of wallet id to CraftingPlan
+        """
+        inventories = WalletInventory.load_many(wallet_ids)
+
+        return {wallet_id: self.plan(inventory, assembly_id, grade, quantity)
+                for wallet_id, inventory in inventories.items()}
@@ -0,0 +1,135 @@
+import hashlib
+
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpRequest, HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.safestring import mark_safe
+
+from necrotopia.caching import get_media_timeout
+from necrotopia.models import ModuleAssembly, ResourceItem, Rule, SkillItem
+
+
+class CatalogueFragment:
+    """
+        The rendered content of a catalogue page, without the parts of the page that depend on who is looking.
+    """
+
+    def __init__(self, title: str, html: str, stamp, warning: str = ''):
+        self.title = title
+        self.html = html
+        self.stamp = stamp
+        self.warning = warning
+        self.digest = hashlib.md5(html.encode('utf-8')).hexdigest()
+
+    @property
+    def Html(self) -> str:
+        return mark_safe(self.html)
+
+    def __str__(self):
+        return self.title
+
+
+class FragmentCache:
+    """
+        The rendered content of the rule, skill, resource and blueprint pages, cached per object and stamped with
+        the object's fragment_stamp, which every save moves. A fragment is used as long as its stamp matches. signals.py moves the stamp of everything an edit shows up on, so a fragment cached by
+        any process is rendered again, and also drops the fragments from the cache.
+
+        Pages served from a fragment carry an ETag and the stamp as their Last-Modified date, so a browser
+        revalidating the page gets a 304 until the fragment changes.
+    """
+
+    key_prefix = 'necrotopia.fragment'
+
+    # one day, shortened to the life of signed media URLs when the storage signs them
+    timeout = 60 * 60 * 24
+
+    # cached model and the name of its pages
+    sources = {
+        ModuleAssembly: 'blueprint',
+        Rule: 'rule',
+        SkillItem: 'skill',
+        ResourceItem: 'resource',
+    }
+
+    @staticmethod
+    def get_key(model, pk) -> str:
+        return '{prefix}.{item_type}.{pk}'.format(prefix=FragmentCache.key_prefix,
+                                                  item_type=FragmentCache.sources[model], pk=pk)
+
+    @staticmethod
+    def get(model, pk, render) -> CatalogueFragment:
+        """
+            The cached fragment of a row, rendered again when it is missing or its stamp is out of date.
+
+        :param render: a callable taking the primary key and returning the title, html and warning of the fragment
+        :return: a CatalogueFragment; raises model.DoesNotExist when there is no such row
+        """
+        stamp = model.objects.filter(pk=pk).values_list('fragment_stamp', flat=True).get()
+        key = FragmentCache.get_key(model, pk)
+
+        fragment = cache.get(key)
+        if fragment is not None and fragment.stamp == stamp:
+            return fragment
+        if fragment is not None:
+            cache.delete(key)
+
+        def render_fragment():
+            title, html, warning = render(pk)
+
+            return CatalogueFragment(title, html, stamp, warning)
+
+        return cache.get_or_set(key, render_fragment, get_media_timeout(FragmentCache.timeout))
+
+    @staticmethod
+    def touch(model, pks):
+        """
+            Move the stamp of the given rows to now, for an edit of something their pages show that is not saved
+            with them, so the fragments cached for them by any process are rendered again. The dates shown in the
+            admin are left to real edits of the rows.
+        """
+        pks = [pk for pk in pks if pk is not None]
+        if len(pks) > 0:
+            model.objects.filter(pk__in=pks).update(fragment_stamp=timezone.now())
+
+    @staticmethod
+    def purge(model, pks):
+        cache.delete_many([FragmentCache.get_key(model, pk) for pk in pks if pk is not None])
+
+    @staticmethod
+    def get_etag(request: HttpRequest, fragment: CatalogueFragment) -> str:
+        """
+            The fragment's digest combined with what the rest of the page shows of the user.
+        """
+        user = request.user
+        viewer = 'anonymous' if user.is_anonymous else '{pk}:{email}:{staff}'.format(pk=user.pk, email=user.email,
+                                                                                    staff=user.is_staff)
+        value = hashlib.md5('{digest}:{viewer}'.format(digest=fragment.digest, viewer=viewer).encode('utf-8'))
+
+        return '"{etag}"'.format(etag=value.hexdigest())
+
+    @staticmethod
+    def get_not_modified(request: HttpRequest, fragment: CatalogueFragment):
+        """
+        :return: a 304 response when the browser already has this page, otherwise None
+        """
+        # a page carrying messages has to be rendered for them to be shown
+        if len(messages.get_messages(request)) > 0:
+            return None
+
+        response = get_conditional_response(request, etag=FragmentCache.get_etag(request, fragment),
+                                            last_modified=int(fragment.stamp.timestamp()))
+        if response is not None:
+            FragmentCache.set_headers(request, response, fragment)
+
+        return response
+
+    @staticmethod
+    def set_headers(request: HttpRequest, response: HttpResponse, fragment: CatalogueFragment):
+        response['ETag'] = FragmentCache.get_etag(request, fragment)
+        response['Last-Modified'] = http_date(fragment.stamp.timestamp())
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie',))
@@ -0,0 +1,124 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.files.base import ContentFile
+from django.dispatch import Signal
+
+from necrotopia.tools import ImageTool
+
+# sent by the render_images job, which stores the renditions of an image without saving its row, with the instance
+# the renditions belong to
+renditions_ready = Signal()
+
+
+class ResponsiveImage:
+    """
+        The URLs a template needs to show an uploaded image at the right size: srcset lists of the WebP renditions
+        and of their JPEG or PNG fallbacks, and src, the card sized fallback for browsers without srcset. Until its
+        renditions are made, an image is shown from its original file.
+    """
+
+    def __init__(self, src: str, srcset: str = '', webp_srcset: str = ''):
+        self.src = src
+        self.srcset = srcset
+        self.webp_srcset = webp_srcset
+
+    @staticmethod
+    def get(image, renditions: dict):
+        """
+        :param image: the FieldFile of the original image
+        :param renditions: the renditions of the image, as made by ImagePipeline.process
+        """
+        if not image:
+            return ResponsiveImage('')
+
+        items = renditions.get('items', []) if renditions.get('source') == image.name else []
+        if len(items) == 0:
+            return ResponsiveImage(image.url)
+
+        storage = image.storage
+        fallbacks = [(item, storage.url(item['fallback'])) for item in items]
+        src = next((url for item, url in fallbacks if item['rendition'] == 'card'), fallbacks[-1][1])
+
+        return ResponsiveImage(src, ', '.join('{url} {width}w'.format(url=url, width=item['width'])
+                                              for item, url in fallbacks),
+                               ', '.join('{url} {width}w'.format(url=storage.url(item['webp']), width=item['width'])
+                                         for item in items))
+
+    def __str__(self):
+        return self.src
+
+
+class ImagePipeline:
+    """
+        Makes the renditions of an uploaded image off the request, in the render_images job. The renditions are
+        encoded in a pool of worker processes, one rendition per process, and stored next to the original.
+    """
+
+    # name, and the box each rendition is scaled down to fit
+    renditions = (
+        ('thumbnail', 320, 320),
+        ('card', 800, 800),
+        ('full', 1920, 1920),
+    )
+
+    quality = 80
+
+    max_workers = len(renditions)
+
+    _pool = None
+
+    @staticmethod
+    def get_pool() -> ProcessPoolExecutor:
+        if ImagePipeline._pool is None:
+            ImagePipeline._pool = ProcessPoolExecutor(max_workers=ImagePipeline.max_workers)
+
+        return ImagePipeline._pool
+
+    @staticmethod
+    def get_rendition_name(source: str, rendition: str, extension: str) -> str:
+        return '{root}.{rendition}.{extension}'.format(root=os.path.splitext(source)[0], rendition=rendition,
+                                                      extension=extension)
+
+    @staticmethod
+    def render(data: bytes) -> list:
+        """
+        :return: the output of ImageTool.render_rendition for each rendition, in order
+        """
+        arguments = ([data] * len(ImagePipeline.renditions), [width for _, width, _ in ImagePipeline.renditions],
+                     [height for _, _, height in ImagePipeline.renditions],
+                     [ImagePipeline.quality] * len(ImagePipeline.renditions))
+        try:
+            return list(ImagePipeline.get_pool().map(ImageTool.render_rendition, *arguments))
+        except BrokenProcessPool:
+            # a worker died, start over with a new pool once
+            ImagePipeline._pool = None
+            return list(ImagePipeline.get_pool().map(ImageTool.render_rendition, *arguments))
+
+    def process(self, storage, source: str) -> dict:
+        """
+            Make and store the renditions of the image stored as source. A rendition as large as the one before it,
+            because the original is small, is left out.
+
+        :return: the renditions, to be kept with the image
+        """
+        with storage.open(source, 'rb') as original:
+            data = original.read()
+
+        items = []
+        for (rendition, _, _), output in zip(ImagePipeline.renditions, ImagePipeline.render(data)):
+            if len(items) > 0 and items[-1]['width'] >= output['width']:
+                continue
+
+            items.append({
+                'rendition': rendition,
+                'width': output['width'],
+                'height': output['height'],
+                'webp': storage.save(ImagePipeline.get_rendition_name(source, rendition, 'webp'),
+                                     ContentFile(output['webp'])),
+                'fallback': storage.save(ImagePipeline.get_rendition_name(source, rendition, output['extension']),
+                                         ContentFile(output['fallback'])),
+            })
+
+        return {'source': source, 'items': items}
@@ -0,0 +1,202 @@
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.db import transaction
+from django.utils import timezone
+
+from necrotopia.images import ImagePipeline, renditions_ready
+from necrotopia.mail import send_activation_email
+from necrotopia.models import BackgroundJob, ItemPdf, JobStatus, UserProfile
+from necrotopia.printing import PrintPack
+from necrotopia.tags import TagQuery
+
+
+class JobQueue:
+    """
+        A queue of long admin actions kept in the BackgroundJob table and run by the run_jobs worker. Workers claim
+        the oldest queued job with SELECT ... FOR UPDATE SKIP LOCKED, so any number of them can share the queue
+        without a broker and without two of them taking the same job. A running job records a heartbeat as it
+        makes progress; a job whose worker stopped beating is queued again, up to max_attempts times.
+    """
+
+    handlers = dict()
+
+    max_attempts = 3
+
+    @staticmethod
+    def register(kind: str):
+        """
+            Decorates the function running the jobs of a kind. It is called with the BackgroundJob and returns the
+            message to show when the job is done.
+        """
+        def decorator(handler):
+            JobQueue.handlers[kind] = handler
+            return handler
+
+        return decorator
+
+    @staticmethod
+    def enqueue(kind: str, arguments: dict, user: UserProfile = None, total: int = 0) -> BackgroundJob:
+        if kind not in JobQueue.handlers:
+            raise KeyError('No job handler is registered for "{kind}"'.format(kind=kind))
+
+        return BackgroundJob.objects.create(kind=kind, arguments=arguments, total=total,
+                                            requested_by=user if user is not None and user.is_authenticated else None)
+
+    @staticmethod
+    def claim():
+        """
+        :return: the oldest queued job, now marked as running, or None when there is nothing to do
+        """
+        with transaction.atomic():
+            job = BackgroundJob.objects.select_for_update(skip_locked=True).filter(status=JobStatus.Queued) \
+                .order_by('id').first()
+            if job is None:
+                return None
+
+            now = timezone.now()
+            job.status = JobStatus.Running
+            job.attempts += 1
+            job.started_date = now
+            job.heartbeat_date = now
+            job.save(update_fields=['status', 'attempts', 'started_date', 'heartbeat_date'])
+
+        return job
+
+    @staticmethod
+    def set_progress(job: BackgroundJob, progress: int, total: int = None):
+        job.progress = progress
+        job.total = job.total if total is None else total
+        job.heartbeat_date = timezone.now()
+        # not once the job was taken over after this worker was taken for stopped
+        BackgroundJob.objects.filter(pk=job.pk, attempts=job.attempts).update(
+            progress=job.progress, total=job.total, heartbeat_date=job.heartbeat_date)
+
+    @staticmethod
+    def run(job: BackgroundJob) -> BackgroundJob:
+        try:
+            job.message = JobQueue.handlers[job.kind](job) or ''
+            job.status = JobStatus.Done
+        except Exception as error:
+            job.message = '{name}: {error}'.format(name=type(error).__name__, error=error)
+            job.status = JobStatus.Failed
+
+        job.finished_date = timezone.now()
+        # a job queued again by requeue_stale while it ran belongs to its next attempt, which records its own result
+        finished = BackgroundJob.objects.filter(pk=job.pk, attempts=job.attempts, status=JobStatus.Running).update(
+            status=job.status, message=job.message, result=job.result, finished_date=job.finished_date)
+        if finished == 0:
+            job.refresh_from_db()
+
+        return job
+
+    @staticmethod
+    def requeue_stale(max_age: timedelta) -> int:
+        """
+            Queue again the running jobs whose worker has not reported progress for max_age, or fail them once
+            they have been tried max_attempts times.
+
+        :return: the number of stale jobs found
+        """
+        stale = BackgroundJob.objects.filter(status=JobStatus.Running, heartbeat_date__lt=timezone.now() - max_age)
+        failed = stale.filter(attempts__gte=JobQueue.max_attempts).update(
+            status=JobStatus.Failed, finished_date=timezone.now(), message='The worker running this job stopped')
+
+        return failed + stale.update(status=JobStatus.Queued)
+
+    @staticmethod
+    def work(max_jobs: int = None, poll: float = 1.0, stop=None, until_empty: bool = False,
+             stale_after: timedelta = None, on_stale=None) -> int:
+        """
+            Run queued jobs until max_jobs have been run or stop() returns True, waiting poll seconds whenever the
+            queue is empty; with until_empty, return as soon as the queue is empty instead.
+
+        :param stale_after: queue again the jobs of stopped workers, see requeue_stale, when starting and then every
+            half of stale_after between jobs
+        :param on_stale: called with the number of stale jobs, when there were any
+        :return: the number of jobs run
+        """
+        done = 0
+        next_requeue = time.monotonic()
+        while max_jobs is None or done < max_jobs:
+            if stop is not None and stop():
+                break
+
+            if stale_after is not None and time.monotonic() >= next_requeue:
+                stale = JobQueue.requeue_stale(stale_after)
+                if stale > 0 and on_stale is not None:
+                    on_stale(stale)
+                next_requeue = time.monotonic() + stale_after.total_seconds() / 2
+
+            job = JobQueue.claim()
+            if job is None:
+                if until_empty:
+                    break
+                time.sleep(poll)
+                continue
+
+            JobQueue.run(job)
+            done += 1
+
+        return done
+
+
+@JobQueue.register('print_pdfs')
+def print_pdfs(job: BackgroundJob) -> str:
+    # the job points at the pack rather than a copy of it; packs are never overwritten
+    job.result.name = PrintPack().get(job.arguments['assembly_ids'],
+                                      on_progress=lambda done, total: JobQueue.set_progress(job, done, total))
+
+    return 'Printed {count} blueprints'.format(count=len(job.arguments['assembly_ids']))
+
+
+@JobQueue.register('bulk_tagging')
+def bulk_tagging(job: BackgroundJob) -> str:
+    model = apps.get_model(job.arguments['model'])
+    pks = job.arguments['pks']
+    changed = TagQuery.set_tags(model.objects.filter(pk__in=pks), job.arguments['tags'], job.arguments['replace'])
+    JobQueue.set_progress(job, len(pks), len(pks))
+
+    return 'Changed tags on {count} items'.format(count=len(changed))
+
+
+@JobQueue.register('resend_registration_email')
+def resend_registration_email(job: BackgroundJob) -> str:
+    users = list(UserProfile.objects.filter(pk__in=job.arguments['user_ids']).order_by('pk'))
+    # a job queued again after its worker stopped carries on after the users whose email was already queued
+    for index, user in enumerate(users[job.progress:], start=job.progress):
+        with transaction.atomic():
+            send_activation_email(job.arguments['domain'], user)
+            JobQueue.set_progress(job, index + 1, len(users))
+
+    return 'Registration email queued for {count} users'.format(count=len(users))
+
+
+@JobQueue.register('render_images')
+def render_images(job: BackgroundJob) -> str:
+    model = apps.get_model(job.arguments['model'])
+    instance = model.objects.filter(pk=job.arguments['pk']).first()
+    if instance is None or not instance.get_image_file() or instance.has_renditions():
+        return 'Nothing to render'
+
+    image = instance.get_image_file()
+    instance.renditions = ImagePipeline().process(image.storage, image.name)
+    # the row is updated rather than saved so this does not queue itself again, and only while it still has this image
+    model.objects.filter(pk=instance.pk, **{instance.image_field: image.name}).update(renditions=instance.renditions)
+    renditions_ready.send(sender=model, instance=instance)
+
+    return 'Rendered {count} sizes of {name}'.format(count=len(instance.renditions['items']), name=image.name)
+
+
+@JobQueue.register('set_pdf_digest')
+def set_pdf_digest(job: BackgroundJob) -> str:
+    item = ItemPdf.objects.filter(pk=job.arguments['pk']).first()
+    if item is None or not item.pdf or item.digest != '':
+        return 'Nothing to read'
+
+    item.set_digest()
+    # only while the row still points at the file that was read
+    ItemPdf.objects.filter(pk=item.pk, pdf=item.pdf.name).update(digest=item.digest)
+
+    return 'Read {name}'.format(name=item.pdf.name)
@@ -0,0 +1,179 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from necrotopia.models import JobStatus, OutboundEmail
+from necrotopia.token import account_activation_token
+
+
+class MailQueue:
+    """
+        Outbound mail, rendered when it is queued and sent later by the send_queued_mail command, so a request only
+        pays for an INSERT. The sender keeps one connection to the mail server open across batches, paces itself to
+        EMAIL_QUEUE_RATE messages a second, and retries a failed message with an exponential backoff.
+
+        Messages are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several senders can share the queue.
+    """
+
+    # how long a claimed message is left to its sender before it is queued again
+    lease = timedelta(minutes=10)
+
+    @staticmethod
+    def get_setting(name: str, default):
+        return getattr(settings, name, default)
+
+    @staticmethod
+    def enqueue(subject: str, body: str, to: list, content_subtype: str = 'html',
+                from_email: str = '') -> OutboundEmail:
+        return OutboundEmail.objects.create(subject=subject, body=body, to=list(to), content_subtype=content_subtype,
+                                            from_email=from_email)
+
+    @staticmethod
+    def get_message(email: OutboundEmail, connection=None) -> EmailMessage:
+        message = EmailMessage(email.subject, email.body, from_email=email.from_email or None, to=email.to,
+                               connection=connection)
+        message.content_subtype = email.content_subtype
+
+        return message
+
+    @staticmethod
+    def get_retry_delay(attempts: int) -> timedelta:
+        return timedelta(seconds=MailQueue.get_setting('EMAIL_QUEUE_RETRY_DELAY', 60) * 2 ** (attempts - 1))
+
+    @staticmethod
+    def get_batch_size(rate: float) -> int:
+        """
+            EMAIL_QUEUE_BATCH_SIZE, cut down when pacing at rate messages a second would not send a whole batch
+            within half the lease, so no message is queued again by another sender while it is still waiting here.
+        """
+        batch_size = MailQueue.get_setting('EMAIL_QUEUE_BATCH_SIZE', 100)
+        if rate > 0:
+            batch_size = min(batch_size, int(MailQueue.lease.total_seconds() * rate / 2))
+
+        return max(1, batch_size)
+
+    @staticmethod
+    def claim(batch_size: int) -> list:
+        """
+        :return: up to batch_size due messages, now marked as being sent, oldest first
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            emails = list(OutboundEmail.objects.select_for_update(skip_locked=True)
+                          .filter(status=JobStatus.Queued, next_attempt_date__lte=now).order_by('id')[:batch_size])
+            OutboundEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+                status=JobStatus.Running, attempts=F('attempts') + 1, next_attempt_date=now + MailQueue.lease)
+
+        for email in emails:
+            email.status = JobStatus.Running
+            email.attempts += 1
+
+        return emails
+
+    @staticmethod
+    def requeue_stale() -> int:
+        """
+            Queue again the messages whose sender stopped before reporting on them.
+        """
+        return OutboundEmail.objects.filter(status=JobStatus.Running, next_attempt_date__lt=timezone.now()) \
+            .update(status=JobStatus.Queued)
+
+    @staticmethod
+    def set_sent(email: OutboundEmail):
+        email.status = JobStatus.Done
+        email.sent_date = timezone.now()
+        email.last_error = ''
+        email.save(update_fields=['status', 'sent_date', 'last_error'])
+
+    @staticmethod
+    def set_failed(email: OutboundEmail, error: Exception):
+        email.last_error = '{name}: {error}'.format(name=type(error).__name__, error=error)
+        if email.attempts >= MailQueue.get_setting('EMAIL_QUEUE_MAX_ATTEMPTS', 5):
+            email.status = JobStatus.Failed
+        else:
+            email.status = JobStatus.Queued
+            email.next_attempt_date = timezone.now() + MailQueue.get_retry_delay(email.attempts)
+        email.save(update_fields=['status', 'last_error', 'next_attempt_date'])
+
+    @staticmethod
+    def send_pending(connection=None, until_empty: bool = False, poll: float = 1.0, stop=None) -> int:
+        """
+            Send queued messages over one connection until stop() returns True, waiting poll seconds whenever
+            nothing is due; with until_empty, return as soon as nothing is due instead.
+
+        :return: the number of messages sent
+        """
+        connection = get_connection() if connection is None else connection
+        rate = MailQueue.get_setting('EMAIL_QUEUE_RATE', 0)
+        interval = 1.0 / rate if rate > 0 else 0.0
+        batch_size = MailQueue.get_batch_size(rate)
+
+        sent = 0
+        next_send = time.monotonic()
+        try:
+            while stop is None or not stop():
+                emails = MailQueue.claim(batch_size)
+                if len(emails) == 0:
+                    if until_empty:
+                        break
+                    time.sleep(poll)
+                    continue
+
+                for email in emails:
+                    wait = next_send - time.monotonic()
+                    if wait > 0:
+                        time.sleep(wait)
+                    next_send = max(next_send, time.monotonic()) + interval
+
+                    try:
+                        # opens the connection when it is not open already, so it is set up once rather than per
+                        # message, and again after an error closed it
+                        connection.open()
+                        if connection.send_messages([MailQueue.get_message(email, connection)]) != 1:
+                            raise RuntimeError('The message was not accepted')
+                    except Exception as error:
+                        connection.close()
+                        MailQueue.set_failed(email, error)
+                        continue
+
+                    MailQueue.set_sent(email)
+                    sent += 1
+        finally:
+            connection.close()
+
+        return sent
+
+    @staticmethod
+    def purge(max_age: timedelta) -> int:
+        """
+            Forget the messages sent more than max_age ago.
+        """
+        deleted, _ = OutboundEmail.objects.filter(status=JobStatus.Done,
+                                                  sent_date__lt=timezone.now() - max_age).delete()
+
+        return deleted
+
+
+def send_activation_email(domain: str, user):
+    """
+        Queue the activation email of a user, it is sent by the send_queued_mail command.
+    """
+    mail_subject = 'Activation link has been sent to your specified email'
+    message = render_to_string('registration/activation_email.html',
+                               {
+                                   'user': user,
+                                   'domain': domain,
+                                   'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+                                   'token': account_activation_token.make_token(user),
+                               })
+
+    to_email = user.email
+    MailQueue.enqueue(mail_subject, message, [to_email])
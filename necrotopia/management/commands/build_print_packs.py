@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from necrotopia.models import ItemPdf
+from necrotopia.printing import PrintPack
+
+
+class Command(BaseCommand):
+    help = 'Print the blueprint PDFs of each crafting tree, item type and of every published blueprint ahead of time'
+
+    def handle(self, *args, **options):
+        # files uploaded before digests were kept are read once
+        missing = ItemPdf.objects.filter(digest='').exclude(pdf='').exclude(pdf__isnull=True)
+        for item in missing:
+            item.set_digest()
+            item.save(update_fields=['digest'])
+
+        printer = PrintPack()
+        for title, assembly_ids in PrintPack.get_packs().items():
+            name = printer.get(assembly_ids)
+            self.stdout.write(self.style.SUCCESS('{title}: {count} blueprints in {name}'.format(
+                title=title, count=len(assembly_ids), name=name)))
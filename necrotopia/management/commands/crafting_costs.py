@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from necrotopia.cost_matrix import CraftingCostMatrix
+from necrotopia.crafting import CraftingLoopError
+
+
+class Command(BaseCommand):
+    help = 'Export the raw resources, mind and time needed for every grade of every blueprint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+        parser.add_argument('--output', help='file to write to, the console when omitted (csv only)')
+
+    def handle(self, *args, **options):
+        if options['format'] == 'parquet' and not options['output']:
+            raise CommandError('Parquet exports need an --output file')
+
+        try:
+            matrix = CraftingCostMatrix.build()
+        except CraftingLoopError as error:
+            raise CommandError(str(error))
+
+        if options['format'] == 'parquet':
+            matrix.write_parquet(options['output'])
+        elif options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                matrix.write_csv(output)
+        else:
+            matrix.write_csv(self.stdout)
+
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS('Wrote {count} blueprint grades to {output}'.format(
+                count=len(matrix.nodes), output=options['output'])))
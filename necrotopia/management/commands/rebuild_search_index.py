@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from necrotopia.search import SearchIndex
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search vectors of every searchable row'
+
+    def handle(self, *args, **options):
+        for model, count in SearchIndex.rebuild().items():
+            self.stdout.write(self.style.SUCCESS('Indexed {count} {name}'.format(
+                count=count, name=model._meta.verbose_name_plural)))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from necrotopia.jobs import JobQueue
+from necrotopia.models import Advertisement, ItemCardFace, ItemPicture, RulePicture
+
+
+class Command(BaseCommand):
+    help = 'Queue the making of the renditions of every uploaded image that has none yet'
+
+    def handle(self, *args, **options):
+        for model in (Advertisement, ItemCardFace, ItemPicture, RulePicture):
+            count = 0
+            for instance in model.objects.exclude(**{model.image_field: ''}):
+                if not instance.has_renditions():
+                    JobQueue.enqueue('render_images', {'model': model._meta.label_lower, 'pk': instance.pk})
+                    count += 1
+
+            self.stdout.write(self.style.SUCCESS('Queued {count} {name}'.format(
+                count=count, name=model._meta.verbose_name_plural)))
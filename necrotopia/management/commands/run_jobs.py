@@ -0,0 +1,32 @@
+import signal
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from necrotopia.jobs import JobQueue
+
+
+class Command(BaseCommand):
+    help = 'Run the background jobs queued by the admin actions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the queued jobs, then exit')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help='Seconds without progress before a running job is queued again')
+
+    def handle(self, *args, **options):
+        # finish the running job before stopping on SIGTERM
+        stopping = []
+        previous = signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+
+        def on_stale(count: int):
+            self.stdout.write(self.style.WARNING('Found {count} stale jobs'.format(count=count)))
+
+        try:
+            done = JobQueue.work(poll=options['poll'], stop=lambda: len(stopping) > 0, until_empty=options['once'],
+                                 stale_after=timedelta(seconds=options['stale_after']), on_stale=on_stale)
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+
+        self.stdout.write(self.style.SUCCESS('Ran {count} jobs'.format(count=done)))
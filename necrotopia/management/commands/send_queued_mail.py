@@ -0,0 +1,31 @@
+import signal
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from necrotopia.mail import MailQueue
+
+
+class Command(BaseCommand):
+    help = 'Send the queued outbound mail'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Send the messages due now, then exit')
+        parser.add_argument('--poll', type=float, default=5.0, help='Seconds to wait when nothing is due')
+        parser.add_argument('--keep-days', type=int, default=30, help='Days to keep sent messages for')
+
+    def handle(self, *args, **options):
+        # finish the batch being sent before stopping on SIGTERM
+        stopping = []
+        previous = signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+
+        try:
+            MailQueue.requeue_stale()
+            MailQueue.purge(timedelta(days=options['keep_days']))
+
+            sent = MailQueue.send_pending(until_empty=options['once'], poll=options['poll'],
+                                          stop=lambda: len(stopping) > 0)
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+
+        self.stdout.write(self.style.SUCCESS('Sent {count} messages'.format(count=sent)))
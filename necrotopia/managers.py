@@ -1,4 +1,7 @@
 from django.contrib.auth.base_user import BaseUserManager
+from django.db import models
+from django.db.models import Count, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.utils.translation import gettext as _translate
 
 
@@ -26,3 +29,73 @@ class CustomUserManager(BaseUserManager):
             raise ValueError(_translate('Superuser must have is_superuser set to true'))
 
         return self.create_user(email, password, **extra_fields)
+
+
+class TaggedQuerySet(models.QuerySet):
+    def tagged(self, tags, match_all: bool = False):
+        """
+            Rows tagged with any of the tags, or with all of them when match_all is set.
+
+        :param tags: a tag string as entered in a TagField, or a list of tag names or Tag objects
+        """
+        from necrotopia.tags import TagQuery
+
+        return TagQuery.filter(self, tags, match_all)
+
+
+class ModuleAssemblyQuerySet(TaggedQuerySet):
+    def with_media(self):
+        """
+            Annotate whether each blueprint has a picture and a PDF, see ModuleAssembly.has_image and has_pdf.
+        """
+        from necrotopia.models import ItemPdf, ItemPicture
+
+        return self.annotate(
+            picture_exists=Exists(ItemPicture.objects.filter(imd_assembly_item_id=OuterRef('pk'))),
+            pdf_exists=Exists(ItemPdf.objects.filter(pdf_assembly_item_id=OuterRef('pk'))))
+
+
+class WalletQuerySet(models.QuerySet):
+    @staticmethod
+    def get_count(model) -> Coalesce:
+        rows = model.objects.filter(wallet_link_id=OuterRef('pk')).order_by().values('wallet_link_id')
+
+        return Coalesce(Subquery(rows.annotate(count=Count('pk')).values('count')), Value(0))
+
+    def with_counts(self):
+        """
+            Annotate the number of resource and item rows in each wallet as resource_count and item_count.
+        """
+        from necrotopia.models import WalletItem, WalletResource
+
+        return self.annotate(resource_count=self.get_count(WalletResource), item_count=self.get_count(WalletItem))
+
+
+class ItemCardQuerySet(models.QuerySet):
+    def with_faces(self):
+        """
+            Annotate whether each card has a front and a back face, see ItemCard.has_front and has_back.
+        """
+        from necrotopia.models import CardSide, ItemCardFace
+
+        faces = ItemCardFace.objects.filter(img_parent_card_id=OuterRef('pk'))
+
+        return self.annotate(front_exists=Exists(faces.filter(card_side=CardSide.Front)),
+                             back_exists=Exists(faces.filter(card_side=CardSide.Back)))
+
+
+class SkillItemQuerySet(TaggedQuerySet):
+    def with_first_rating(self):
+        """
+            Annotate the description of each skill's lowest grade rating, see SkillItem.trunc_description.
+        """
+        from necrotopia.models import SkillRatings
+
+        ratings = SkillRatings.objects.filter(skill_id=OuterRef('pk')).order_by('grade', 'pk')
+
+        return self.annotate(first_rating_description=Subquery(ratings.values('description')[:1]))
+
+
+class RatedSkillItemQuerySet(models.QuerySet):
+    def with_skill(self):
+        return self.select_related('skill')
@@ -0,0 +1,234 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.base import File
+
+
+class CachedMediaFile(File):
+    """
+        A media file read from the local copy kept by MediaCache. Unlike a plain File it can be opened again after
+        it was closed, as a FieldFile expects of the files its storage opens, by calling reopen; the copy may have
+        been evicted meanwhile, so it is opened through the cache again rather than by its path.
+    """
+
+    def __init__(self, file, name: str, reopen):
+        super(CachedMediaFile, self).__init__(file, name)
+        self.reopen = reopen
+
+    def open(self, mode=None):
+        if not self.closed:
+            self.seek(0)
+        else:
+            self.file = self.reopen()
+
+        return self
+
+
+class MediaCache:
+    """
+        A read-through cache on local disk of files kept in the object store, shared by every process of the host.
+        Files are stored once per content, under the sha256 of their bytes, so the same PDF or image stored under
+        several names takes the space of one copy. Each name remembers the ETag and digest of its content; after
+        revalidate_after seconds the next read asks the store whether the ETag still matches before using the copy.
+
+        One process fetches a given name at a time, the others wait on a file lock and read what it stored. The
+        names share 256 lock files, by the start of their digest, so the locks do not grow with the names read.
+        When the copies outgrow max_size, the least recently read are removed until they take 90% of it.
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, directory: str, max_size: int, revalidate_after: float):
+        self.directory = directory
+        self.max_size = max_size
+        self.revalidate_after = revalidate_after
+
+    @staticmethod
+    def get_default():
+        """
+        :return: the cache set up by MEDIA_CACHE_DIR and MEDIA_CACHE_MAX_SIZE, or None when it is turned off
+        """
+        max_size = getattr(settings, 'MEDIA_CACHE_MAX_SIZE', 0)
+        directory = getattr(settings, 'MEDIA_CACHE_DIR', '')
+        if max_size <= 0 or not directory:
+            return None
+
+        return MediaCache(directory, max_size, getattr(settings, 'MEDIA_CACHE_REVALIDATE', 60))
+
+    @staticmethod
+    def get_key_digest(key: str) -> str:
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get_path(self, *parts) -> str:
+        path = os.path.join(self.directory, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        return path
+
+    def get_blob_path(self, digest: str) -> str:
+        return self.get_path('blobs', digest[:2], digest)
+
+    @staticmethod
+    def get_lock_name(key: str) -> str:
+        return 'names-{bucket}'.format(bucket=MediaCache.get_key_digest(key)[:2])
+
+    def get_entry_path(self, key: str) -> str:
+        key_digest = MediaCache.get_key_digest(key)
+
+        return self.get_path('entries', key_digest[:2], key_digest + '.json')
+
+    @contextmanager
+    def lock(self, name: str, blocking: bool = True):
+        """
+            Hold the lock file called name, across threads and processes. Without blocking, yield False instead of
+            waiting when another holds it.
+        """
+        with open(self.get_path('locks', name), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_entry(self, key: str):
+        try:
+            with open(self.get_entry_path(key), 'r') as entry_file:
+                return json.load(entry_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def set_entry(self, key: str, entry: dict):
+        path = self.get_entry_path(key)
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), delete=False) as entry_file:
+            json.dump(entry, entry_file)
+        os.replace(entry_file.name, path)
+
+    def forget(self, key: str):
+        """
+            Stop using the copy of key, when it was written or deleted through this host.
+        """
+        try:
+            os.remove(self.get_entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def open_blob(self, entry: dict):
+        """
+        :return: the copy of the content of entry opened for reading, or None when it was evicted
+        """
+        path = self.get_blob_path(entry['digest'])
+        try:
+            blob = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+
+        # the modification time is the last read, which eviction goes by
+        os.utime(path)
+
+        return blob
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry['checked'] < self.revalidate_after
+
+    def open(self, key: str, fetch):
+        """
+            Open the copy of key, fetching it first when there is none or it has changed.
+
+        :param fetch: called with the ETag of the copy, or None when there is none; returns None when the copy is
+            still current, or the ETag and a readable stream of the content in the store
+        :return: the copy, opened for reading
+        """
+        entry = self.get_entry(key)
+        if entry is not None and self.is_fresh(entry):
+            blob = self.open_blob(entry)
+            if blob is not None:
+                return blob
+
+        with self.lock(MediaCache.get_lock_name(key)):
+            # another process may have fetched it while this one waited
+            entry = self.get_entry(key)
+            blob = self.open_blob(entry) if entry is not None else None
+            if blob is not None and self.is_fresh(entry):
+                return blob
+
+            result = fetch(entry['etag'] if blob is not None else None)
+            if result is None:
+                entry['checked'] = time.time()
+                self.set_entry(key, entry)
+                return blob
+
+            if blob is not None:
+                blob.close()
+            etag, stream = result
+            digest, blob = self.store(stream)
+            self.set_entry(key, {'etag': etag, 'digest': digest, 'checked': time.time()})
+
+        self.evict()
+
+        return blob
+
+    def store(self, stream) -> tuple:
+        """
+            Copy stream into the cache.
+
+        :return: the digest the copy is kept under, and the copy opened for reading; it is opened before it is
+            put in place, so it stays readable if another process evicts it straight away
+        """
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(self.get_path('tmp', 'blob')),
+                                         delete=False) as blob:
+            try:
+                for chunk in iter(lambda: stream.read(MediaCache.chunk_size), b''):
+                    digest.update(chunk)
+                    blob.write(chunk)
+            except BaseException:
+                os.remove(blob.name)
+                raise
+
+        copy = open(blob.name, 'rb')
+        # the same content may be stored already, under another name
+        os.replace(blob.name, self.get_blob_path(digest.hexdigest()))
+
+        return digest.hexdigest(), copy
+
+    def evict(self):
+        """
+            Remove the least recently read copies while the copies take more than max_size. A copy removed while
+            it is being read stays readable to its reader.
+        """
+        with self.lock('evict', blocking=False) as locked:
+            if not locked:
+                return
+
+            blobs = []
+            for root, _, names in os.walk(os.path.join(self.directory, 'blobs')):
+                for name in names:
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except FileNotFoundError:
+                        continue
+                    blobs.append((stat.st_mtime_ns, stat.st_size, os.path.join(root, name)))
+
+            total = sum(size for _, size, _ in blobs)
+            if total <= self.max_size:
+                return
+
+            for _, size, path in sorted(blobs):
+                if total <= self.max_size * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -1,3 +1,5 @@
+import hashlib
+import uuid
 from datetime import timedelta
 from enum import IntEnum
 from typing import TypedDict, cast
@@ -5,6 +7,8 @@ from typing import TypedDict, cast
 import PIL
 from django.contrib.auth.models import AbstractBaseUser, AbstractUser, Group, Permission, User, \
     PermissionsMixin
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
 from django.core.mail import send_mail
 from django.core.validators import EmailValidator, MinValueValidator, MaxValueValidator
@@ -16,10 +20,14 @@ from django.utils.safestring import mark_safe
 from django.utils.translation import gettext as _translate
 from django_resized import ResizedImageField
 from imagekit.models import ImageSpecField, ProcessedImageField
-from imagekit.processors import ResizeToFill
+from imagekit.cachefiles.backends import CacheFileState
+from imagekit.processors import ResizeToFill, ResizeToFit
 from tagging.fields import TagField
 
-from necrotopia.managers import CustomUserManager
+from necrotopia.images import ResponsiveImage
+from necrotopia.managers import CustomUserManager, ItemCardQuerySet, ModuleAssemblyQuerySet, RatedSkillItemQuerySet, \
+    SkillItemQuerySet, TaggedQuerySet, WalletQuerySet
+from necrotopia.storage_backends import PrivateMediaStorage
 from necrotopia.tools import ImageTool
 
 USERNAME_FIELD = 'email'
@@ -128,6 +136,20 @@ class SkillCategory(IntEnum):
         return [(key.value, key.name) for key in cls]
 
 
+class JobStatus(IntEnum):
+    Queued = 0
+    Running = 1
+    Done = 2
+    Failed = 3
+
+    def __str__(self):
+        return str(self.name)
+
+    @classmethod
+    def choices(cls):
+        return [(key.value, key.name) for key in cls]
+
+
 class Title(models.Model):
     descriptor = models.CharField(max_length=30, blank=False, null=False)
 
@@ -247,10 +269,15 @@ class ResourceItem(models.Model):
     expiration_units = models.SmallIntegerField(default=6, blank=True, null=True)
     time_units = models.IntegerField(choices=TimeUnits.choices(), default=TimeUnits.months)
     registry_date = models.DateTimeField('registry_date', default=timezone.now)
+    modified_date = models.DateTimeField('modified_date', auto_now=True)
+    fragment_stamp = models.DateTimeField('fragment_stamp', auto_now=True)
     registrar = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     rated_skills = models.ForeignKey('RatedSkillItem', on_delete=models.CASCADE, null=True, blank=True,
                                      related_name='related_skills')
     tags = TagField()
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+
+    objects = TaggedQuerySet.as_manager()
 
     def get_expiration(self):
         if self.expiration_units == 0 or self.time_units == TimeUnits.No_Expiration:
@@ -275,6 +302,11 @@ class ResourceItem(models.Model):
 
     class Meta:
         ordering = ['name']
+        indexes = (
+            GinIndex(fields=['search_vector'], name='resource_search_vector'),
+            GinIndex(fields=['name'], name='resource_name_trigram', opclasses=['gin_trgm_ops']),
+            models.Index(fields=['name', 'id'], name='resource_name_keyset'),
+        )
         verbose_name = 'Resource'
         verbose_name_plural = 'Resources'
 
@@ -284,29 +316,54 @@ class SkillItem(models.Model):
     category = models.IntegerField(choices=sorted(SkillCategory.choices(), key=lambda x: x[1]),
                                    default=SkillCategory.Anomaly)
     registry_date = models.DateTimeField('registry_date', default=timezone.now)
+    modified_date = models.DateTimeField('modified_date', auto_now=True)
+    fragment_stamp = models.DateTimeField('fragment_stamp', auto_now=True)
     registrar = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     skill_ratings = models.ForeignKey('SkillRatings', on_delete=models.CASCADE, null=True, blank=True,
                                       related_name='skill_ratings')
 
     tags = TagField()
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+
+    objects = SkillItemQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
     class Meta:
         ordering = ['name', ]
+        indexes = (
+            GinIndex(fields=['search_vector'], name='skill_search_vector'),
+            GinIndex(fields=['name'], name='skill_name_trigram', opclasses=['gin_trgm_ops']),
+            models.Index(fields=['name', 'id'], name='skill_name_keyset'),
+        )
         verbose_name = 'Skill'
         verbose_name_plural = 'Skills'
 
     def get_item_type(self):
         return SkillCategory(self.category).name
 
+    def get_first_rating_description(self):
+        """
+            The description of the lowest grade rating, read from SkillItem.objects.with_first_rating() or prefetched
+            skillratings_set when available.
+        """
+        if hasattr(self, 'first_rating_description'):
+            return self.first_rating_description
+
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('skillratings_set')
+        if prefetched is not None:
+            first = min(prefetched, key=lambda rating: (rating.grade, rating.pk), default=None)
+        else:
+            first = self.skillratings_set.order_by('grade', 'pk').first()
+
+        return first.description if first is not None else None
+
     def trunc_description(self):
         result = ''
-        if self.skillratings_set is not None:
-            first = self.skillratings_set.first()
-            if first is not None:
-                result = "{description}...".format(description=first.description[:50])
+        description = self.get_first_rating_description()
+        if description is not None:
+            result = "{description}...".format(description=description[:50])
 
         return result
 
@@ -315,9 +372,13 @@ class SkillRatings(models.Model):
     grade = models.IntegerField(choices=Grade.choices(), default=Grade.Basic)
     skill = models.ForeignKey(SkillItem, on_delete=models.CASCADE, blank=False, null=False)
     description = models.CharField(max_length=3000, unique=False)
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['grade', ]
+        indexes = (
+            GinIndex(fields=['search_vector'], name='skill_rating_search_vector'),
+        )
         verbose_name = 'SkillRating'
         verbose_name_plural = 'SkillRatings'
 
@@ -333,20 +394,53 @@ class RatedSkillItem(models.Model):
     time = models.IntegerField(default=10, blank=True, null=True)
     one_use_per_game = models.BooleanField(default=False, blank=True, null=True)
 
+    objects = RatedSkillItemQuerySet.as_manager()
+
     def __str__(self):
+        # RatedSkillItem.objects.with_skill() selects the skill with the row, so this needs no query of its own
         x = Grade(self.grade).name
         return f'{x} {self.skill.name} [{self.mind} mind , {self.time} minutes]'
 
 
-class RulePicture(models.Model):
+class ResponsiveImageModel(models.Model):
+    """
+        A model with an uploaded image, named by image_field, shown through the renditions the render_images job
+        makes of it. See images.py.
+    """
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+
+    image_field = 'image'
+
+    class Meta:
+        abstract = True
+
+    def get_image_file(self):
+        return getattr(self, self.image_field)
+
+    def has_renditions(self) -> bool:
+        image = self.get_image_file()
+
+        return bool(image) and self.renditions.get('source') == image.name
+
+    def get_responsive_image(self) -> ResponsiveImage:
+        return ResponsiveImage.get(self.get_image_file(), self.renditions)
+
+
+class RulePicture(ResponsiveImageModel):
     picture = models.ImageField(upload_to='static_images')
     rule_item = models.ForeignKey('Rule', blank=False, null=False, on_delete=models.CASCADE,
                                   related_name='picture_rule')
 
+    # made the first time it is shown, see thumbnails.py
+    thumbnail = ImageSpecField(source='picture', processors=[ResizeToFill(300, 300)], format='JPEG',
+                               options={'quality': 80})
+
+    image_field = 'picture'
+
     def image_preview(self):
         if self.picture:
             return mark_safe(
-                '<a href="%s"><img src="%s" width="150" height="150" /></a>' % (self.picture.url, self.picture.url))
+                '<a href="%s"><img src="%s" width="150" height="150" /></a>' % (self.picture.url, self.thumbnail.url))
         else:
             return '(No image)'
 
@@ -360,10 +454,21 @@ class Rule(models.Model):
     slug = models.CharField(max_length=255, unique=False, blank=True, null=True)
     text = models.CharField(max_length=2048, unique=False, blank=True, null=True)
     last_update_date = models.DateTimeField('last_update_date', default=timezone.now)
+    fragment_stamp = models.DateTimeField('fragment_stamp', auto_now=True)
     registration_date = models.DateTimeField('registration_date', default=timezone.now)
     registrar = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     pictures = models.ForeignKey(RulePicture, blank=True, null=True, on_delete=models.CASCADE, related_name='pictures')
     tags = TagField()
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+
+    objects = TaggedQuerySet.as_manager()
+
+    class Meta:
+        indexes = (
+            GinIndex(fields=['search_vector'], name='rule_search_vector'),
+            GinIndex(fields=['name'], name='rule_name_trigram', opclasses=['gin_trgm_ops']),
+            models.Index(fields=['name', 'id'], name='rule_name_keyset'),
+        )
 
     def __str__(self):
         return self.name
@@ -376,17 +481,43 @@ class ItemPdf(models.Model):
     pdf = models.FileField(upload_to='pdf/', null=True, blank=True)
     pdf_assembly_item = models.ForeignKey('ModuleAssembly', blank=False, null=False, on_delete=models.CASCADE,
                                           related_name='pdf_picture_ModuleAssembly')
-
-
-class ItemPicture(models.Model):
+    # sha256 of the file, set when a file is uploaded; print packs are named after the digests of their sources
+    digest = models.CharField(max_length=64, blank=True, default='', editable=False)
+
+    def set_digest(self):
+        if not self.pdf:
+            self.digest = ''
+            return
+
+        value = hashlib.sha256()
+        self.pdf.open('rb')
+        try:
+            for chunk in self.pdf.chunks():
+                value.update(chunk)
+        finally:
+            # an upload is about to be saved to storage, a stored file was opened just for this
+            if self.pdf._committed:
+                self.pdf.close()
+            else:
+                self.pdf.seek(0)
+        self.digest = value.hexdigest()
+
+
+class ItemPicture(ResponsiveImageModel):
     picture = models.ImageField(upload_to='static_images')
     imd_assembly_item = models.ForeignKey('ModuleAssembly', blank=False, null=False, on_delete=models.CASCADE,
                                           related_name='img_picture_ModuleAssembly')
 
+    # made the first time it is shown, see thumbnails.py
+    thumbnail = ImageSpecField(source='picture', processors=[ResizeToFill(300, 300)], format='JPEG',
+                               options={'quality': 80})
+
+    image_field = 'picture'
+
     def image_preview(self):
         if self.picture:
             return mark_safe(
-                '<a href="%s"><img src="%s" width="150" height="150" /></a>' % (self.picture.url, self.picture.url))
+                '<a href="%s"><img src="%s" width="150" height="150" /></a>' % (self.picture.url, self.thumbnail.url))
         else:
             return '(No image)'
 
@@ -459,6 +590,7 @@ class ModuleAssembly(models.Model):
     details = models.CharField(blank=True, null=True, max_length=1000)
     registration_date = models.DateTimeField('registration_date', default=timezone.now)
     last_update_date = models.DateTimeField('last_update_date', default=timezone.now)
+    fragment_stamp = models.DateTimeField('fragment_stamp', auto_now=True)
     registrar = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     crafting_tree = models.CharField(max_length=100, unique=False, blank=True, null=True, default='Artisan')
     crafting_area = models.CharField(max_length=100, unique=False, blank=True, null=True,
@@ -470,23 +602,34 @@ class ModuleAssembly(models.Model):
     checked = models.BooleanField(default=False)
     module_grades = models.ForeignKey(ModuleGrade, on_delete=models.CASCADE, blank=True, null=True,
                                       related_name='moduleGrade_grades')
+    # replaced whenever anything in the blueprint's tree changes, see PartsListCache
+    parts_revision = models.UUIDField(default=uuid.uuid4, editable=False)
 
     tags = TagField()
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
 
-    def flatten(self):
-        result = dict()
-        grades = ModuleGrade.objects.filter(module_assembly_id=self.line_id)
+    objects = ModuleAssemblyQuerySet.as_manager()
 
-        if grades is not None:
-            for grade in grades:
-                pass
+    def flatten(self) -> dict:
+        """
+            Expand every grade of this blueprint into its raw resources, total mind and total time.
 
-        return result
+        :return: a dictionary of Grade to BillOfMaterials
+        """
+        from necrotopia.crafting import CraftingGraph
+
+        return CraftingGraph.load([self.line_id]).flatten(self.line_id)
 
     def has_image(self):
+        if hasattr(self, 'picture_exists'):
+            return self.picture_exists
+
         return ItemPicture.objects.filter(imd_assembly_item__line_id__exact=self.pk).first() is not None
 
     def has_pdf(self):
+        if hasattr(self, 'pdf_exists'):
+            return self.pdf_exists
+
         return ItemPdf.objects.filter(pdf_assembly_item_id__exact=self.pk).first() is not None
 
     def get_item_type(self):
@@ -505,10 +648,40 @@ class ModuleAssembly(models.Model):
         return self.name
 
     class Meta:
+        indexes = (
+            GinIndex(fields=['search_vector'], name='blueprint_search_vector'),
+            GinIndex(fields=['name'], name='blueprint_name_trigram', opclasses=['gin_trgm_ops']),
+            models.Index(fields=['name', 'line_id'], name='blueprint_name_keyset'),
+        )
         verbose_name = 'Blueprint'
         verbose_name_plural = 'Blueprints'
 
 
+class ModuleAssemblyPartsList(models.Model):
+    module_assembly = models.ForeignKey(ModuleAssembly, on_delete=models.CASCADE, blank=False, null=False,
+                                        related_name='parts_lists')
+    grade = models.IntegerField(choices=Grade.choices(), default=Grade.Basic)
+    resources = models.JSONField(default=list, blank=True)
+    mind = models.IntegerField(default=0)
+    time = models.IntegerField(default=0)
+    version = models.DateTimeField('version', default=timezone.now)
+    revision = models.UUIDField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['grade', ]
+        constraints = (
+            models.UniqueConstraint(fields=('module_assembly', 'grade'), name='unique_parts_list_grade'),
+        )
+        verbose_name = 'Parts List'
+        verbose_name_plural = 'Parts Lists'
+
+    def get_grade_name(self):
+        return Grade(self.grade).name
+
+    def __str__(self):
+        return "{blueprint} ({grade})".format(blueprint=self.module_assembly_id, grade=self.get_grade_name())
+
+
 class LootTableItem(models.Model):
     item_name = models.CharField(max_length=255, unique=True)
     probability = models.FloatField(null=False, blank=False,
@@ -539,7 +712,7 @@ class LootTable(models.Model):
         return self.name
 
 
-class Advertisement(models.Model):
+class Advertisement(ResponsiveImageModel):
     name = models.CharField(max_length=60, default='', blank=True)
     slug = models.TextField(max_length=100, default='', blank=True)
     link = models.URLField(max_length=1000, default='', blank=True, null=True)
@@ -550,11 +723,36 @@ class Advertisement(models.Model):
     registry_date = models.DateTimeField('registry_date', default=timezone.now)
     registrar = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
 
+    thumbnail = ImageSpecField(source='image', processors=[ResizeToFill(300, 150)], format='JPEG',
+                               options={'quality': 80}, cachefile_strategy='necrotopia.thumbnails.OnSaveOrFirstUse')
+    # shown by the carousel until the renditions of the image are made; made when the image is saved, see thumbnails.py
+    carousel = ImageSpecField(source='image', processors=[ResizeToFit(1600, 900, upscale=False)], format='JPEG',
+                              options={'quality': 80}, cachefile_strategy='necrotopia.thumbnails.OnSave')
+
     def __str__(self):
         return self.name
 
+    def has_carousel(self) -> bool:
+        # known from the cache or the ThumbnailFile table, without asking the storage
+        carousel = self.carousel
+
+        return carousel.cachefile_backend.get_state(carousel, check_if_unknown=False) == CacheFileState.EXISTS
+
+    def get_responsive_image(self) -> ResponsiveImage:
+        if self.image and not self.has_renditions() and self.has_carousel():
+            return ResponsiveImage(self.carousel.url)
+
+        return super(Advertisement, self).get_responsive_image()
+
+    def image_preview(self):
+        if self.image:
+            return mark_safe(
+                '<a href="%s"><img src="%s" width="300" height="150" /></a>' % (self.image.url, self.thumbnail.url))
+        else:
+            return '(No image)'
+
     def is_active(self) -> bool:
-        today = timezone.now().date()
+        today = timezone.localdate()
 
         return self.start_date <= today <= self.end_date and self.published
 
@@ -595,19 +793,24 @@ class Wallet(models.Model):
     creation_date = models.DateTimeField(default=timezone.now, null=False)
     items = models.ForeignKey(WalletItem, null=True, on_delete=models.CASCADE)
 
+    objects = WalletQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
 
-class ItemCardFace(models.Model):
+class ItemCardFace(ResponsiveImageModel):
     card_side = models.IntegerField(choices=CardSide.choices(), default=CardSide.Front)
     image = models.ImageField(upload_to='item_card_faces')
     img_parent_card = models.ForeignKey("ItemCard", blank=False, null=False, on_delete=models.CASCADE, related_name='img_image_parent_card')
 
+    thumbnail = ImageSpecField(source='image', processors=[ResizeToFill(400, 300)], format='JPEG',
+                               options={'quality': 80})
+
     def image_preview(self):
         if self.image:
             return mark_safe(
-                '<a href="%s"><img src="%s" width="200" height="150" /></a>' % (self.image.url, self.image.url))
+                '<a href="%s"><img src="%s" width="200" height="150" /></a>' % (self.image.url, self.thumbnail.url))
         else:
             return '(No image)'
 
@@ -624,10 +827,18 @@ class ItemCard(models.Model):
     registry_date = models.DateTimeField('registry_date', default=timezone.now)
     registrar = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
 
+    objects = ItemCardQuerySet.as_manager()
+
     def has_front(self):
+        if hasattr(self, 'front_exists'):
+            return self.front_exists
+
         return self.has_facing(CardSide.Front)
 
     def has_back(self):
+        if hasattr(self, 'back_exists'):
+            return self.back_exists
+
         return self.has_facing(CardSide.Back)
 
     def has_facing(self, card_side: CardSide) -> bool:
@@ -638,3 +849,90 @@ class ItemCard(models.Model):
 
     def __str__(self):
         return "{card_type} Card".format(card_type=ComponentType(self.item_type).name)
+
+
+class BackgroundJob(models.Model):
+    """
+        A long admin action run by the run_jobs worker instead of inside the admin request. See jobs.py.
+    """
+    kind = models.CharField(max_length=60)
+    arguments = models.JSONField(default=dict, blank=True)
+    status = models.IntegerField(choices=JobStatus.choices(), default=JobStatus.Queued)
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    message = models.TextField(default='', blank=True)
+    result = models.FileField(upload_to='jobs/', storage=PrivateMediaStorage, blank=True, null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    requested_by = models.ForeignKey(UserProfile, blank=True, null=True, on_delete=models.SET_NULL)
+    created_date = models.DateTimeField(default=timezone.now)
+    started_date = models.DateTimeField(blank=True, null=True)
+    heartbeat_date = models.DateTimeField(blank=True, null=True)
+    finished_date = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-created_date']
+        indexes = (
+            models.Index(fields=['status', 'id'], name='background_job_queue'),
+        )
+        verbose_name = 'Background Job'
+        verbose_name_plural = 'Background Jobs'
+
+    def __str__(self):
+        return '{kind} #{pk}'.format(kind=self.kind, pk=self.pk)
+
+    def get_status(self):
+        return JobStatus(self.status).name
+
+    def is_finished(self) -> bool:
+        return self.status in (JobStatus.Done, JobStatus.Failed)
+
+    def get_percent(self) -> int:
+        if self.status == JobStatus.Done:
+            return 100
+        if self.total == 0:
+            return 0
+
+        return min(int(100 * self.progress / self.total), 100)
+
+
+class OutboundEmail(models.Model):
+    """
+        A rendered message waiting to be sent, or sent, by the send_queued_mail command. See mail.py.
+    """
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    content_subtype = models.CharField(max_length=20, default='html')
+    from_email = models.CharField(max_length=254, blank=True, default='')
+    to = models.JSONField(default=list)
+    status = models.IntegerField(choices=JobStatus.choices(), default=JobStatus.Queued)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(default='', blank=True)
+    created_date = models.DateTimeField(default=timezone.now)
+    # when a queued message is due, or when a message being sent is given up on as its sender having stopped
+    next_attempt_date = models.DateTimeField(default=timezone.now)
+    sent_date = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = (
+            models.Index(fields=['status', 'next_attempt_date'], name='outbound_email_queue'),
+        )
+        verbose_name = 'Outbound Email'
+        verbose_name_plural = 'Outbound Emails'
+
+    def __str__(self):
+        return '{subject} to {to}'.format(subject=self.subject, to=', '.join(self.to))
+
+    def get_status(self):
+        return JobStatus(self.status).name
+
+
+class ThumbnailFile(models.Model):
+    """
+        A generated thumbnail known to be in storage, so whether it exists outlives the cache. See thumbnails.py.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    created_date = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,95 @@
+import base64
+import binascii
+import json
+
+from django.db.models import QuerySet
+from django.http import QueryDict
+
+
+class KeysetPage:
+    def __init__(self, items: list, next_cursor: str = None, previous_cursor: str = None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class KeysetPaginator:
+    """
+        Seek pagination ordered by name then primary key. A page starts right after (or ends right before) the
+        (name, pk) of a row named by an opaque cursor in the URL, so every page is a short index range scan no
+        matter how deep it is, and pages stay stable while rows are added or removed around them.
+    """
+
+    def __init__(self, queryset: QuerySet, page_size: int = 50):
+        self.queryset = queryset
+        self.page_size = page_size
+
+    @staticmethod
+    def encode_cursor(row) -> str:
+        value = json.dumps([row.name, row.pk], separators=(',', ':')).encode('utf-8')
+
+        return base64.urlsafe_b64encode(value).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor: str):
+        """
+        :return: the (name, pk) a cursor points at, or None when it is missing or malformed
+        """
+        if not cursor:
+            return None
+
+        try:
+            name, pk = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+            return None
+
+        if not isinstance(name, str) or not isinstance(pk, int):
+            return None
+
+        return name, pk
+
+    def get_page(self, parameters: QueryDict) -> KeysetPage:
+        """
+            The page after the 'after' cursor, before the 'before' cursor, or the first page when neither is given.
+        """
+        after = self.decode_cursor(parameters.get('after'))
+        before = self.decode_cursor(parameters.get('before')) if after is None else None
+
+        if before is not None:
+            name, pk = before
+            rows = list(self.queryset.filter(name__lte=name).exclude(name=name, pk__gte=pk)
+                        .order_by('-name', '-pk')[:self.page_size + 1])
+            has_previous = len(rows) > self.page_size
+            items = list(reversed(rows[:self.page_size]))
+            has_next = True
+        else:
+            queryset = self.queryset
+            if after is not None:
+                name, pk = after
+                queryset = queryset.filter(name__gte=name).exclude(name=name, pk__lte=pk)
+
+            rows = list(queryset.order_by('name', 'pk')[:self.page_size + 1])
+            has_next = len(rows) > self.page_size
+            items = rows[:self.page_size]
+            has_previous = after is not None
+
+        if len(items) == 0:
+            return KeysetPage(items)
+
+        return KeysetPage(items,
+                          self.encode_cursor(items[-1]) if has_next else None,
+                          self.encode_cursor(items[0]) if has_previous else None)
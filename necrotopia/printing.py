@@ -0,0 +1,328 @@
+import hashlib
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tempfile import SpooledTemporaryFile
+
+from django.core.files import File
+from pypdf import PdfReader, PdfWriter
+from pypdf.errors import PyPdfError
+from pypdf.generic import ArrayObject, DictionaryObject, EncodedStreamObject, IndirectObject, StreamObject
+
+from necrotopia.models import BackgroundJob, ComponentType, ItemPdf, ModuleAssembly
+
+
+class PdfDeduplicator:
+    """
+        Blueprint PDFs are printed from the same few templates, so every source file embeds its own copy of the
+        same fonts and background images. This points every page at one copy of each identical font and XObject,
+        then copies the pages into a new writer, which only takes the objects they still refer to.
+
+        Only pypdf's public API is used, so the copies nothing refers to are left behind rather than blanked out of
+        the writer holding them.
+    """
+
+    resource_types = ('/Font', '/XObject')
+
+    def __init__(self, writer: PdfWriter):
+        self.writer = writer
+        self._digests = dict()
+
+    @staticmethod
+    def get_stream_data(stream: StreamObject) -> bytes:
+        """
+            The decoded data of a stream, or None when pypdf cannot decode it.
+        """
+        try:
+            data = stream.get_data()
+        except (NotImplementedError, PyPdfError):
+            return None
+        finally:
+            if isinstance(stream, EncodedStreamObject):
+                # get_data keeps a decoded copy on the stream, which is not needed once it is digested
+                stream.decoded_self = None
+
+        return data if isinstance(data, bytes) else data.encode('latin-1')
+
+    def get_digest(self, obj) -> str:
+        """
+            A digest of an object and everything it refers to, so copies of a font from different source files,
+            which have different object numbers, get the same digest.
+        """
+        return self._get_digest(obj, [])[0]
+
+    def _get_digest(self, obj, path: list) -> tuple:
+        """
+            A reference back to an object on path, the objects the walk is inside of, is counted by how many steps
+            back it points. The digest of an object referring back above itself depends on where the walk entered
+            the cycle, so it is not kept for other walks.
+
+        :return: the digest, and the lowest position on path the object refers back to, or None
+        """
+        if isinstance(obj, IndirectObject):
+            if obj.idnum in self._digests:
+                return self._digests[obj.idnum], None
+            if obj.idnum in path:
+                position = path.index(obj.idnum)
+                return 'cycle:{steps}'.format(steps=len(path) - position), position
+
+            path.append(obj.idnum)
+            digest, back = self._get_digest(obj.get_object(), path)
+            path.pop()
+            if back is None or back >= len(path):
+                self._digests[obj.idnum] = digest
+                back = None
+
+            return digest, back
+
+        backs = []
+        value = hashlib.sha256(type(obj).__name__.encode('utf-8'))
+        if isinstance(obj, DictionaryObject):
+            for key in sorted(obj.keys()):
+                if key in ('/Length', '/Filter', '/DecodeParms'):
+                    continue
+                digest, back = self._get_digest(obj.raw_get(key), path)
+                value.update(key.encode('utf-8'))
+                value.update(digest.encode('ascii'))
+                backs.append(back)
+            if isinstance(obj, StreamObject):
+                data = PdfDeduplicator.get_stream_data(obj)
+                # a stream that cannot be decoded is only ever equal to itself
+                value.update(data if data is not None else 'stream:{id}'.format(id=id(obj)).encode('ascii'))
+        elif isinstance(obj, ArrayObject):
+            for item in obj:
+                digest, back = self._get_digest(item, path)
+                value.update(digest.encode('ascii'))
+                backs.append(back)
+        else:
+            value.update(repr(obj).encode('utf-8'))
+
+        backs = [back for back in backs if back is not None]
+
+        return value.hexdigest(), min(backs) if len(backs) > 0 else None
+
+    def deduplicate(self) -> int:
+        """
+        :return: the number of references pointed at another copy
+        """
+        canonical = dict()
+        replaced = 0
+        for page in self.writer.pages:
+            resources = page.get('/Resources')
+            if resources is None:
+                continue
+
+            resources = resources.get_object()
+            for resource_type in PdfDeduplicator.resource_types:
+                if resource_type not in resources:
+                    continue
+
+                entries = resources[resource_type].get_object()
+                for name in list(entries.keys()):
+                    reference = entries.raw_get(name)
+                    if not isinstance(reference, IndirectObject):
+                        continue
+
+                    first = canonical.setdefault(self.get_digest(reference), reference)
+                    if first.idnum != reference.idnum:
+                        entries[name] = first
+                        replaced += 1
+
+        return replaced
+
+    def compact(self) -> PdfWriter:
+        """
+            A new writer with the pages of this one and only the objects they refer to.
+        """
+        result = PdfWriter()
+        for page in self.writer.pages:
+            result.add_page(page)
+
+        return result
+
+
+class ProgressFile:
+    """
+        Passes writes on to file, calling on_write at most every interval seconds while they go on, so a long write
+        still reports that it is alive.
+    """
+
+    def __init__(self, file, on_write, interval: float):
+        self.file = file
+        self.on_write = on_write
+        self.interval = interval
+        self.next_call = time.monotonic() + interval
+
+    def write(self, data):
+        if time.monotonic() >= self.next_call:
+            self.on_write()
+            self.next_call = time.monotonic() + self.interval
+
+        return self.file.write(data)
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+
+class PdfPrinter:
+    """
+        Merges the PDFs of blueprints into one document. The source files are downloaded concurrently by a small
+        thread pool into temporary files, and the merged document is written to a temporary file, so neither the
+        source files nor the output file are held in memory whole.
+
+        The pages themselves are: pypdf's PdfWriter keeps every page copied into it, with the fonts and images
+        they use, in memory until the document is written, and the duplicate fonts and images until they are
+        deduplicated. A print takes memory in proportion to the size of its sources.
+    """
+
+    max_workers = 4
+
+    # files smaller than this stay in memory, larger ones roll over to disk
+    spool_size = 8 * 1024 * 1024
+
+    # seconds between progress reports while the document is written
+    write_interval = 10
+
+    def __init__(self, storage=None, max_workers: int = None):
+        self.storage = ItemPdf._meta.get_field('pdf').storage if storage is None else storage
+        self.max_workers = PdfPrinter.max_workers if max_workers is None else max_workers
+
+    @staticmethod
+    def get_pdf_sources(assembly_ids) -> list:
+        """
+        :return: the name and digest of the PDFs of the given blueprints, in the order of the blueprints
+        """
+        positions = {assembly_id: position for position, assembly_id in enumerate(assembly_ids)}
+        pdfs = ItemPdf.objects.filter(pdf_assembly_item_id__in=positions.keys()).exclude(pdf='') \
+            .exclude(pdf__isnull=True).values_list('pdf_assembly_item_id', 'pk', 'pdf', 'digest')
+
+        return [(name, digest) for _, _, name, digest in sorted(pdfs, key=lambda row: (positions[row[0]], row[1]))]
+
+    @staticmethod
+    def get_pdf_names(assembly_ids) -> list:
+        """
+        :return: the names of the PDFs of the given blueprints, in the order of the blueprints
+        """
+        return [name for name, _ in PdfPrinter.get_pdf_sources(assembly_ids)]
+
+    def fetch(self, name: str) -> SpooledTemporaryFile:
+        result = SpooledTemporaryFile(max_size=PdfPrinter.spool_size)
+        with self.storage.open(name, 'rb') as source:
+            shutil.copyfileobj(source, result)
+        result.seek(0)
+
+        return result
+
+    def merge(self, names, on_progress=None) -> SpooledTemporaryFile:
+        """
+        :param on_progress: called with the number of steps done and the number of steps, a step being a source
+            file fetched, a source file merged or the document written; it is also called again every
+            write_interval seconds while the document is written
+        :return: the merged document, positioned at its start
+        """
+        steps = 2 * len(names) + 1
+        done = 0
+
+        def report():
+            if on_progress is not None:
+                on_progress(done, steps)
+
+        writer = PdfWriter()
+        futures = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(self.fetch, name) for name in names]
+                for _ in as_completed(futures):
+                    done += 1
+                    report()
+            sources = [future.result() for future in futures]
+
+            for source in sources:
+                for page in PdfReader(source).pages:
+                    writer.add_page(page)
+                done += 1
+                report()
+
+            deduplicator = PdfDeduplicator(writer)
+            deduplicator.deduplicate()
+            writer = deduplicator.compact()
+
+            result = SpooledTemporaryFile(max_size=PdfPrinter.spool_size)
+            writer.write(ProgressFile(result, report, PdfPrinter.write_interval))
+            result.seek(0)
+            done += 1
+            report()
+        finally:
+            # every fetch has finished by now; when one of them failed, the others are closed all the same
+            for future in futures:
+                if not future.cancelled() and future.exception() is None:
+                    future.result().close()
+            writer.close()
+
+        return result
+
+
+class PrintPack:
+    """
+        A merged, deduplicated print of a set of blueprints, kept in private media storage under a name made from the
+        digests of its source files. Printing the same files again, in the same order, costs one lookup of that name
+        instead of downloading and parsing every source; a changed file has a new digest, so its packs are simply
+        not found any more.
+
+        The packs printed for events, the published blueprints of each crafting tree, of each item type and all of
+        them, are built ahead of time by the build_print_packs command.
+    """
+
+    location = 'print_packs'
+
+    def __init__(self, storage=None, printer: PdfPrinter = None):
+        self.storage = BackgroundJob._meta.get_field('result').storage if storage is None else storage
+        self.printer = PdfPrinter() if printer is None else printer
+
+    @staticmethod
+    def get_key(sources) -> str:
+        """
+            The digest of a pack; a source whose digest is not known yet is counted by its name, which storage
+            never reuses.
+        """
+        value = hashlib.sha256()
+        for name, digest in sources:
+            value.update((digest if digest != '' else 'name:{name}'.format(name=name)).encode('utf-8'))
+            value.update(b'\n')
+
+        return value.hexdigest()
+
+    @staticmethod
+    def get_name(key: str) -> str:
+        return '{location}/{key}.pdf'.format(location=PrintPack.location, key=key)
+
+    @staticmethod
+    def get_packs() -> dict:
+        """
+        :return: the ids of the blueprints in each event print pack, in print order, by pack title
+        """
+        published = ModuleAssembly.objects.filter(published=True).order_by('name', '-pk')
+        rows = list(published.values_list('pk', 'crafting_tree', 'item_type'))
+
+        packs = dict()
+        for pk, crafting_tree, item_type in rows:
+            packs.setdefault('Crafting tree: {name}'.format(name=crafting_tree or 'None'), []).append(pk)
+            packs.setdefault('Item type: {name}'.format(name=ComponentType(item_type).name), []).append(pk)
+        packs['Published'] = [pk for pk, _, _ in rows]
+
+        return packs
+
+    def get(self, assembly_ids, on_progress=None) -> str:
+        """
+            The pack of the given blueprints, printed and stored when there is none yet.
+
+        :return: the name of the pack in storage
+        """
+        sources = PdfPrinter.get_pdf_sources(assembly_ids)
+        name = PrintPack.get_name(PrintPack.get_key(sources))
+        if self.storage.exists(name):
+            return name
+
+        merged = self.printer.merge([source for source, _ in sources], on_progress=on_progress)
+        with merged:
+            return self.storage.save(name, File(merged))
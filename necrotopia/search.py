@@ -0,0 +1,108 @@
+from functools import reduce
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db.models import F, FloatField, OuterRef, Q, QuerySet, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from necrotopia.models import ModuleAssembly, ResourceItem, Rule, SkillItem, SkillRatings
+
+SEARCH_CONFIG = 'english'
+
+
+class SearchIndex:
+    """
+        Full-text search over the stored search_vector column of the searchable models. Each vector is rebuilt
+        with a single UPDATE whenever a row is saved, weighting the name above the tags and the tags above the
+        longer descriptive text. A search is one indexed query per model: the terms are matched against the GIN
+        indexed vector, names are also matched by trigram similarity so misspelled names are still found, and the
+        results are ordered by rank.
+    """
+
+    # (field, weight) pairs making up the search vector of each model
+    fields = {
+        ModuleAssembly: (('name', 'A'), ('tags', 'B'), ('details', 'C'), ('visual_description', 'C'),
+                         ('achievement_mechanics', 'D')),
+        Rule: (('name', 'A'), ('tags', 'B'), ('reference', 'C'), ('slug', 'C'), ('text', 'D')),
+        SkillItem: (('name', 'A'), ('tags', 'B')),
+        ResourceItem: (('name', 'A'), ('tags', 'B')),
+        SkillRatings: (('description', 'A'),),
+    }
+
+    # models whose rows are also found through the search vector of a related model, and the foreign key linking them
+    related = {
+        SkillItem: (SkillRatings, 'skill'),
+    }
+
+    @staticmethod
+    def get_vector(model) -> SearchVector:
+        return reduce(lambda result, vector: result + vector,
+                      (SearchVector(Coalesce(field, Value('')), weight=weight, config=SEARCH_CONFIG)
+                       for field, weight in SearchIndex.fields[model]))
+
+    @staticmethod
+    def update(model, pks=None) -> int:
+        """
+            Rebuild the search vector of some rows of a model, or of all of them when pks is None.
+
+        :return: the number of rows updated
+        """
+        queryset = model.objects.all() if pks is None else model.objects.filter(pk__in=pks)
+
+        return queryset.update(search_vector=SearchIndex.get_vector(model))
+
+    @staticmethod
+    def rebuild() -> dict:
+        return {model: SearchIndex.update(model) for model in SearchIndex.fields}
+
+    @staticmethod
+    def get_terms(search_terms) -> list:
+        if isinstance(search_terms, str):
+            search_terms = search_terms.split(',')
+
+        return [term.strip() for term in search_terms if len(term.strip()) > 0]
+
+    @staticmethod
+    def get_query(terms: list) -> SearchQuery:
+        return reduce(lambda result, query: result | query,
+                      (SearchQuery(term, config=SEARCH_CONFIG, search_type='websearch') for term in terms))
+
+    @staticmethod
+    def search(queryset_or_model, search_terms) -> QuerySet:
+        """
+            Find the rows of a searchable model matching any of the search terms, best match first.
+
+        :param queryset_or_model: a searchable model, or a queryset of one to search within
+        :param search_terms: a comma separated string of terms, or a list of them
+        :return: the matching rows annotated with their search_rank
+        """
+        queryset = queryset_or_model.all() if isinstance(queryset_or_model, QuerySet) \
+            else queryset_or_model.objects.all()
+        terms = SearchIndex.get_terms(search_terms)
+        if len(terms) == 0:
+            return queryset.none()
+
+        query = SearchIndex.get_query(terms)
+        matches = Q(search_vector=query)
+        ranks = [SearchRank(F('search_vector'), query)]
+
+        ordering = 'pk'
+        if 'name' in dict(SearchIndex.fields[queryset.model]):
+            ordering = 'name'
+            for term in terms:
+                matches |= Q(name__trigram_similar=term)
+            ranks.append(TrigramSimilarity('name', terms[0]) if len(terms) == 1
+                         else Greatest(*(TrigramSimilarity('name', term) for term in terms)))
+
+        related = SearchIndex.related.get(queryset.model)
+        if related is not None:
+            related_model, link = related
+            related_matches = related_model.objects.filter(search_vector=query)
+            matches |= Q(pk__in=related_matches.values(link))
+            ranks.append(Coalesce(Subquery(
+                related_matches.filter(**{link: OuterRef('pk')})
+                .annotate(rank=SearchRank(F('search_vector'), query))
+                .order_by('-rank').values('rank')[:1], output_field=FloatField()), Value(0.0)))
+
+        rank = reduce(lambda result, value: result + value, ranks)
+
+        return queryset.filter(matches).annotate(search_rank=rank).order_by('-search_rank', ordering)
@@ -0,0 +1,214 @@
+from django.db import connections, transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from necrotopia.advertisements import AdvertisementCache
+from necrotopia.autocomplete import AUTOCOMPLETE_INDEX
+from necrotopia.crafting import PartsListCache
+from necrotopia.fragments import FragmentCache
+from necrotopia.images import renditions_ready
+from necrotopia.jobs import JobQueue
+from necrotopia.models import Advertisement, ItemCardFace, ItemPdf, ItemPicture, ModuleAssembly, ModuleGrade, \
+    ModuleGradeResource, ModuleGradeSubAssembly, ResourceItem, Rule, RulePicture, SkillItem, SkillRatings
+from necrotopia.search import SearchIndex
+from necrotopia.tags import TagQuery, tags_changed
+
+
+def create_search_extensions(sender, using='default', **kwargs):
+    """
+        The trigram indexes need pg_trgm, which has to exist before the tables are created.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+def create_tag_indexes(sender, using='default', **kwargs):
+    """
+        TaggedItem belongs to django-tagging, so its covering indexes are added once its table exists.
+    """
+    TagQuery.create_indexes(using)
+
+
+def get_grade_assembly_ids(grade_ids) -> list:
+    return list(ModuleGrade.objects.filter(pk__in=grade_ids).values_list('module_assembly_id', flat=True))
+
+
+def invalidate_blueprints(assembly_ids):
+    """
+        Forget the parts lists and page fragments of the given blueprints and of every blueprint above them.
+    """
+    dependents = PartsListCache.invalidate(assembly_ids)
+    FragmentCache.touch(ModuleAssembly, dependents)
+    transaction.on_commit(lambda: FragmentCache.purge(ModuleAssembly, dependents))
+
+
+@receiver(post_save, sender=ModuleAssembly)
+@receiver(post_delete, sender=ModuleAssembly)
+def invalidate_assembly_parts_lists(sender, instance: ModuleAssembly, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    invalidate_blueprints([instance.line_id])
+
+
+@receiver(post_save, sender=ModuleGrade)
+@receiver(post_delete, sender=ModuleGrade)
+def invalidate_grade_parts_lists(sender, instance: ModuleGrade, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    invalidate_blueprints([instance.module_assembly_id])
+
+
+@receiver(post_save, sender=ModuleGradeResource)
+@receiver(post_delete, sender=ModuleGradeResource)
+@receiver(post_save, sender=ModuleGradeSubAssembly)
+@receiver(post_delete, sender=ModuleGradeSubAssembly)
+def invalidate_grade_part_parts_lists(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    invalidate_blueprints(get_grade_assembly_ids([instance.parent_grade_id]))
+
+
+@receiver(post_save, sender=ResourceItem)
+def invalidate_resource_parts_lists(sender, instance: ResourceItem, **kwargs):
+    if kwargs.get('raw', False) or kwargs.get('created', False):
+        return
+
+    grade_ids = ModuleGradeResource.objects.filter(resource=instance).values_list('parent_grade_id', flat=True)
+    invalidate_blueprints(get_grade_assembly_ids(grade_ids))
+
+
+@receiver(post_save, sender=Rule)
+@receiver(post_delete, sender=Rule)
+@receiver(post_save, sender=SkillItem)
+@receiver(post_delete, sender=SkillItem)
+@receiver(post_save, sender=ResourceItem)
+@receiver(post_delete, sender=ResourceItem)
+def purge_page_fragment(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    pk = instance.pk
+    transaction.on_commit(lambda: FragmentCache.purge(sender, [pk]))
+
+
+@receiver(post_save, sender=RulePicture)
+@receiver(post_delete, sender=RulePicture)
+def purge_rule_picture_fragment(sender, instance: RulePicture, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    rule_id = instance.rule_item_id
+    FragmentCache.touch(Rule, [rule_id])
+    transaction.on_commit(lambda: FragmentCache.purge(Rule, [rule_id]))
+
+
+@receiver(post_save, sender=SkillRatings)
+@receiver(post_delete, sender=SkillRatings)
+def purge_skill_rating_fragment(sender, instance: SkillRatings, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    skill_id = instance.skill_id
+    FragmentCache.touch(SkillItem, [skill_id])
+    transaction.on_commit(lambda: FragmentCache.purge(SkillItem, [skill_id]))
+
+
+@receiver(post_save, sender=ModuleAssembly)
+@receiver(post_save, sender=Rule)
+@receiver(post_save, sender=SkillItem)
+@receiver(post_save, sender=ResourceItem)
+@receiver(post_save, sender=SkillRatings)
+def update_search_vector(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    SearchIndex.update(sender, [instance.pk])
+
+
+@receiver(tags_changed)
+def update_bulk_tagged(sender, pks, **kwargs):
+    """
+        Bulk tagging updates the rows without saving them, so the search vectors and page fragments showing their
+        tags are refreshed here.
+    """
+    if sender in SearchIndex.fields:
+        SearchIndex.update(sender, pks)
+    if sender in FragmentCache.sources:
+        transaction.on_commit(lambda: FragmentCache.purge(sender, pks))
+
+
+@receiver(post_save, sender=ModuleAssembly)
+@receiver(post_save, sender=Rule)
+@receiver(post_save, sender=SkillItem)
+@receiver(post_save, sender=ResourceItem)
+def update_autocomplete_index(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    pk, name = instance.pk, instance.name
+    transaction.on_commit(lambda: AUTOCOMPLETE_INDEX.update(sender, pk, name))
+
+
+@receiver(post_delete, sender=ModuleAssembly)
+@receiver(post_delete, sender=Rule)
+@receiver(post_delete, sender=SkillItem)
+@receiver(post_delete, sender=ResourceItem)
+def remove_from_autocomplete_index(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: AUTOCOMPLETE_INDEX.remove(sender, pk))
+
+
+@receiver(post_save, sender=Advertisement)
+@receiver(post_delete, sender=Advertisement)
+def invalidate_active_advertisements(sender, instance: Advertisement, **kwargs):
+    transaction.on_commit(AdvertisementCache.invalidate)
+
+
+@receiver(pre_save, sender=ItemPdf)
+def set_pdf_digest(sender, instance: ItemPdf, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    # a new upload, or the file was cleared
+    if not instance.pdf or not instance.pdf._committed:
+        instance.set_digest()
+    # pointed at a file already in storage, which is then known by its name until its digest is backfilled
+    elif instance.digest != '' and instance.pk is not None and \
+            not ItemPdf.objects.filter(pk=instance.pk, pdf=instance.pdf.name).exists():
+        instance.digest = ''
+
+
+@receiver(post_save, sender=ItemPdf)
+def queue_pdf_digest(sender, instance: ItemPdf, **kwargs):
+    # a file uploaded straight to storage is only read by the worker
+    if kwargs.get('raw', False) or not instance.pdf or instance.digest != '':
+        return
+
+    transaction.on_commit(lambda: JobQueue.enqueue('set_pdf_digest', {'pk': instance.pk}))
+
+
+@receiver(post_save, sender=RulePicture)
+@receiver(post_save, sender=ItemPicture)
+@receiver(post_save, sender=ItemCardFace)
+@receiver(post_save, sender=Advertisement)
+def queue_image_renditions(sender, instance, **kwargs):
+    if kwargs.get('raw', False) or not instance.get_image_file() or instance.has_renditions():
+        return
+
+    arguments = {'model': sender._meta.label_lower, 'pk': instance.pk}
+    transaction.on_commit(lambda: JobQueue.enqueue('render_images', arguments))
+
+
+@receiver(renditions_ready, sender=RulePicture)
+def purge_rendered_rule_picture_fragment(sender, instance: RulePicture, **kwargs):
+    # sent by the worker; moving the stamp reaches the fragments cached by the web server as well
+    FragmentCache.touch(Rule, [instance.rule_item_id])
+    FragmentCache.purge(Rule, [instance.rule_item_id])
+
+
+@receiver(renditions_ready, sender=Advertisement)
+def invalidate_rendered_advertisements(sender, instance: Advertisement, **kwargs):
+    AdvertisementCache.invalidate()
@@ -1,19 +1,233 @@
+import gzip
+import hashlib
+import mimetypes
+import posixpath
+import re
+
+import brotli
+from botocore.exceptions import ClientError
 from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestFilesMixin
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
 from storages.backends.s3boto3 import S3Boto3Storage
+from storages.utils import clean_name
+
+from necrotopia.media_cache import CachedMediaFile, MediaCache
+
 
+class StaticStorage(ManifestFilesMixin, S3Boto3Storage):
+    """
+        Static files in S3 under content hashed names, such as css/necrotopia.55e7cbb9ba48.css, cached for a year by
+        browsers since a changed file gets a new name. The manifest mapping names to hashed names is kept in
+        STATIC_ROOT on each server, written by collectstatic; until collectstatic has run, files are served under
+        their own names.
+
+        collectstatic lists the bucket once and only uploads a file whose MD5 differs from the ETag of the object
+        in its place, so a deploy uploads what changed rather than every bundled admin and icon file. Text files are
+        also stored gzip and brotli compressed next to the file, as name.gz and name.br, with their
+        Content-Encoding set, for the CDN or proxy in front of the bucket to serve to browsers accepting them.
+    """
 
-class StaticStorage(S3Boto3Storage):
-    location = 'static'
     default_acl = 'public-read'
+    file_overwrite = True
+    # the files are public, and a signed URL would change whenever it is made
+    querystring_auth = False
+
+    immutable_parameters = {'CacheControl': 'public, max-age=31536000, immutable'}
+
+    hashed_pattern = re.compile(r'\.[0-9a-f]{12}\.')
+
+    compressed_types = ('text/css', 'text/javascript', 'application/javascript', 'application/json',
+                        'image/svg+xml', 'image/vnd.microsoft.icon', 'text/plain', 'text/html', 'text/xml')
+
+    # extension, and how to compress a file with it
+    encodings = (
+        ('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0)),
+        ('.br', lambda data: brotli.compress(data, quality=11)),
+    )
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('manifest_storage', FileSystemStorage(location=settings.STATIC_ROOT))
+        super(StaticStorage, self).__init__(*args, **kwargs)
+        # the ETag and modification time of each stored object, listed when collectstatic first asks for one
+        self.objects = None
+        self.deleted = dict()
+        self.saved = dict()
+
+    @staticmethod
+    def is_compressible(name: str) -> bool:
+        content_type, encoding = mimetypes.guess_type(name)
+
+        return content_type in StaticStorage.compressed_types and encoding is None
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            return name
+
+        return super(StaticStorage, self).stored_name(name)
+
+    def get_object_parameters(self, name):
+        if StaticStorage.hashed_pattern.search(posixpath.basename(name)):
+            return StaticStorage.immutable_parameters.copy()
+
+        return super(StaticStorage, self).get_object_parameters(name)
+
+    def get_objects(self) -> dict:
+        if self.objects is None:
+            prefix = self._normalize_name('').rstrip('/')
+            prefix = prefix + '/' if prefix else ''
+            self.objects = dict()
+            for page in self.connection.meta.client.get_paginator('list_objects_v2').paginate(
+                    Bucket=self.bucket_name, Prefix=prefix):
+                for item in page.get('Contents', []):
+                    self.objects[item['Key'][len(prefix):]] = (item['ETag'].strip('"'), item['LastModified'])
+
+        return self.objects
+
+    def exists(self, name):
+        return clean_name(name) in self.get_objects()
+
+    def get_modified_time(self, name):
+        objects = self.get_objects()
+        if clean_name(name) not in objects:
+            return super(StaticStorage, self).get_modified_time(name)
+
+        modified_time = objects[clean_name(name)][1]
+
+        return modified_time if settings.USE_TZ else timezone.make_naive(modified_time)
+
+    def delete(self, name):
+        # collectstatic deletes a file before storing it again, which may well be unchanged; the delete is held until
+        # the end of post_process
+        name = clean_name(name)
+        if name in self.get_objects():
+            self.deleted[name] = self.objects.pop(name)
+
+    def _save(self, name, content):
+        name = clean_name(name)
+        content.seek(0)
+        data = content.read()
+        content.seek(0)
+        etag = hashlib.md5(data).hexdigest()
+
+        previous = self.get_objects().get(name) or self.deleted.get(name)
+        if previous is None or previous[0] != etag:
+            name = super(StaticStorage, self)._save(name, content)
+        self.deleted.pop(name, None)
+        self.objects[name] = (etag, previous[1] if previous is not None and previous[0] == etag else timezone.now())
+        if StaticStorage.is_compressible(name):
+            self.saved[name] = data
+
+        return name
+
+    def read(self, name: str) -> bytes:
+        if name in self.saved:
+            return self.saved[name]
+
+        with self.open(name, 'rb') as stored:
+            return stored.read()
+
+    def compress(self, name: str):
+        """
+            Store the compressed copies of name that are missing and worth keeping.
+
+        :return: the names of the copies stored
+        """
+        stored = []
+        data = None
+        for extension, compress in StaticStorage.encodings:
+            if self.exists(name + extension):
+                continue
+
+            data = self.read(name) if data is None else data
+            compressed = compress(data)
+            if len(compressed) < len(data) * 0.95:
+                stored.append(self._save(name + extension, ContentFile(compressed)))
+
+        return stored
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super(StaticStorage, self).post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+
+        for name in sorted(self.deleted):
+            super(StaticStorage, self).delete(name)
+        self.deleted.clear()
+
+        for name in sorted(set(self.hashed_files.values())):
+            if StaticStorage.is_compressible(name):
+                for compressed_name in self.compress(name):
+                    yield name, compressed_name, True
+
+
+class LocalCacheMixin:
+    """
+        Reads files through the MediaCache of the host, so a PDF or image read again by the print and image jobs,
+        in this process or another, is fetched from the object store once.
+    """
+
+    def get_cache_key(self, name: str) -> str:
+        return '{bucket}/{name}'.format(bucket=self.bucket_name, name=self._normalize_name(clean_name(name)))
+
+    def fetch(self, name: str, etag: str = None):
+        """
+        :return: None when the object still has etag, otherwise its ETag and a stream of its content
+        """
+        parameters = {} if etag is None else {'IfNoneMatch': etag}
+        try:
+            response = self.bucket.Object(self._normalize_name(clean_name(name))).get(**parameters)
+        except ClientError as error:
+            status = error.response['ResponseMetadata']['HTTPStatusCode']
+            if status == 304:
+                return None
+            if status == 404:
+                raise FileNotFoundError('File does not exist: %s' % name)
+            raise
+
+        return response['ETag'], response['Body']
+
+    def _open(self, name, mode='rb'):
+        cache = MediaCache.get_default()
+        if cache is None or mode != 'rb':
+            return super(LocalCacheMixin, self)._open(name, mode)
+
+        key = self.get_cache_key(name)
+
+        def open_copy():
+            return cache.open(key, lambda etag: self.fetch(name, etag))
+
+        try:
+            return CachedMediaFile(open_copy(), name, open_copy)
+        except FileNotFoundError:
+            cache.forget(key)
+            raise
+
+    def _save(self, name, content):
+        name = super(LocalCacheMixin, self)._save(name, content)
+        self.forget(name)
+
+        return name
+
+    def delete(self, name):
+        super(LocalCacheMixin, self).delete(name)
+        self.forget(name)
+
+    def forget(self, name: str):
+        cache = MediaCache.get_default()
+        if cache is not None:
+            cache.forget(self.get_cache_key(name))
 
 
-class PublicMediaStorage(S3Boto3Storage):
+class PublicMediaStorage(LocalCacheMixin, S3Boto3Storage):
     location = 'media'
     default_acl = 'public-read'
     file_overwrite = False
 
 
-class PrivateMediaStorage(S3Boto3Storage):
+class PrivateMediaStorage(LocalCacheMixin, S3Boto3Storage):
     location = 'private'
     default_acl = 'private'
     file_overwrite = False
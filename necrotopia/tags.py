@@ -0,0 +1,139 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.db.models import Count, QuerySet
+from django.dispatch import Signal
+from django.utils import timezone
+from tagging import settings as tagging_settings
+from tagging.models import Tag, TaggedItem
+from tagging.utils import edit_string_for_tags, parse_tag_input
+
+# sent by TagQuery.set_tags, which writes the tags of many rows without saving them one by one, with the primary keys
+# of the rows whose tags changed
+tags_changed = Signal()
+
+
+class TagQuery:
+    """
+        Finds tagged rows with a subquery over TaggedItem, so any number of tags costs a single SQL statement
+        whether the tags are matched with OR or AND semantics.
+    """
+
+    # name, key columns and included columns of the covering indexes over TaggedItem
+    indexes = (
+        ('tagged_item_type_tag', ('content_type_id', 'tag_id'), ('object_id',)),
+        ('tagged_item_type_object', ('content_type_id', 'object_id'), ('tag_id',)),
+    )
+
+    @staticmethod
+    def get_tag_names(tags) -> list:
+        """
+        :param tags: a tag string as entered in a TagField, or a list of tag names or Tag objects
+        :return: the distinct tag names
+        """
+        if isinstance(tags, str):
+            return parse_tag_input(tags)
+
+        return sorted({tag.name if isinstance(tag, Tag) else str(tag) for tag in tags})
+
+    @staticmethod
+    def get_object_ids(model, tags, match_all: bool = False) -> QuerySet:
+        """
+            The primary keys of the rows of model tagged with any of the tags, or with all of them when match_all
+            is set, as a lazy queryset to be used as a subquery.
+        """
+        names = TagQuery.get_tag_names(tags)
+        result = TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(model),
+                                           tag__name__in=names)
+        if match_all:
+            # TaggedItem is unique per (tag, content type, object), so counting rows counts distinct tags
+            result = result.values('object_id').annotate(tag_count=Count('tag_id')).filter(tag_count=len(names))
+
+        return result.values('object_id')
+
+    @staticmethod
+    def filter(queryset_or_model, tags, match_all: bool = False) -> QuerySet:
+        queryset = queryset_or_model.all() if isinstance(queryset_or_model, QuerySet) \
+            else queryset_or_model.objects.all()
+        if len(TagQuery.get_tag_names(tags)) == 0:
+            return queryset.none()
+
+        return queryset.filter(pk__in=TagQuery.get_object_ids(queryset.model, tags, match_all))
+
+    @staticmethod
+    def create_indexes(using: str = 'default'):
+        connection = connections[using]
+        quote_name = connection.ops.quote_name
+        table = quote_name(TaggedItem._meta.db_table)
+
+        with connection.cursor() as cursor:
+            for name, columns, included in TagQuery.indexes:
+                cursor.execute('CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns}) INCLUDE ({included})'.format(
+                    name=quote_name(name), table=table, columns=', '.join(map(quote_name, columns)),
+                    included=', '.join(map(quote_name, included))))
+
+    @staticmethod
+    def get_new_tags(tag_string: str, old_tag_string: str, replace: bool) -> set:
+        """
+            The tag names a row ends up with when tag_string is applied to a row tagged with old_tag_string.
+        """
+        names = set(parse_tag_input(tag_string))
+        if not replace:
+            names |= set(parse_tag_input(old_tag_string))
+        if tagging_settings.FORCE_LOWERCASE_TAGS:
+            names = {name.lower() for name in names}
+
+        return names
+
+    @staticmethod
+    def set_tags(queryset, tag_string: str, replace: bool, batch_size: int = 500) -> list:
+        """
+            Set the tags of every row of queryset to tag_string, or add them to the tags already there. The new tags
+            of the whole selection are worked out in memory, then written in one transaction with one delete and
+            bulk inserts and updates, rather than several queries per row.
+
+        :return: the primary keys of the rows whose tags changed
+        """
+        model = queryset.model
+        content_type = ContentType.objects.get_for_model(model)
+
+        with transaction.atomic():
+            rows = list(queryset.order_by().values_list('pk', 'tags'))
+            wanted = {pk: TagQuery.get_new_tags(tag_string, old_tag_string, replace) for pk, old_tag_string in rows}
+
+            names = set().union(*wanted.values())
+            tags = {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+            Tag.objects.bulk_create([Tag(name=name) for name in names if name not in tags], ignore_conflicts=True,
+                                    batch_size=batch_size)
+            if len(tags) < len(names):
+                tags = {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+
+            current = TaggedItem.objects.filter(content_type=content_type, object_id__in=wanted.keys()) \
+                .values_list('pk', 'object_id', 'tag_id')
+            wanted_pairs = {(pk, tags[name].pk) for pk, row_names in wanted.items() for name in row_names}
+            current_pairs = set()
+            removed = []
+            for tagged_item_id, object_id, tag_id in current:
+                current_pairs.add((object_id, tag_id))
+                if (object_id, tag_id) not in wanted_pairs:
+                    removed.append(tagged_item_id)
+
+            if len(removed) > 0:
+                TaggedItem.objects.filter(pk__in=removed).delete()
+            TaggedItem.objects.bulk_create([TaggedItem(content_type=content_type, object_id=object_id, tag_id=tag_id)
+                                            for object_id, tag_id in wanted_pairs - current_pairs],
+                                           batch_size=batch_size)
+
+            # bulk_update leaves auto_now fields alone, so the fragment stamps are moved here
+            stamp = timezone.now()
+            changed = []
+            for pk, old_tag_string in rows:
+                new_tag_string = edit_string_for_tags(sorted((tags[name] for name in wanted[pk]),
+                                                             key=lambda tag: tag.name))
+                if new_tag_string != old_tag_string:
+                    changed.append(model(pk=pk, tags=new_tag_string, fragment_stamp=stamp))
+            model.objects.bulk_update(changed, ['tags', 'fragment_stamp'], batch_size=batch_size)
+
+            changed_pks = [row.pk for row in changed]
+            tags_changed.send(sender=model, pks=changed_pks)
+
+        return changed_pks
@@ -0,0 +1,53 @@
+from imagekit.cachefiles.backends import CacheFileState, Simple
+from imagekit.cachefiles.strategies import JustInTime
+
+from necrotopia.models import ThumbnailFile
+
+
+class PersistentCacheFileBackend(Simple):
+    """
+        Keeps track of which imagekit thumbnails have been generated. Most thumbnails are made lazily, the first
+        time their URL is asked for. Knowing whether one exists would otherwise mean asking S3 every time the cache has
+        forgotten, and the default cache forgets whenever a process restarts. This backend keeps the thumbnails
+        known to exist in the ThumbnailFile table, with the cache in front of it, so each thumbnail costs at most
+        one existence check in storage, ever.
+    """
+
+    def get_state(self, file, check_if_unknown=True):
+        state = self.cache.get(self.get_key(file))
+        if state is not None:
+            return state
+
+        if ThumbnailFile.objects.filter(name=file.name).exists():
+            super(PersistentCacheFileBackend, self).set_state(file, CacheFileState.EXISTS)
+            return CacheFileState.EXISTS
+
+        return super(PersistentCacheFileBackend, self).get_state(file, check_if_unknown)
+
+    def set_state(self, file, state):
+        super(PersistentCacheFileBackend, self).set_state(file, state)
+
+        if state == CacheFileState.EXISTS:
+            ThumbnailFile.objects.get_or_create(name=file.name)
+        elif state == CacheFileState.DOES_NOT_EXIST:
+            ThumbnailFile.objects.filter(name=file.name).delete()
+
+
+class OnSave:
+    """
+        An imagekit strategy making a thumbnail when its source image is saved, in the request saving it, and never
+        when its URL is asked for. A page showing it checks that it exists first, see Advertisement.has_carousel.
+    """
+
+    def on_source_saved(self, file):
+        file.generate()
+
+
+class OnSaveOrFirstUse(JustInTime):
+    """
+        Makes a thumbnail when its source image is saved, and the first time it is shown when it is still missing,
+        as it is for the images saved before it was added.
+    """
+
+    def on_source_saved(self, file):
+        file.generate()
@@ -2,7 +2,7 @@ from numbers import Number
 from decimal import Decimal
 import os
 from io import BytesIO
-from PIL import Image as PilImage
+from PIL import Image as PilImage, ImageOps
 from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
 
@@ -40,6 +40,43 @@ class ImageTool:
 
         return image
 
+    @staticmethod
+    def has_alpha(pil_image) -> bool:
+        return pil_image.mode in ('RGBA', 'LA', 'PA') or \
+            (pil_image.mode == 'P' and 'transparency' in pil_image.info)
+
+    @staticmethod
+    def render_rendition(data: bytes, max_width: int, max_height: int, quality: int) -> dict:
+        """
+            Scale an image down to fit max_width by max_height, upright, as WebP and as JPEG, or PNG when the image
+            is transparent. JPEG sources are decoded in draft mode, at the smallest power of two scale still larger
+            than the rendition, which is much faster than decoding the whole image only to throw most of it away.
+            Uses nothing but PIL, so it can run in a worker process.
+
+        :return: the width and height of the rendition, the WebP data, the fallback data and its file extension
+        """
+        pil_image = PilImage.open(BytesIO(data))
+        if pil_image.format == 'JPEG':
+            # a rotated photo is stored on its side, so both sides are kept at least as long as the longest side
+            longest = max(max_width, max_height)
+            pil_image.draft('RGB', (longest, longest))
+
+        pil_image = ImageOps.exif_transpose(pil_image)
+        alpha = ImageTool.has_alpha(pil_image)
+        pil_image = pil_image.convert('RGBA' if alpha else 'RGB')
+        pil_image.thumbnail((max_width, max_height), PilImage.LANCZOS)
+
+        webp = BytesIO()
+        pil_image.save(webp, format='WEBP', quality=quality, method=4)
+        fallback = BytesIO()
+        if alpha:
+            pil_image.save(fallback, format='PNG', optimize=True)
+        else:
+            pil_image.save(fallback, format='JPEG', quality=quality, optimize=True, progressive=True)
+
+        return {'width': pil_image.width, 'height': pil_image.height, 'webp': webp.getvalue(),
+                'fallback': fallback.getvalue(), 'extension': 'png' if alpha else 'jpg'}
+
 class DictionaryTool:
     @staticmethod
     def add_or_update(key, value, dictionary: {}):
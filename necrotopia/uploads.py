@@ -0,0 +1,237 @@
+import posixpath
+import uuid
+
+from django import forms
+from django.apps import apps
+from django.contrib.admin.widgets import AdminFileWidget
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.forms.widgets import HiddenInput
+from django.urls import reverse
+from storages.utils import clean_name
+
+
+class StoredUpload(str):
+    """
+        The name of a file the browser sent straight to the object store, given to a FileField in place of an
+        UploadedFile. Assigned to a model's file field it is saved as is, the bytes are already stored.
+    """
+
+    def __new__(cls, name: str, size: int):
+        upload = super(StoredUpload, cls).__new__(cls, name)
+        upload.size = size
+
+        return upload
+
+    @property
+    def name(self) -> str:
+        return str(self)
+
+
+class DirectUpload:
+    """
+        Uploads from the admin that go from the browser straight to the object store instead of through the web
+        server. The admin asks for an upload slot, a presigned POST limited to one object name, content type and
+        size; the browser posts the file to the store and hands the signed token of the slot back with the form,
+        so Django only records the name of the stored object. Post-processing is left to the post_save signals of
+        each model, as for a file uploaded through Django.
+
+        The slot is a plain S3 presigned POST, so it works against any S3 compatible store, MinIO included, and
+        covers files up to the 5GB a single POST may carry.
+    """
+
+    # model label, field name: the content types the field takes and its largest file in bytes
+    targets = {
+        'necrotopia.itempdf.pdf': (('application/pdf',), 50 * 1024 * 1024),
+        'necrotopia.itempicture.picture': (('image/jpeg', 'image/png', 'image/webp', 'image/gif'), 20 * 1024 * 1024),
+        'necrotopia.rulepicture.picture': (('image/jpeg', 'image/png', 'image/webp', 'image/gif'), 20 * 1024 * 1024),
+        'necrotopia.itemcardface.image': (('image/jpeg', 'image/png', 'image/webp', 'image/gif'), 20 * 1024 * 1024),
+        'necrotopia.advertisement.image': (('image/jpeg', 'image/png', 'image/webp', 'image/gif'), 20 * 1024 * 1024),
+    }
+
+    # seconds a slot may be used for, and its token redeemed in
+    expires = 600
+
+    salt = 'necrotopia.uploads'
+
+    @staticmethod
+    def get_target(model, field_name: str) -> str:
+        return '{label}.{field}'.format(label=model._meta.label_lower, field=field_name)
+
+    @staticmethod
+    def get_field(target: str):
+        if target not in DirectUpload.targets:
+            raise ValidationError('Files cannot be uploaded to %(target)s', code='invalid_target',
+                                  params={'target': target})
+
+        label, field_name = target.rsplit('.', 1)
+
+        return apps.get_model(label)._meta.get_field(field_name)
+
+    @staticmethod
+    def get_name(field, filename: str) -> str:
+        """
+        :return: the name to store filename as, in a directory of its own so it never replaces another upload
+        """
+        directory = uuid.uuid4().hex
+        root, extension = posixpath.splitext(posixpath.basename(filename.replace('\\', '/')))
+        name = field.generate_filename(None, posixpath.join(directory, root + extension))
+        overflow = len(name) - field.max_length
+        if overflow > 0:
+            name = field.generate_filename(None, posixpath.join(directory, root[:max(len(root) - overflow, 1)] +
+                                                                extension))
+
+        return name
+
+    @staticmethod
+    def get_slot(target: str, filename: str, content_type: str, size: int, storage=None) -> dict:
+        """
+            Make a presigned POST for one file.
+
+        :param storage: the S3 storage to upload to, that of the target field by default
+        :return: the url and form fields the browser posts the file with, and the token to send back with the form
+        """
+        field = DirectUpload.get_field(target)
+        content_types, max_size = DirectUpload.targets[target]
+        if content_type not in content_types:
+            raise ValidationError('%(content_type)s files cannot be uploaded here', code='invalid_content_type',
+                                  params={'content_type': content_type})
+        if size < 1 or size > max_size:
+            raise ValidationError('Files uploaded here must be at most %(max_size)d bytes', code='invalid_size',
+                                  params={'max_size': max_size})
+
+        storage = field.storage if storage is None else storage
+        name = DirectUpload.get_name(field, filename)
+        fields = {'Content-Type': content_type}
+        conditions = [{'Content-Type': content_type}, ['content-length-range', 1, max_size]]
+        if storage.default_acl:
+            fields['acl'] = storage.default_acl
+            conditions.append({'acl': storage.default_acl})
+        cache_control = storage.get_object_parameters(name).get('CacheControl')
+        if cache_control:
+            fields['Cache-Control'] = cache_control
+            conditions.append({'Cache-Control': cache_control})
+
+        post = storage.bucket.meta.client.generate_presigned_post(
+            storage.bucket_name, storage._normalize_name(clean_name(name)), Fields=fields, Conditions=conditions,
+            ExpiresIn=DirectUpload.expires)
+
+        return {
+            'url': post['url'],
+            'fields': post['fields'],
+            'name': name,
+            'token': signing.dumps({'target': target, 'name': name}, salt=DirectUpload.salt),
+        }
+
+    @staticmethod
+    def complete(token: str, target: str) -> StoredUpload:
+        """
+            Check that the file of an upload slot made for target arrived in storage.
+
+        :raises ValidationError: when the token is not one of ours, has expired or its file is missing
+        """
+        try:
+            slot = signing.loads(token, salt=DirectUpload.salt, max_age=DirectUpload.expires * 2)
+        except signing.BadSignature:
+            raise ValidationError('The upload has expired, please choose the file again', code='invalid_token')
+
+        if slot['target'] != target:
+            raise ValidationError('The upload was made for another field', code='invalid_token')
+
+        storage = DirectUpload.get_field(target).storage
+        if not storage.exists(slot['name']):
+            raise ValidationError('The upload did not finish, please choose the file again', code='missing')
+
+        return StoredUpload(slot['name'], storage.size(slot['name']))
+
+
+class DirectUploadToken(str):
+    """
+        The token a DirectUploadWidget read from the form, redeemed by the form field.
+    """
+
+
+class DirectUploadWidget(AdminFileWidget):
+    """
+        A file input that uploads the chosen file to the object store as soon as it is picked, see
+        static/js/direct_upload.js, and posts back the token of its slot in a hidden input next to it. Without
+        JavaScript the file is posted with the form as before.
+    """
+
+    class Media:
+        js = ('js/direct_upload.js',)
+
+    def __init__(self, target: str, attrs: dict = None):
+        super(DirectUploadWidget, self).__init__(attrs)
+        self.target = target
+
+    def get_context(self, name, value, attrs):
+        context = super(DirectUploadWidget, self).get_context(name, value, attrs)
+        context['widget']['attrs'].update({
+            'data-direct-upload': reverse('direct_upload_slot'),
+            'data-direct-upload-target': self.target,
+        })
+
+        return context
+
+    def render(self, name, value, attrs=None, renderer=None):
+        token_name = self.get_token_name(name)
+        token = HiddenInput(attrs={'data-direct-upload-token': ''}).render(token_name, '', renderer=renderer)
+
+        return super(DirectUploadWidget, self).render(name, value, attrs, renderer) + token
+
+    @staticmethod
+    def get_token_name(name: str) -> str:
+        return '{name}_token'.format(name=name)
+
+    def value_from_datadict(self, data, files, name):
+        token = data.get(self.get_token_name(name))
+        if token and not files.get(name) and not self.is_initial_cleared(data, name):
+            return DirectUploadToken(token)
+
+        return super(DirectUploadWidget, self).value_from_datadict(data, files, name)
+
+    def is_initial_cleared(self, data, name) -> bool:
+        return not self.is_required and forms.CheckboxInput().value_from_datadict(
+            data, {}, self.clear_checkbox_name(name))
+
+    def value_omitted_from_data(self, data, files, name):
+        return super(DirectUploadWidget, self).value_omitted_from_data(data, files, name) and \
+            self.get_token_name(name) not in data
+
+
+class DirectUploadFieldMixin:
+    def __init__(self, *args, target: str = '', **kwargs):
+        kwargs['widget'] = DirectUploadWidget(target)
+        super(DirectUploadFieldMixin, self).__init__(*args, **kwargs)
+        self.target = target
+
+    def to_python(self, data):
+        if isinstance(data, DirectUploadToken):
+            # the file is checked by its slot: its content type and size were part of the presigned POST
+            return DirectUpload.complete(data, self.target)
+
+        return super(DirectUploadFieldMixin, self).to_python(data)
+
+
+class DirectUploadFileField(DirectUploadFieldMixin, forms.FileField):
+    pass
+
+
+class DirectUploadImageField(DirectUploadFieldMixin, forms.ImageField):
+    pass
+
+
+class DirectUploadAdminMixin:
+    """
+        Admin of a model with a DirectUpload target, whose file inputs upload straight to the object store.
+    """
+
+    def formfield_for_dbfield(self, db_field, request, **kwargs):
+        target = DirectUpload.get_target(self.model, db_field.name)
+        if target in DirectUpload.targets:
+            field_class = DirectUploadImageField if isinstance(db_field, models.ImageField) else DirectUploadFileField
+            return db_field.formfield(form_class=field_class, target=target, **kwargs)
+
+        return super(DirectUploadAdminMixin, self).formfield_for_dbfield(db_field, request, **kwargs)
@@ -11,10 +11,13 @@ from django.conf.urls.static import static
 
 urlpatterns = [
     path('', views.home, name='home'),
+    path('favicon.ico', views.favicon, name='favicon'),
     path('search_results/', views.search_results, name='search_results'),
+    path('autocomplete/', views.autocomplete, name='autocomplete'),
     path('rule_view/<int:rule_id>', views.rule_view, name='rule_view'),
     path('rules_list/', views.rules_list, name='rules_list'),
     path('blueprint_view/<int:blueprint_id>', views.blueprint_view, name='blueprint_view'),
+    path('blueprint_list/', views.blueprint_list, name='blueprint_list'),
     path('skill_list', views.skill_list, name='list_all_skills'),
     path('skill_view/<int:skill_id>', views.skill_view, name='skill_view'),
     path('resource_view/<int:resource_id>', views.resource_view, name='resource_view'),
@@ -1,50 +1,54 @@
 import re
 
-import tagging
 from django.contrib.auth import authenticate, get_user_model
+from django.contrib.staticfiles.storage import staticfiles_storage
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.mail import EmailMessage
 from django.db.models import QuerySet
-from django.http import FileResponse, HttpRequest, HttpResponse, HttpResponseRedirect, Http404
+from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, Http404, JsonResponse
 from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.shortcuts import render, redirect
 from django.template import RequestContext
 from django.template.loader import render_to_string
-from django.utils.encoding import force_bytes
-from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from django.utils.http import urlsafe_base64_decode
 from django.views import View
 from django.views.decorators.cache import cache_control
-from django.views.decorators.http import require_GET
+from django.views.decorators.http import require_GET, require_POST
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import ValidationError
 from django.contrib.auth import login as auth_login
-from tagging.models import TaggedItem
 
 from Config import Config
+from necrotopia.advertisements import AdvertisementCache
+from necrotopia.autocomplete import AUTOCOMPLETE_INDEX
+from necrotopia.crafting import CraftingLoopError, PartsListCache
 from necrotopia.forms import AuthenticateUserForm, RegisterUserForm, UserProfileForm
+from necrotopia.fragments import FragmentCache
+from necrotopia.mail import send_activation_email
 from necrotopia.models import UserProfile, Rule, RulePicture, ModuleAssembly, Advertisement, ItemPicture, ModuleGrade, \
     SkillItem, SkillRatings, ResourceItem
+from necrotopia.pagination import KeysetPage, KeysetPaginator
+from necrotopia.search import SearchIndex
 from necrotopia.token import account_activation_token
+from necrotopia.uploads import DirectUpload
 from necrotopia_project import settings
-from necrotopia_project.settings import GLOBAL_SITE_NAME, STATICFILES_DIRS
+from necrotopia_project.settings import GLOBAL_SITE_NAME
 from django.contrib.auth import logout
 from django.contrib import messages
 from django.contrib.auth import login, authenticate
 from django.utils.translation import gettext_lazy as _translate
 from django.utils.encoding import force_str
-from django.utils import timezone
 
 
 @require_GET
-@cache_control(max_age=60 * 60 * 24, immutable=True, public=True)  # one day
-def favicon(request: HttpRequest) -> FileResponse:
-    file = (STATICFILES_DIRS / "images" / "project_icon.png").open("rb")
-    return FileResponse(file)
+@cache_control(max_age=60 * 60 * 24, public=True)  # one day
+def favicon(request: HttpRequest) -> HttpResponseRedirect:
+    # to the content hashed copy in the static storage, which browsers keep for a year
+    return HttpResponseRedirect(staticfiles_storage.url('images/project_icon.png'))
 
 
 def get_active_advertisements_for_user(user: UserProfile):
-    now = timezone.now()
-
     if user.is_anonymous or user.display_game_advertisements:
-        return Advertisement.objects.filter(published=True, start_date__lte=now, end_date__gte=now)
+        return AdvertisementCache.get_active()
     else:
         return None
 
@@ -121,20 +125,7 @@ def authenticate_user(request, template_name='registration/login.html', redirect
 
 
 def send_registration_email(request, user):
-    current_site = get_current_site(request)
-    mail_subject = 'Activation link has been sent to your specified email'
-    message = render_to_string('registration/activation_email.html',
-                               {
-                                   'user': user,
-                                   'domain': current_site.domain,
-                                   'uid': urlsafe_base64_encode(force_bytes(user.pk)),
-                                   'token': account_activation_token.make_token(user),
-                               })
-
-    to_email = user.email
-    email = EmailMessage(mail_subject, message, to=[to_email])
-    email.content_subtype = 'html'
-    email.send()
+    send_activation_email(get_current_site(request).domain, user)
 
 
 def register_user(request):
@@ -209,14 +200,6 @@ def user_profile_change(request, template='necrotopia/user_profile_change.html')
     return render(request, template, context=context)
 
 
-def tag_OR_query(model, tags):
-    result = TaggedItem.objects.none()
-    for tag in tags:
-        result = result.union(TaggedItem.objects.get_by_model(model, tag))
-
-    return result
-
-
 def search_results(request):
     search_terms = []
     all_rules_found = []
@@ -224,25 +207,16 @@ def search_results(request):
 
     if request.method == 'POST':
         search_terms = request.POST['search_terms']
-        search_terms_list = list(search_terms.lower().split(','))
-
-        tags = tagging.models.get_tag_list(search_terms)
+        search_terms_list = SearchIndex.get_terms(search_terms.lower())
 
-        blueprints_by_name = ModuleAssembly.objects.filter(name__icontains=search_terms)
-        blueprints_by_tag = tag_OR_query(model=ModuleAssembly, tags=tags)
-        all_blueprints_found = blueprints_by_name.union(blueprints_by_tag).order_by('name')
+        all_blueprints_found = list(SearchIndex.search(ModuleAssembly, search_terms_list))
+        parts_lists = PartsListCache.get_many(all_blueprints_found)
+        for blueprint in all_blueprints_found:
+            blueprint.parts_list = parts_lists[blueprint.line_id].values()
 
-        rules_by_name = Rule.objects.filter(name__icontains=search_terms)
-        rules_by_tag = tag_OR_query(model=Rule, tags=tags)
-        all_rules_found = rules_by_name.union(rules_by_tag).order_by('name')
-
-        skills_by_name = SkillItem.objects.filter(name__icontains=search_terms)
-        skills_by_tag = tag_OR_query(model=SkillItem, tags=tags)
-        all_skills_found = skills_by_name.union(skills_by_tag).order_by('name')
-
-        resource_by_name = ResourceItem.objects.filter(name__icontains=search_terms)
-        resource_by_tag = tag_OR_query(model=ResourceItem, tags=tags)
-        all_resources_found = resource_by_name.union(resource_by_tag).order_by('name')
+        all_rules_found = SearchIndex.search(Rule, search_terms_list)
+        all_skills_found = SearchIndex.search(SkillItem, search_terms_list)
+        all_resources_found = SearchIndex.search(ResourceItem, search_terms_list)
 
         context['all_blueprints_found'] = all_blueprints_found
         context['all_skills_found'] = all_skills_found
@@ -255,79 +229,175 @@ def search_results(request):
     return render(request, 'necrotopia/search_results.html', context)
 
 
+@require_GET
+@cache_control(max_age=60, public=True)
+def autocomplete(request: HttpRequest) -> JsonResponse:
+    query = request.GET.get('q', '')
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 25)
+    except ValueError:
+        limit = 10
+
+    return JsonResponse({'query': query, 'results': AUTOCOMPLETE_INDEX.search(query, limit)})
+
+
+@require_POST
+@staff_member_required
+def direct_upload_slot(request: HttpRequest) -> JsonResponse:
+    """
+        An upload slot for a file the admin is about to send straight to the object store, see DirectUpload.
+    """
+    try:
+        size = int(request.POST.get('size', 0))
+        slot = DirectUpload.get_slot(request.POST.get('target', ''), request.POST.get('filename', ''),
+                                     request.POST.get('content_type', ''), size)
+    except ValueError:
+        return JsonResponse({'error': 'The size of the file is missing'}, status=400)
+    except ValidationError as error:
+        return JsonResponse({'error': ' '.join(error.messages)}, status=400)
+
+    return JsonResponse(slot)
+
+
+def render_list_page(request, list_template: str, context: dict, page: KeysetPage):
+    context.update({
+        'list_template': list_template,
+        'page': page,
+        # an empty page is falsy, so the list templates go by this rather than by page
+        'paginated': True,
+        'title': GLOBAL_SITE_NAME,
+    })
+
+    return render(request, 'necrotopia/paged_list.html', context=context)
+
+
 def rules_list(request):
-    return render(request, 'necrotopia/rules_list.html', context={"rules_found": Rule.objects.all()})
+    rules = Rule.objects.only('id', 'name', 'reference', 'slug', 'tags')
+    page = KeysetPaginator(rules).get_page(request.GET)
 
+    return render_list_page(request, 'necrotopia/rules_list.html', {'all_rules_found': page.items}, page)
 
-def rule_view(request, rule_id):
+
+def blueprint_list(request):
+    blueprints = ModuleAssembly.objects.only('line_id', 'name', 'item_type', 'expiration_units', 'time_units', 'tags',
+                                             'last_update_date', 'parts_revision')
+    page = KeysetPaginator(blueprints).get_page(request.GET)
+    parts_lists = PartsListCache.get_many(page.items)
+    for blueprint in page.items:
+        blueprint.parts_list = parts_lists[blueprint.line_id].values()
+
+    return render_list_page(request, 'necrotopia/blueprint_list.html', {'all_blueprints_found': page.items}, page)
+
+
+def render_catalogue_page(request, model, pk, template: str, render_fragment, not_found: str):
+    """
+        A rule, skill, resource or blueprint page around its cached fragment, or a 304 when the browser has it.
+    """
     try:
-        rule = Rule.objects.get(pk=rule_id)
-        pictures = RulePicture.objects.filter(rule_item_id=rule_id)
-    except Rule.DoesNotExist:
-        raise Http404("That rule does not exist")
+        fragment = FragmentCache.get(model, pk, render_fragment)
+    except model.DoesNotExist:
+        raise Http404(not_found)
+
+    response = FragmentCache.get_not_modified(request, fragment)
+    if response is not None:
+        return response
+
+    if fragment.warning:
+        messages.warning(request, fragment.warning)
+
+    response = render(request, template, context={'fragment': fragment, 'title': GLOBAL_SITE_NAME})
+    FragmentCache.set_headers(request, response, fragment)
+
+    return response
+
+
+def render_rule_fragment(rule_id) -> tuple:
+    rule = Rule.objects.get(pk=rule_id)
+    pictures = RulePicture.objects.filter(rule_item_id=rule_id)
     context = {
         'rule': rule,
         'pictures': pictures,
-        'title': GLOBAL_SITE_NAME,
     }
-    return render(request, 'necrotopia/rule_view.html', context=context)
 
+    return rule.name, render_to_string('necrotopia/fragments/rule_view.html', context=context), ''
 
-def blueprint_view(request, blueprint_id):
+
+def rule_view(request, rule_id):
+    return render_catalogue_page(request, Rule, rule_id, 'necrotopia/rule_view.html', render_rule_fragment,
+                                 "That rule does not exist")
+
+
+def render_blueprint_fragment(blueprint_id) -> tuple:
+    blueprint = ModuleAssembly.objects.get(pk=blueprint_id)
+    # pictures = ItemPicture.objects.filter(assembly_item_id=blueprint_id)
+    module_grades = ModuleGrade.objects.filter(module_assembly=blueprint)
+    warning = ''
     try:
-        blueprint = ModuleAssembly.objects.get(pk=blueprint_id)
-        # pictures = ItemPicture.objects.filter(assembly_item_id=blueprint_id)
-        module_grades = ModuleGrade.objects.filter(module_assembly=blueprint)
-        parts_list = blueprint.flatten()
-
-        tags = blueprint.get_tags_string()
-    except ModuleAssembly.DoesNotExist:
-        raise Http404("That blueprint does not exist")
-
-    return render(request, 'necrotopia/blueprint_view.html',
-                  context={
-                      'blueprint': blueprint,
-                      'item_type': blueprint.get_item_type_display,
-                      'expiration': blueprint.get_expiration(),
-                      # 'pictures': pictures,
-                      'module_grades': module_grades,
-                      'tags': tags,
-                      'parts_list': parts_list,
-                      'title': GLOBAL_SITE_NAME,
-                  })
+        parts_list = PartsListCache.get(blueprint)
+    except CraftingLoopError as error:
+        parts_list = dict()
+        warning = str(error)
+
+    html = render_to_string('necrotopia/fragments/blueprint_view.html',
+                            context={
+                                'blueprint': blueprint,
+                                'item_type': blueprint.get_item_type_display,
+                                'expiration': blueprint.get_expiration(),
+                                # 'pictures': pictures,
+                                'module_grades': module_grades,
+                                'tags': blueprint.tags,
+                                'parts_list': parts_list.values(),
+                            })
+
+    return blueprint.name, html, warning
+
+
+def blueprint_view(request, blueprint_id):
+    return render_catalogue_page(request, ModuleAssembly, blueprint_id, 'necrotopia/blueprint_view.html',
+                                 render_blueprint_fragment, "That blueprint does not exist")
 
 
 def skill_list(request):
-    return render(request, 'necrotopia/skill_list.html', context={'skills_found': SkillItem.objects.all()})
+    skills = SkillItem.objects.only('id', 'name', 'category', 'tags')
+    page = KeysetPaginator(skills).get_page(request.GET)
 
+    return render_list_page(request, 'necrotopia/skill_list.html', {'all_skills_found': page.items}, page)
 
-def skill_view(request, skill_id):
-    try:
-        skill = SkillItem.objects.get(pk=skill_id)
-        skill_ratings = SkillRatings.objects.filter(skill_id=skill.id)
-    except SkillItem.DoesNotExist:
-        raise Http404("That skill does not exist")
+
+def render_skill_fragment(skill_id) -> tuple:
+    skill = SkillItem.objects.get(pk=skill_id)
+    skill_ratings = SkillRatings.objects.filter(skill_id=skill.id)
     context = {
         'skill': skill,
         'skill_ratings': skill_ratings,
-        'title': GLOBAL_SITE_NAME
     }
 
-    return render(request, 'necrotopia/skill_view.html', context=context)
+    return skill.name, render_to_string('necrotopia/fragments/skill_view.html', context=context), ''
 
 
-def resources_list(request, resources):
-    return render(request, 'necrotopia/resource_list.html', context=resources)
+def skill_view(request, skill_id):
+    return render_catalogue_page(request, SkillItem, skill_id, 'necrotopia/skill_view.html', render_skill_fragment,
+                                 "That skill does not exist")
 
 
-def resource_view(request, resource_id):
-    try:
-        resource = ResourceItem.objects.get(pk=resource_id)
-    except Rule.DoesNotExist:
-        raise Http404("That resource does not exist")
+def resources_list(request):
+    resources = ResourceItem.objects.only('id', 'name', 'expiration_units', 'time_units', 'tags')
+    page = KeysetPaginator(resources).get_page(request.GET)
+
+    return render_list_page(request, 'necrotopia/resource_list.html', {'all_resources_found': page.items}, page)
+
+
+def render_resource_fragment(resource_id) -> tuple:
+    resource = ResourceItem.objects.get(pk=resource_id)
     context = {
         'resource': resource,
     }
-    return render(request, 'necrotopia/resource_view.html', context=context)
+
+    return resource.name, render_to_string('necrotopia/fragments/resource_view.html', context=context), ''
+
+
+def resource_view(request, resource_id):
+    return render_catalogue_page(request, ResourceItem, resource_id, 'necrotopia/resource_view.html',
+                                 render_resource_fragment, "That resource does not exist")
 
 
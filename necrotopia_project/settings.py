@@ -18,7 +18,9 @@ from django.utils.encoding import smart_str
 django.utils.encoding.smart_text = smart_str
 
 from Config import Config
+from necrotopia.caching import get_cache_settings
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -36,12 +38,21 @@ AWS_S3_OBJECT_PARAMETERS = {
 }
 AWS_LOCATION = Config.AWS_LOCATION
 STATIC_URL = '%s/%s' % (AWS_S3_ENDPOINT_URL, AWS_LOCATION)
-STATICFILES_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+# content hashed names, see necrotopia.storage_backends.StaticStorage; the manifest of the hashed names is kept in
+# STATIC_ROOT by collectstatic
+STATICFILES_STORAGE = 'necrotopia.storage_backends.StaticStorage'
+STATIC_ROOT = Config.STATIC_ROOT or BASE_DIR / 'staticfiles'
 PUBLIC_MEDIA_LOCATION = 'media'
 MEDIA_URL = f'{AWS_S3_ENDPOINT_URL}/{PUBLIC_MEDIA_LOCATION}/'
 DEFAULT_FILE_STORAGE = 'necrotopia.storage_backends.PublicMediaStorage'
 PRIVATE_MEDIA_LOCATION = 'private'
 PRIVATE_FILE_STORAGE = 'necrotopia.storage_backends.PrivateMediaStorage'
+# media read back by the server is kept on local disk, see necrotopia.media_cache.MediaCache: at most
+# MEDIA_CACHE_MAX_SIZE bytes (0 turns the cache off), checked against the object store after MEDIA_CACHE_REVALIDATE
+# seconds
+MEDIA_CACHE_DIR = Config.MEDIA_CACHE_DIR or os.path.join(tempfile.gettempdir(), 'necrotopia_media')
+MEDIA_CACHE_MAX_SIZE = Config.MEDIA_CACHE_MAX_MB * 1024 * 1024
+MEDIA_CACHE_REVALIDATE = Config.MEDIA_CACHE_REVALIDATE
 
 
 STATICFILES_DIRS = (BASE_DIR / 'static',)
@@ -76,6 +87,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'bootstrap5',
     'imagekit',
     'nested_admin',
@@ -152,6 +164,19 @@ DATABASES = {
     }
 }
 
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# CACHE_URL names the cache shared by every process, e.g. redis://cache:6379/0; the default cache keeps
+# CACHE_LOCAL_SIZE recently read entries in each process for up to CACHE_LOCAL_TIMEOUT seconds in front of it
+
+CACHES = get_cache_settings(Config.CACHE_URL, Config.CACHE_TIMEOUT, Config.CACHE_KEY_PREFIX, Config.CACHE_VERSION,
+                            Config.CACHE_LOCAL_SIZE, Config.CACHE_LOCAL_TIMEOUT)
+
+# imagekit thumbnails are generated the first time they are shown, and remembered in the database once they exist
+IMAGEKIT_DEFAULT_CACHEFILE_BACKEND = 'necrotopia.thumbnails.PersistentCacheFileBackend'
+IMAGEKIT_DEFAULT_CACHEFILE_STRATEGY = 'imagekit.cachefiles.strategies.JustInTime'
+IMAGEKIT_CACHE_TIMEOUT = 60 * 60 * 24
+
 EMAIL_USE_TLS = Config.EMAIL_USE_TLS
 EMAIL_HOST = Config.EMAIL_HOST
 EMAIL_HOST_USER = Config.EMAIL_HOST_USER
@@ -159,7 +184,17 @@ EMAIL_HOST_PASSWORD = Config.EMAIL_HOST_PASSWORD
 EMAIL_PORT = Config.EMAIL_PORT
 
 EMAIL_BACKEND = Config.EMAIL_BACKEND
-# EMAIL_FILE_PATH = '/tmp/messages'  # change this to a proper location
+if Config.EMAIL_FILE_PATH:
+    # where django.core.mail.backends.filebased.EmailBackend writes messages
+    EMAIL_FILE_PATH = Config.EMAIL_FILE_PATH
+
+# outbound mail is queued and sent by the send_queued_mail command, at most EMAIL_QUEUE_RATE messages a second
+# (0 for no limit) over one connection, EMAIL_QUEUE_BATCH_SIZE messages at a time; a failed message is retried after
+# EMAIL_QUEUE_RETRY_DELAY seconds, doubled after every attempt, up to EMAIL_QUEUE_MAX_ATTEMPTS attempts
+EMAIL_QUEUE_RATE = Config.EMAIL_QUEUE_RATE
+EMAIL_QUEUE_BATCH_SIZE = Config.EMAIL_QUEUE_BATCH_SIZE
+EMAIL_QUEUE_MAX_ATTEMPTS = Config.EMAIL_QUEUE_MAX_ATTEMPTS
+EMAIL_QUEUE_RETRY_DELAY = Config.EMAIL_QUEUE_RETRY_DELAY
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
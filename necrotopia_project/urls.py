@@ -26,6 +26,7 @@ urlpatterns = [
     path('user_profile_change', views.user_profile_change, name='user_profile_change'),
     path('activate/<uidb64>/<token>/', ActivateAccount.as_view(), name='activate'),
     path('accounts/logout', views.log_me_out, name='logout'),
+    path('admin/uploads/slot', views.direct_upload_slot, name='direct_upload_slot'),
     path('admin/', admin.site.urls),
     path('', include("necrotopia.urls")),
 ]
@@ -0,0 +1,79 @@
+'use strict';
+/*
+    Sends the file picked in a DirectUploadWidget straight to the object store: asks Django for an upload slot,
+    posts the file to the presigned URL, then keeps the token of the slot in the hidden input next to the file input
+    and empties the file input, so the form itself only carries the token.
+*/
+(function () {
+    function getCookie(name) {
+        const match = document.cookie.match('(^|;)\\s*' + name + '=([^;]*)');
+        return match ? decodeURIComponent(match[2]) : '';
+    }
+
+    function getTokenInput(input) {
+        return input.form.querySelector('input[name="' + input.name + '_token"]');
+    }
+
+    function setStatus(input, text) {
+        let status = input.parentNode.querySelector('.direct-upload-status');
+        if (status === null) {
+            status = document.createElement('span');
+            status.className = 'direct-upload-status help';
+            input.parentNode.appendChild(status);
+        }
+        status.textContent = text;
+    }
+
+    async function upload(input) {
+        const file = input.files[0];
+        const tokenInput = getTokenInput(input);
+        const submits = input.form.querySelectorAll('[type="submit"]');
+        tokenInput.value = '';
+        submits.forEach(function (button) { button.disabled = true; });
+        setStatus(input, 'Uploading ' + file.name + '…');
+
+        try {
+            const request = new FormData();
+            request.append('target', input.dataset.directUploadTarget);
+            request.append('filename', file.name);
+            request.append('content_type', file.type);
+            request.append('size', file.size);
+            const response = await fetch(input.dataset.directUpload, {
+                method: 'POST',
+                body: request,
+                credentials: 'same-origin',
+                headers: {'X-CSRFToken': getCookie('csrftoken')}
+            });
+            const slot = await response.json();
+            if (!response.ok) {
+                throw new Error(slot.error);
+            }
+
+            // the policy of the slot requires its fields to come before the file
+            const post = new FormData();
+            Object.keys(slot.fields).forEach(function (name) { post.append(name, slot.fields[name]); });
+            post.append('file', file);
+            const stored = await fetch(slot.url, {method: 'POST', body: post});
+            if (!stored.ok) {
+                throw new Error('The file store refused the upload (' + stored.status + ')');
+            }
+
+            tokenInput.value = slot.token;
+            input.value = '';
+            setStatus(input, 'Uploaded ' + file.name);
+        } catch (error) {
+            // the file stays in the input and is posted with the form instead
+            setStatus(input, error.message);
+        } finally {
+            submits.forEach(function (button) { button.disabled = false; });
+        }
+    }
+
+    // inline rows are added after the page loads, so the inputs are found when they change
+    document.addEventListener('change', function (event) {
+        const input = event.target;
+        if (input.matches && input.matches('input[type="file"][data-direct-upload]') && input.files.length > 0) {
+            upload(input);
+        }
+    });
+})();
@@ -0,0 +1,130 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from necrotopia.models import CardSide, Grade, ItemCard, ItemCardFace, ItemPdf, ItemPicture, ModuleAssembly, \
+    RatedSkillItem, ResourceItem, SkillItem, SkillRatings, UserProfile, Wallet, WalletItem, WalletResource
+
+
+class ChangelistQueryTests(TestCase):
+    def setUp(self):
+        self.registrar = UserProfile.objects.create_superuser(email='admin@necrotopia.test', password='password')
+        self.client.force_login(self.registrar)
+        self.resource = ResourceItem.objects.create(name='Alloy Metal', registrar=self.registrar)
+
+    def add_rows(self, count: int):
+        for index in range(count):
+            blueprint = ModuleAssembly.objects.create(name='Blueprint {index}'.format(index=index), tags='gizmo',
+                                                      registrar=self.registrar)
+            if index % 2 == 0:
+                ItemPicture.objects.create(picture='static_images/{index}.png'.format(index=index),
+                                           imd_assembly_item=blueprint)
+            if index % 3 == 0:
+                ItemPdf.objects.create(pdf='pdf/{index}.pdf'.format(index=index), pdf_assembly_item=blueprint)
+
+            wallet = Wallet.objects.create(name='Wallet {index}'.format(index=index), owner_link=self.registrar)
+            for _ in range(index % 4):
+                WalletResource.objects.create(wallet_link=wallet, resource_link=self.resource)
+            WalletItem.objects.create(wallet_link=wallet, module_link=blueprint)
+
+            card = ItemCard.objects.create(registrar=self.registrar)
+            ItemCardFace.objects.create(card_side=CardSide.Front, image='item_card_faces/front.png',
+                                        img_parent_card=card)
+            if index % 2 == 0:
+                ItemCardFace.objects.create(card_side=CardSide.Back, image='item_card_faces/back.png',
+                                            img_parent_card=card)
+
+            skill = SkillItem.objects.create(name='Skill {index}'.format(index=index), registrar=self.registrar)
+            for grade in (Grade.Master, Grade.Basic):
+                SkillRatings.objects.create(skill=skill, grade=grade, description='{grade} {index}'.format(
+                    grade=grade.name, index=index))
+
+    def count_queries(self, url: str) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        return len(queries)
+
+    def test_constant_query_count(self):
+        urls = ('/admin/necrotopia/moduleassembly/', '/admin/necrotopia/wallet/', '/admin/necrotopia/itemcard/',
+                '/admin/necrotopia/skillitem/')
+
+        self.add_rows(3)
+        few = [self.count_queries(url) for url in urls]
+        self.add_rows(30)
+        many = [self.count_queries(url) for url in urls]
+
+        self.assertEqual(few, many)
+
+    def test_annotations(self):
+        self.add_rows(4)
+
+        blueprints = {blueprint.name: blueprint for blueprint in ModuleAssembly.objects.with_media()}
+        with self.assertNumQueries(0):
+            self.assertEqual([blueprints['Blueprint {index}'.format(index=index)].has_image() for index in range(4)],
+                             [True, False, True, False])
+            self.assertEqual([blueprints['Blueprint {index}'.format(index=index)].has_pdf() for index in range(4)],
+                             [True, False, False, True])
+
+        wallet = Wallet.objects.with_counts().get(name='Wallet 3')
+        self.assertEqual((wallet.resource_count, wallet.item_count), (3, 1))
+        self.assertEqual(Wallet.objects.with_counts().get(name='Wallet 0').resource_count, 0)
+
+        cards = list(ItemCard.objects.with_faces().order_by('pk'))
+        with self.assertNumQueries(0):
+            self.assertEqual([(card.has_front(), card.has_back()) for card in cards],
+                             [(True, True), (True, False), (True, True), (True, False)])
+
+        # without the annotations the model methods still query
+        self.assertEqual(ModuleAssembly.objects.get(name='Blueprint 0').has_image(), True)
+
+
+class SkillQueryTests(TestCase):
+    def setUp(self):
+        self.registrar = UserProfile.objects.create_user(email='registrar@necrotopia.test', password='password')
+        resource = ResourceItem.objects.create(name='Alloy Metal', registrar=self.registrar)
+        for index in range(3):
+            skill = SkillItem.objects.create(name='Skill {index}'.format(index=index), registrar=self.registrar)
+            for grade in (Grade.Proficient, Grade.Basic):
+                SkillRatings.objects.create(skill=skill, grade=grade, description='{grade} rating of skill {index}, '
+                                            'long enough to be truncated'.format(grade=grade.name, index=index))
+            RatedSkillItem.objects.create(resource_item=resource, skill=skill, grade=Grade.Basic)
+        SkillItem.objects.create(name='Unrated', registrar=self.registrar)
+
+    def test_with_first_rating(self):
+        with self.assertNumQueries(1):
+            descriptions = [skill.trunc_description() for skill in SkillItem.objects.with_first_rating()]
+
+        self.assertEqual(descriptions[0], 'Basic rating of skill 0, long enough to be truncat...')
+        self.assertEqual(descriptions[-1], '')
+
+    def test_prefetched_ratings(self):
+        with self.assertNumQueries(2):
+            descriptions = [skill.trunc_description()
+                            for skill in SkillItem.objects.prefetch_related('skillratings_set')]
+
+        self.assertEqual(descriptions, [skill.trunc_description() for skill in SkillItem.objects.all()])
+
+    def test_with_skill(self):
+        with self.assertNumQueries(1):
+            names = [str(rated_skill) for rated_skill in RatedSkillItem.objects.with_skill().order_by('skill__name')]
+
+        self.assertEqual(names[0], 'Basic Skill 0 [5 mind , 10 minutes]')
+
+    def test_resource_change_form(self):
+        admin = UserProfile.objects.create_superuser(email='admin@necrotopia.test', password='password')
+        self.client.force_login(admin)
+        resource = ResourceItem.objects.get(name='Alloy Metal')
+        url = '/admin/necrotopia/resourceitem/{pk}/change/'.format(pk=resource.pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, 'Basic Skill 0 [5 mind , 10 minutes]')
+
+        for index in range(3, 10):
+            skill = SkillItem.objects.create(name='Skill {index}'.format(index=index), registrar=self.registrar)
+            RatedSkillItem.objects.create(resource_item=resource, skill=skill, grade=Grade.Basic)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(url)
+        self.assertContains(response, 'Basic Skill 9 [5 mind , 10 minutes]')
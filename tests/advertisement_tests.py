@@ -0,0 +1,134 @@
+import tempfile
+from datetime import datetime, timedelta
+from unittest import mock
+from zoneinfo import ZoneInfo
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from necrotopia.advertisements import ActiveAdvertisement, AdvertisementCache
+from necrotopia.models import Advertisement, UserProfile
+from tests.image_tests import make_image
+
+
+class AdvertisementCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # the images and their thumbnails are kept in S3 outside of tests
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        storage = FileSystemStorage(location=directory.name, base_url='/media/')
+        for name in ('running', 'unpublished', 'finished'):
+            storage.save('advertisements/{name}.png'.format(name=name), ContentFile(make_image(800, 400, 'PNG')))
+        storage_patch = mock.patch.object(Advertisement._meta.get_field('image'), 'storage', storage)
+        storage_patch.start()
+        self.addCleanup(storage_patch.stop)
+        settings_override = override_settings(IMAGEKIT_DEFAULT_FILE_STORAGE='django.core.files.storage.'
+                                                                            'FileSystemStorage',
+                                              MEDIA_ROOT=directory.name, MEDIA_URL='/media/')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.registrar = UserProfile.objects.create_user(email='registrar@necrotopia.test', password='password')
+        today = timezone.localdate()
+        self.running = Advertisement.objects.create(name='Running', image='advertisements/running.png',
+                                                    published=True, start_date=today - timedelta(days=1),
+                                                    end_date=today + timedelta(days=1), registrar=self.registrar)
+        Advertisement.objects.create(name='Unpublished', image='advertisements/unpublished.png', published=False,
+                                     start_date=today, end_date=today, registrar=self.registrar)
+        Advertisement.objects.create(name='Finished', image='advertisements/finished.png', published=True,
+                                     start_date=today - timedelta(days=5), end_date=today - timedelta(days=1),
+                                     registrar=self.registrar)
+
+    def tearDown(self):
+        cache.clear()
+
+    @staticmethod
+    def count_advertisement_queries(queries) -> int:
+        return len([query for query in queries if 'necrotopia_advertisement' in query['sql']])
+
+    def test_active(self):
+        active = AdvertisementCache.get_active()
+
+        self.assertEqual([advertisement.name for advertisement in active], ['Running'])
+        self.assertIsInstance(active[0], ActiveAdvertisement)
+        # the carousel shows the thumbnail made on save until the renditions of the image are made
+        self.assertEqual(active[0].image_url, self.running.carousel.url)
+
+    def test_home_is_cached(self):
+        self.client.get('/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/')
+
+        self.assertEqual(self.count_advertisement_queries(queries), 0)
+        self.assertContains(response, self.running.carousel.url)
+        self.assertNotContains(response, 'advertisements/finished')
+
+    def test_opted_out(self):
+        user = UserProfile.objects.create_user(email='player@necrotopia.test', password='password')
+        user.display_game_advertisements = False
+        user.save()
+        self.client.force_login(user)
+
+        self.assertIsNone(self.client.get('/').context['advertisements'])
+
+    def test_invalidated_on_save_and_delete(self):
+        self.assertEqual(len(AdvertisementCache.get_active()), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            advertisement = Advertisement.objects.get(name='Unpublished')
+            advertisement.published = True
+            advertisement.save()
+        self.assertEqual([advertisement.name for advertisement in AdvertisementCache.get_active()],
+                         ['Running', 'Unpublished'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.running.delete()
+        self.assertEqual([advertisement.name for advertisement in AdvertisementCache.get_active()], ['Unpublished'])
+
+    def test_pending_renditions(self):
+        with mock.patch.object(AdvertisementCache, 'pending_timeout', 0):
+            AdvertisementCache.get_active()
+            # the running advertisement has no renditions yet, so the list is not kept until midnight
+            with CaptureQueriesContext(connection) as queries:
+                AdvertisementCache.get_active()
+            self.assertEqual(self.count_advertisement_queries(queries), 1)
+
+            # made by the worker, without the list being dropped from this cache
+            Advertisement.objects.filter(pk=self.running.pk).update(
+                renditions={'source': self.running.image.name, 'items': []})
+            AdvertisementCache.get_active()
+            with CaptureQueriesContext(connection) as queries:
+                AdvertisementCache.get_active()
+            self.assertEqual(self.count_advertisement_queries(queries), 0)
+
+    def test_rolls_over_at_midnight(self):
+        AdvertisementCache.get_active()
+        tomorrow = timezone.localtime() + timedelta(days=2)
+
+        with mock.patch('necrotopia.advertisements.timezone.localtime', return_value=tomorrow):
+            self.assertEqual(AdvertisementCache.get_active(), [])
+
+    def test_timeout(self):
+        now = datetime(2024, 6, 1, 23, 50, tzinfo=ZoneInfo('America/New_York'))
+
+        with mock.patch('necrotopia.caching.default_storage', mock.Mock(querystring_auth=False)):
+            self.assertEqual(AdvertisementCache.get_timeout(now), 600)
+        # signed image URLs must not outlive their signatures
+        with mock.patch('necrotopia.caching.default_storage',
+                        mock.Mock(querystring_auth=True, querystring_expire=600)):
+            self.assertEqual(AdvertisementCache.get_timeout(now), 300)
+
+    def test_seconds_to_midnight(self):
+        zone = ZoneInfo('America/New_York')
+
+        self.assertEqual(AdvertisementCache.get_seconds_to_midnight(datetime(2024, 6, 1, 23, 0, tzinfo=zone)), 3600)
+        # the clocks go back an hour overnight, so that night is an hour longer
+        self.assertEqual(AdvertisementCache.get_seconds_to_midnight(datetime(2024, 11, 2, 23, 0, tzinfo=zone)), 3600)
+        self.assertEqual(AdvertisementCache.get_seconds_to_midnight(datetime(2024, 11, 3, 0, 0, tzinfo=zone)),
+                         25 * 3600)
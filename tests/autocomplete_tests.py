@@ -0,0 +1,104 @@
+import time
+
+from necrotopia.autocomplete import AUTOCOMPLETE_INDEX, PrefixCache, PrefixIndex
+from necrotopia.models import ModuleAssembly, ResourceItem, Rule, SkillItem
+from tests.component_tests import HelperFactory, MECHANICAL_AUTO_FRAME
+from tests.crafting_tests import BlueprintTestCase
+
+
+class PrefixCacheTests(BlueprintTestCase):
+    def test_lru(self):
+        cache = PrefixCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl(self):
+        cache = PrefixCache(ttl=0)
+        cache.set('a', 1)
+        time.sleep(0.001)
+
+        self.assertIsNone(cache.get('a'))
+
+
+class PrefixIndexTests(BlueprintTestCase):
+    def setUp(self):
+        super().setUp()
+        self.save_component(HelperFactory.get_master_raider_ride())
+        self.rule = Rule.objects.create(name='Mechanics of Crafting', registrar=self.registrar)
+        self.skill = SkillItem.objects.create(name='Mechanic', registrar=self.registrar)
+        AUTOCOMPLETE_INDEX.reset()
+
+    def tearDown(self):
+        AUTOCOMPLETE_INDEX.reset()
+
+    def get_names(self, text: str, limit: int = 10) -> list:
+        return [result['name'] for result in AUTOCOMPLETE_INDEX.search(text, limit)]
+
+    def test_whole_names_first(self):
+        self.assertEqual(self.get_names('mech'), [
+            'Mechanic', MECHANICAL_AUTO_FRAME, 'Mechanical Components', 'Mechanical Engine', 'Mechanical Gear System',
+            'Mechanics of Crafting'])
+
+    def test_any_word(self):
+        self.assertEqual(self.get_names('cRaft  '), ['Mechanics of Crafting'])
+        self.assertEqual(self.get_names('auto fr'), [MECHANICAL_AUTO_FRAME])
+
+    def test_limit(self):
+        self.assertEqual(len(self.get_names('m', limit=2)), 2)
+        self.assertEqual(self.get_names(' '), [])
+
+    def test_cached(self):
+        self.get_names('mech')
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.get_names('mech')), 6)
+
+    def test_signals(self):
+        self.get_names('mech')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.skill.name = 'Tinkering'
+            self.skill.save()
+            ResourceItem.objects.create(name='Tin', registrar=self.registrar)
+            self.rule.delete()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_names('tin'), ['Tin', 'Tinkering'])
+            self.assertNotIn('Mechanics of Crafting', self.get_names('mech'))
+
+    def test_reload(self):
+        index = PrefixIndex(max_age=0)
+        index.search('mech')
+        ModuleAssembly.objects.filter(name=MECHANICAL_AUTO_FRAME).update(name='Chassis')
+        time.sleep(0.001)
+
+        self.assertEqual([result['name'] for result in index.search('chas')], ['Chassis'])
+
+    def test_view(self):
+        response = self.client.get('/autocomplete/', {'q': 'mechanic', 'limit': 1})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [
+            {'type': 'skill', 'id': self.skill.pk, 'name': 'Mechanic', 'url': '/skill_view/{pk}'.format(
+                pk=self.skill.pk)}])
+
+    def test_speed(self):
+        ModuleAssembly.objects.bulk_create(
+            ModuleAssembly(name='Blueprint {index}'.format(index=index), registrar=self.registrar)
+            for index in range(5000))
+        AUTOCOMPLETE_INDEX.load()
+
+        timings = []
+        for prefix in ('b', 'bl', 'blueprint 4', 'blueprint 49', 'mech', 'x') * 20:
+            AUTOCOMPLETE_INDEX.cache.clear()
+            started = time.perf_counter()
+            AUTOCOMPLETE_INDEX.search(prefix)
+            timings.append(time.perf_counter() - started)
+
+        timings.sort()
+        self.assertLess(timings[int(len(timings) * 0.99)], 0.01)
@@ -0,0 +1,171 @@
+import tempfile
+import threading
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+from django.test import SimpleTestCase, override_settings
+
+from necrotopia.caching import get_cache_settings, parse_cache_url
+from necrotopia.checks import check_shared_cache
+
+TIERED_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default-tests'},
+    'tiered': {
+        'BACKEND': 'necrotopia.caching.TieredCache',
+        'LOCATION': 'tiered-shared',
+        'OPTIONS': {'LOCAL_SIZE': 3, 'LOCAL_TIMEOUT': 0.3, 'LOCK_WAIT': 2, 'LOCK_POLL': 0.01},
+    },
+    'tiered-shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tiered-shared',
+                      'KEY_PREFIX': 'necrotopia', 'VERSION': 2},
+}
+
+
+class CacheUrlTests(SimpleTestCase):
+    def test_parse(self):
+        self.assertEqual(parse_cache_url('locmem://necrotopia'),
+                         {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'necrotopia',
+                          'OPTIONS': {}})
+        self.assertEqual(parse_cache_url('file:///var/tmp/necrotopia')['LOCATION'], '/var/tmp/necrotopia')
+        self.assertEqual(parse_cache_url('db://cache_table')['LOCATION'], 'cache_table')
+        self.assertEqual(parse_cache_url('memcached://cache:11211')['LOCATION'], 'cache:11211')
+
+        redis = parse_cache_url('redis://cache:6379/0?db=1&socket_timeout=x')
+        self.assertEqual((redis['BACKEND'], redis['LOCATION']),
+                         ('django.core.cache.backends.redis.RedisCache', 'redis://cache:6379/0'))
+        self.assertEqual(redis['OPTIONS'], {'db': 1, 'socket_timeout': 'x'})
+
+        with self.assertRaises(InvalidCacheBackendError):
+            parse_cache_url('nonsense://cache')
+
+    def test_settings(self):
+        settings = get_cache_settings('redis://cache:6379/0', 60, 'necrotopia', 3, 100, 5)
+
+        self.assertEqual(settings['default']['BACKEND'], 'necrotopia.caching.TieredCache')
+        self.assertEqual(settings['default']['LOCATION'], 'shared')
+        self.assertEqual({name: settings['shared'][name] for name in ('TIMEOUT', 'KEY_PREFIX', 'VERSION')},
+                         {'TIMEOUT': 60, 'KEY_PREFIX': 'necrotopia', 'VERSION': 3})
+        # without an in-process tier the shared cache is the default one
+        self.assertEqual(list(get_cache_settings('locmem://x', 60, '', 1, 0, 5)), ['default'])
+
+    def test_check(self):
+        for url, debug, warned in (('locmem://x', False, True), ('locmem://x', True, False),
+                                   ('redis://cache:6379/0', False, False)):
+            for local_size in (0, 100):
+                with override_settings(CACHES=get_cache_settings(url, 60, '', 1, local_size, 5), DEBUG=debug):
+                    self.assertEqual([error.id for error in check_shared_cache(None)],
+                                     ['necrotopia.W001'] if warned else [])
+
+
+@override_settings(CACHES=TIERED_CACHES)
+class TieredCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = caches['tiered']
+        self.shared = caches['tiered-shared']
+        self.cache.clear()
+        self.cache.stats.reset()
+
+    def test_tiers(self):
+        self.cache.set('name', ['Alloy Metal'])
+
+        value = self.cache.get('name')
+        value.append('changed')
+        self.assertEqual(self.cache.get('name'), ['Alloy Metal'])
+        self.assertEqual(self.shared.get('name'), ['Alloy Metal'])
+        self.assertEqual(self.cache.get('missing', 'default'), 'default')
+        self.assertEqual(self.cache.stats.as_dict(),
+                         {'local_hits': 2, 'shared_hits': 0, 'misses': 1, 'fills': 0, 'lock_waits': 0})
+
+        # the in-process copy is refreshed from the shared cache once it expires
+        self.shared.set('name', ['Scrap Metal'])
+        self.assertEqual(self.cache.get('name'), ['Alloy Metal'])
+        time.sleep(0.35)
+        self.assertEqual(self.cache.get('name'), ['Scrap Metal'])
+        self.assertEqual(self.cache.stats.shared_hits, 1)
+        self.assertAlmostEqual(self.cache.stats.HitRate, 0.8)
+
+    def test_delete_and_versions(self):
+        self.cache.set('name', 'one')
+        self.cache.set('name', 'two', version=3)
+
+        self.assertEqual((self.cache.get('name'), self.cache.get('name', version=3)), ('one', 'two'))
+        self.assertEqual(self.shared.get('name', version=2), 'one')
+
+        self.cache.delete('name')
+        self.assertIsNone(self.cache.get('name'))
+        self.assertEqual(self.cache.get('name', version=3), 'two')
+
+        self.cache.set('count', 1)
+        self.assertEqual(self.cache.incr('count'), 2)
+        self.assertEqual(self.cache.get('count'), 2)
+
+        self.cache.set('gone', 'value', timeout=0)
+        self.assertFalse(self.cache.has_key('gone'))
+
+    def test_least_recently_used(self):
+        for index in range(4):
+            self.cache.set('key-{index}'.format(index=index), index)
+
+        self.assertEqual(len(self.cache.local), 3)
+        self.assertEqual(self.cache.get('key-0'), 0)
+        self.assertEqual(self.cache.stats.shared_hits, 1)
+
+    def test_get_or_set_threads(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'value'
+
+        results = []
+
+        def read():
+            # each thread has its own backend instance, sharing the in-process tier
+            results.append(caches['tiered'].get_or_set('slow', compute))
+
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.cache.stats.fills, 1)
+        # each read is counted once, however long it waited
+        self.assertEqual(self.cache.stats.misses + self.cache.stats.local_hits, 8)
+        self.assertFalse(self.shared.has_key('slow:lock'))
+
+    def test_get_or_set_other_process(self):
+        # another process holds the lock and stores the value a little later
+        self.shared.add('slow:lock', 1)
+        threading.Timer(0.1, lambda: self.shared.set('slow', 'theirs')).start()
+
+        self.assertEqual(self.cache.get_or_set('slow', lambda: 'ours'), 'theirs')
+        self.assertEqual(self.cache.stats.lock_waits, 1)
+        self.assertEqual(self.cache.stats.fills, 0)
+
+        # a lock left behind by a process that died is waited on for at most LOCK_WAIT seconds
+        self.shared.add('abandoned:lock', 1)
+        self.assertEqual(self.cache.get_or_set('abandoned', lambda: 'ours'), 'ours')
+        self.assertTrue(self.shared.has_key('abandoned:lock'))
+
+
+class FileTieredCacheTests(SimpleTestCase):
+    def test_file_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            settings = {
+                'default': {'BACKEND': 'necrotopia.caching.TieredCache', 'LOCATION': 'file-shared'},
+                'file-shared': parse_cache_url('file://{directory}'.format(directory=directory)),
+            }
+
+            with override_settings(CACHES=settings):
+                cache = caches['default']
+                cache.set('name', {'grade': 'Basic'})
+                self.assertEqual(caches['file-shared'].get('name'), {'grade': 'Basic'})
+
+                # what another process sees: nothing in its own tier, the value on disk
+                cache.local.clear()
+                self.assertEqual(cache.get('name'), {'grade': 'Basic'})
+                self.assertEqual(cache.stats.shared_hits, 1)
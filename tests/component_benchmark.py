@@ -0,0 +1,64 @@
+"""
+    Compares the memory use and evaluation throughput of Component trees against their ComponentArray form.
+
+    python -m tests.component_benchmark [number of trees]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'necrotopia_project.settings')
+django.setup()
+
+from necrotopia.Component import ComponentFactory
+from tests.component_tests import HelperFactory
+
+
+def measure(build):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, current, elapsed
+
+
+def evaluate(trees) -> float:
+    started = time.perf_counter()
+    for tree in trees:
+        tree.collapse()
+        tree.get_total_mind()
+        tree.get_total_time()
+
+    return time.perf_counter() - started
+
+
+def main(count: int):
+    components, component_bytes, component_build = measure(
+        lambda: [HelperFactory.get_master_raider_ride() for _ in range(count)])
+
+    names, name_ids = [], dict()
+    arrays, array_bytes, array_build = measure(
+        lambda: [ComponentFactory.compact(tree, names, name_ids) for tree in components])
+
+    for component, compact in zip(components[:10], arrays[:10]):
+        assert component.collapse() == compact.collapse()
+        assert component.get_total_mind() == compact.get_total_mind()
+        assert component.get_total_time() == compact.get_total_time()
+
+    nodes = len(arrays[0])
+    print('{count} master raider rides, {nodes} nodes each'.format(count=count, nodes=nodes))
+    print('{:<16}{:>14}{:>14}{:>14}'.format('', 'bytes/tree', 'build (s)', 'evaluate (s)'))
+    print('{:<16}{:>14.0f}{:>14.3f}{:>14.3f}'.format(
+        'Component', component_bytes / count, component_build, evaluate(components)))
+    print('{:<16}{:>14.0f}{:>14.3f}{:>14.3f}'.format(
+        'ComponentArray', array_bytes / count, array_build, evaluate(arrays)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -1,6 +1,6 @@
 import unittest
 
-from necrotopia.Component import Component, ComponentFactory
+from necrotopia.Component import Component, ComponentArray, ComponentFactory
 from necrotopia.models import Grade
 
 ALLOY_METAL = "Alloy Metal"
@@ -272,6 +272,84 @@ class ComponentTests(unittest.TestCase):
         mind = master_raider_ride.get_total_mind()
         time = master_raider_ride.get_total_time()
 
+    def test_evaluate(self):
+        master_raider_ride = HelperFactory.get_master_raider_ride()
+        totals = master_raider_ride.evaluate()
+
+        self.assertEqual(totals.resources, master_raider_ride.collapse())
+        self.assertEqual(totals.mind, 180)
+        self.assertEqual(totals.time, 420)
+
+    def test_sub_assembly_quantity(self):
+        basic_frame = HelperFactory.get_basic_frame()
+        basic_frame.quantity = 3
+
+        result = ComponentFactory.create(name=GLITTER_GULCH_RAIDER_RIDE, quantity=1, mind=5, time=20, grade=Grade.Basic)
+        result.add(basic_frame)
+        result.add(ComponentFactory.create(name=BASIC_SCRAP, quantity=5))
+
+        resources = result.collapse()
+        self.assertEqual(resources[ALLOY_METAL], 9)
+        self.assertEqual(resources[MACHINED_COMPONENTS], 6)
+        self.assertEqual(resources[BASIC_SCRAP], 5)
+        self.assertEqual(result.get_total_mind(), 20)
+        self.assertEqual(result.get_total_time(), 80)
+
+    def test_shared_sub_assembly(self):
+        basic_frame = HelperFactory.get_basic_frame()
+        first = ComponentFactory.create(name=MECHANICAL_ENGINE, mind=1)
+        first.add(basic_frame)
+        second = ComponentFactory.create(name=MECHANICAL_GEAR_SYSTEM, mind=1)
+        second.add(basic_frame)
+
+        result = ComponentFactory.create(name=GLITTER_GULCH_RAIDER_RIDE)
+        result.add(first)
+        result.add(second)
+
+        totals = result.evaluate()
+        self.assertEqual(totals.resources[ALLOY_METAL], 6)
+        self.assertEqual(totals.mind, 12)
+
+    def test_deep_tree(self):
+        depth = 10000
+        result = ComponentFactory.create(name=BASIC_SCRAP, quantity=1)
+        for level in range(depth):
+            parent = ComponentFactory.create(name=str(level), mind=1, time=2)
+            parent.add(result)
+            parent.add(ComponentFactory.create(name=HARD_METAL, quantity=1))
+            result = parent
+
+        totals = result.evaluate()
+        self.assertEqual(totals.resources[HARD_METAL], depth)
+        self.assertEqual(totals.resources[BASIC_SCRAP], 1)
+        self.assertEqual(totals.mind, depth)
+        self.assertEqual(totals.time, depth * 2)
+
+    def test_compact(self):
+        for component in (HelperFactory.get_basic_frame(), HelperFactory.get_proficient_raider_ride(),
+                          HelperFactory.get_master_raider_ride()):
+            compact = ComponentFactory.compact(component)
+            totals = component.evaluate()
+
+            self.assertEqual(compact.collapse(), totals.resources)
+            self.assertEqual(compact.get_total_mind(), totals.mind)
+            self.assertEqual(compact.get_total_time(), totals.time)
+
+    def test_compact_quantity(self):
+        compact = ComponentArray()
+        root = compact.append(-1, GLITTER_GULCH_RAIDER_RIDE, mind=5, time=20, grade=Grade.Basic)
+        frame = compact.append(root, MECHANICAL_AUTO_FRAME, quantity=3, mind=5, time=20, grade=Grade.Basic)
+        compact.append(frame, ALLOY_METAL, quantity=3)
+        compact.append(root, BASIC_SCRAP, quantity=5)
+
+        self.assertEqual(compact.collapse(), {ALLOY_METAL: 9, BASIC_SCRAP: 5})
+        self.assertEqual(compact.get_total_mind(), 20)
+        self.assertEqual(compact.get_total_time(), 80)
+        self.assertEqual(len(compact.names), 4)
+
+        with self.assertRaises(ValueError):
+            compact.append(10, BASIC_SCRAP)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,76 @@
+import io
+import unittest
+
+from django.core.management import call_command
+
+from necrotopia.cost_matrix import CraftingCostMatrix
+from necrotopia.crafting import CraftingGraph, CraftingLoopError
+from necrotopia.models import Grade
+from tests.component_tests import HelperFactory, GLITTER_GULCH_RAIDER_RIDE, MECHANICAL_AUTO_FRAME, ALLOY_METAL
+from tests.crafting_tests import GraphBuilder, BlueprintTestCase
+
+
+class CraftingCostMatrixTests(unittest.TestCase):
+    def test_matches_graph(self):
+        builder = GraphBuilder()
+        builder.add(HelperFactory.get_master_raider_ride())
+        matrix = CraftingCostMatrix.from_graph(builder.graph)
+
+        self.assertEqual(len(matrix.nodes), len(builder.graph.nodes))
+        for assembly_id, grade in builder.graph.nodes:
+            expected = builder.graph.expand(assembly_id, grade)
+            actual = matrix.get_bill(assembly_id, grade)
+
+            self.assertEqual(actual.resources, expected.resources)
+            self.assertEqual(actual.mind, expected.mind)
+            self.assertEqual(actual.time, expected.time)
+
+    def test_quantity_and_ungraded(self):
+        graph = CraftingGraph()
+        graph.add_assembly(1, GLITTER_GULCH_RAIDER_RIDE)
+        graph.add_assembly(2, MECHANICAL_AUTO_FRAME)
+        graph.add_grade(1, Grade.Basic, 5, 20)
+        graph.add_grade(2, Grade.Basic, 5, 20)
+        graph.add_resource(2, Grade.Basic, ALLOY_METAL, 3)
+        graph.add_sub_assembly(1, Grade.Basic, 2, Grade.Ungraded, 2)
+
+        bill = CraftingCostMatrix.from_graph(graph).get_bill(1, Grade.Basic)
+        self.assertEqual(bill.resources, {ALLOY_METAL: 6})
+        self.assertEqual(bill.mind, 15)
+        self.assertEqual(bill.time, 60)
+
+    def test_loop(self):
+        graph = CraftingGraph()
+        graph.add_assembly(1, GLITTER_GULCH_RAIDER_RIDE)
+        graph.add_assembly(2, MECHANICAL_AUTO_FRAME)
+        graph.add_grade(1, Grade.Basic)
+        graph.add_grade(2, Grade.Basic)
+        graph.add_sub_assembly(1, Grade.Basic, 2, Grade.Basic, 1)
+        graph.add_sub_assembly(2, Grade.Basic, 1, Grade.Basic, 1)
+
+        with self.assertRaises(CraftingLoopError):
+            CraftingCostMatrix.from_graph(graph)
+
+    def test_csv(self):
+        builder = GraphBuilder()
+        builder.add(HelperFactory.get_basic_frame())
+        output = io.StringIO()
+        CraftingCostMatrix.from_graph(builder.graph).write_csv(output)
+
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[0].split(',')[:5], ['blueprint_id', 'blueprint', 'grade', 'mind', 'time'])
+        self.assertEqual(lines[1].split(',')[1:5], [MECHANICAL_AUTO_FRAME, 'Basic', '5', '20'])
+
+
+class CraftingCostsCommandTests(BlueprintTestCase):
+    def test_command(self):
+        master_raider_ride = HelperFactory.get_master_raider_ride()
+        ride = self.save_component(master_raider_ride)
+
+        output = io.StringIO()
+        call_command('crafting_costs', stdout=output)
+        self.assertEqual(len(output.getvalue().splitlines()), 1 + len(self.grades))
+
+        bill = CraftingCostMatrix.build().get_bill(ride.line_id, Grade.Master)
+        self.assertEqual(bill.resources, master_raider_ride.collapse())
+        self.assertEqual(bill.mind, 180)
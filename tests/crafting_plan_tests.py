@@ -0,0 +1,81 @@
+import unittest
+
+from necrotopia.crafting_plan import CraftingPlanner, WalletInventory
+from necrotopia.models import Grade, Wallet, WalletItem, WalletResource
+from tests.component_tests import HelperFactory, ALLOY_METAL, BASIC_SCRAP, GLITTER_GULCH_RAIDER_RIDE, HARD_METAL, \
+    MACHINED_COMPONENTS, MECHANICAL_AUTO_FRAME, MECHANICAL_COMPONENTS, RECOVERED_ELECTRONICS
+from tests.crafting_tests import BlueprintTestCase, GraphBuilder
+
+
+class CraftingPlannerTests(unittest.TestCase):
+    def setUp(self):
+        self.builder = GraphBuilder()
+        self.ride = self.builder.add(HelperFactory.get_master_raider_ride())
+        self.frame = self.builder.get_assembly_id(MECHANICAL_AUTO_FRAME)
+        self.planner = CraftingPlanner(self.builder.graph)
+
+    def test_empty_wallet(self):
+        plan = self.planner.plan(WalletInventory(), self.ride, Grade.Basic)
+        expected = self.builder.graph.expand(self.ride, Grade.Basic)
+
+        self.assertFalse(plan.can_build)
+        self.assertEqual(plan.missing, expected.resources)
+        self.assertEqual(plan.mind, expected.mind)
+        self.assertEqual(plan.time, expected.time)
+        self.assertEqual(plan.steps[-1].assembly_id, self.ride)
+        self.assertEqual(len(plan.steps), 4)
+
+    def test_full_wallet(self):
+        inventory = WalletInventory()
+        for name, quantity in self.builder.graph.expand(self.ride, Grade.Basic).resources.items():
+            inventory.add_resource(name, quantity + 1)
+
+        plan = self.planner.plan(inventory, self.ride, Grade.Basic)
+        self.assertTrue(plan.can_build)
+        self.assertEqual(plan.used_resources[BASIC_SCRAP], 5)
+
+    def test_owned_sub_assembly(self):
+        inventory = WalletInventory()
+        inventory.add_item(self.ride, Grade.Proficient, 1)
+        inventory.add_item(self.frame, Grade.Basic, 1)
+
+        plan = self.planner.plan(inventory, self.ride, Grade.Master)
+        crafted = {(step.name, step.grade) for step in plan.steps}
+
+        # the owned proficient ride covers everything under it, so the owned frame is kept for the master frame
+        self.assertNotIn((GLITTER_GULCH_RAIDER_RIDE, Grade.Proficient), crafted)
+        self.assertNotIn((MECHANICAL_AUTO_FRAME, Grade.Basic), crafted)
+        self.assertIn((MECHANICAL_AUTO_FRAME, Grade.Proficient), crafted)
+        self.assertEqual(plan.used_items[(self.frame, Grade.Basic)], 1)
+        self.assertEqual(plan.mind, 180 - 75 - 5)
+        # master and proficient frames plus the three gear systems
+        self.assertEqual(plan.missing[ALLOY_METAL], 5)
+        self.assertNotIn(HARD_METAL, plan.used_resources)
+
+    def test_quantity(self):
+        plan = self.planner.plan(WalletInventory(), self.frame, Grade.Basic, quantity=3)
+
+        self.assertEqual(plan.missing, {ALLOY_METAL: 9, MACHINED_COMPONENTS: 6, RECOVERED_ELECTRONICS: 6})
+        self.assertEqual(plan.steps[0].count, 3)
+        self.assertEqual(plan.mind, 15)
+
+
+class CraftingPlannerWalletTests(BlueprintTestCase):
+    def test_plan_many(self):
+        ride = self.save_component(HelperFactory.get_basic_raider_ride())
+        wallets = []
+        for index in range(5):
+            wallet = Wallet.objects.create(name=str(index), owner_link=self.registrar)
+            WalletResource.objects.create(wallet_link=wallet, resource_link=self.get_resource(MECHANICAL_COMPONENTS),
+                                          quantity=index)
+            WalletItem.objects.create(wallet_link=wallet, module_link=self.get_assembly(MECHANICAL_AUTO_FRAME),
+                                      grade=Grade.Basic)
+            wallets.append(wallet.pk)
+
+        with self.assertNumQueries(6):
+            plans = CraftingPlanner.load([ride.line_id]).plan_many(wallets, ride.line_id, Grade.Basic)
+
+        self.assertEqual(len(plans), 5)
+        self.assertEqual(plans[wallets[0]].missing[MECHANICAL_COMPONENTS], 1)
+        self.assertNotIn(MECHANICAL_COMPONENTS, plans[wallets[1]].missing)
+        self.assertEqual(plans[wallets[1]].mind, 15)
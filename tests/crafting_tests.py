@@ -0,0 +1,244 @@
+import time
+import unittest
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from necrotopia.Component import Component
+from necrotopia.crafting import CraftingGraph, CraftingLoopError, PartsListCache
+from necrotopia.models import Grade, ModuleAssembly, ModuleGrade, ModuleGradeResource, ModuleGradeSubAssembly, \
+    ResourceItem, UserProfile, ModuleAssemblyPartsList
+from tests.component_tests import HelperFactory, BASIC_SCRAP, GLITTER_GULCH_RAIDER_RIDE, MECHANICAL_AUTO_FRAME, \
+    MECHANICAL_ENGINE, HARD_METAL
+
+
+class GraphBuilder:
+    """
+        Registers an in-memory Component tree as blueprint grades, one blueprint per distinct name, the same way the
+        admin would enter it.
+    """
+
+    def __init__(self):
+        self.assembly_ids = dict()
+        self.graph = CraftingGraph()
+
+    def get_assembly_id(self, name: str) -> int:
+        if name not in self.assembly_ids:
+            self.assembly_ids[name] = len(self.assembly_ids) + 1
+            self.graph.add_assembly(self.assembly_ids[name], name)
+
+        return self.assembly_ids[name]
+
+    def add(self, component: Component) -> int:
+        assembly_id = self.get_assembly_id(component.name)
+        if (assembly_id, component.grade) in self.graph.nodes:
+            return assembly_id
+
+        self.graph.add_grade(assembly_id, component.grade, component.mind, component.time)
+
+        for sub_component in component.components.values():
+            if len(sub_component.components) > 0:
+                sub_assembly_id = self.add(sub_component)
+                self.graph.add_sub_assembly(assembly_id, component.grade, sub_assembly_id, sub_component.grade,
+                                            sub_component.quantity)
+            else:
+                self.graph.add_resource(assembly_id, component.grade, sub_component.name, sub_component.quantity)
+
+        return assembly_id
+
+
+class CraftingGraphTests(unittest.TestCase):
+    def assertMatchesComponent(self, component: Component):
+        builder = GraphBuilder()
+        assembly_id = builder.add(component)
+        bill = builder.graph.expand(assembly_id, component.grade)
+
+        self.assertEqual(bill.resources, component.collapse())
+        self.assertEqual(bill.mind, component.get_total_mind())
+        self.assertEqual(bill.time, component.get_total_time())
+
+    def test_frames(self):
+        self.assertMatchesComponent(HelperFactory.get_basic_frame())
+        self.assertMatchesComponent(HelperFactory.get_proficient_frame())
+        self.assertMatchesComponent(HelperFactory.get_master_frame())
+
+    def test_rides(self):
+        self.assertMatchesComponent(HelperFactory.get_basic_raider_ride())
+        self.assertMatchesComponent(HelperFactory.get_proficient_raider_ride())
+        self.assertMatchesComponent(HelperFactory.get_master_raider_ride())
+
+    def test_flatten_all_grades(self):
+        builder = GraphBuilder()
+        assembly_id = builder.add(HelperFactory.get_master_raider_ride())
+        result = builder.graph.flatten(assembly_id)
+
+        self.assertEqual(list(result.keys()), [Grade.Basic, Grade.Proficient, Grade.Master])
+        self.assertEqual(result[Grade.Master].mind, 180)
+        self.assertEqual(result[Grade.Proficient].time, 220)
+
+    def test_sub_assembly_quantity(self):
+        graph = CraftingGraph()
+        graph.add_assembly(1, GLITTER_GULCH_RAIDER_RIDE)
+        graph.add_assembly(2, MECHANICAL_AUTO_FRAME)
+        graph.add_grade(1, Grade.Basic, 5, 20)
+        graph.add_grade(2, Grade.Basic, 5, 20)
+        graph.add_resource(2, Grade.Basic, 'Alloy Metal', 3)
+        graph.add_sub_assembly(1, Grade.Basic, 2, Grade.Ungraded, 2)
+
+        bill = graph.expand(1, Grade.Basic)
+        self.assertEqual(bill.resources, {'Alloy Metal': 6})
+        self.assertEqual(bill.mind, 15)
+        self.assertEqual(bill.time, 60)
+
+    def test_loop(self):
+        graph = CraftingGraph()
+        graph.add_assembly(1, GLITTER_GULCH_RAIDER_RIDE)
+        graph.add_grade(1, Grade.Basic)
+        graph.add_sub_assembly(1, Grade.Basic, 1, Grade.Basic, 1)
+
+        with self.assertRaises(CraftingLoopError):
+            graph.expand(1, Grade.Basic)
+
+    def test_deep_chain(self):
+        graph = CraftingGraph()
+        depth = 5000
+        for assembly_id in range(depth):
+            graph.add_assembly(assembly_id, str(assembly_id))
+            graph.add_grade(assembly_id, Grade.Basic, 1, 1)
+            graph.add_resource(assembly_id, Grade.Basic, BASIC_SCRAP, 1)
+            if assembly_id > 0:
+                graph.add_sub_assembly(assembly_id, Grade.Basic, assembly_id - 1, Grade.Basic, 1)
+
+        bill = graph.expand(depth - 1, Grade.Basic)
+        self.assertEqual(bill.resources, {BASIC_SCRAP: depth})
+        self.assertEqual(bill.mind, depth)
+
+
+class BlueprintTestCase(TestCase):
+    """
+        Saves in-memory Component trees as blueprints, one ModuleAssembly per distinct name and one ModuleGrade per
+        distinct (name, grade).
+    """
+
+    def setUp(self):
+        self.registrar = UserProfile.objects.create_user(email='registrar@necrotopia.test', password='password')
+        self.assemblies = dict()
+        self.grades = dict()
+        self.resources = dict()
+
+    def get_assembly(self, name: str) -> ModuleAssembly:
+        if name not in self.assemblies:
+            self.assemblies[name] = ModuleAssembly.objects.create(name=name, registrar=self.registrar)
+
+        return self.assemblies[name]
+
+    def get_resource(self, name: str) -> ResourceItem:
+        if name not in self.resources:
+            self.resources[name] = ResourceItem.objects.create(name=name, registrar=self.registrar)
+
+        return self.resources[name]
+
+    def save_component(self, component: Component) -> ModuleAssembly:
+        assembly = self.get_assembly(component.name)
+        if (component.name, component.grade) in self.grades:
+            return assembly
+
+        grade = ModuleGrade.objects.create(module_assembly=assembly, name=component.name, grade=component.grade,
+                                           mind=component.mind, time=component.time)
+        self.grades[(component.name, component.grade)] = grade
+
+        for sub_component in component.components.values():
+            if len(sub_component.components) > 0:
+                ModuleGradeSubAssembly.objects.create(parent_grade=grade, quantity=sub_component.quantity,
+                                                      grade=sub_component.grade,
+                                                      assembly=self.save_component(sub_component))
+            else:
+                ModuleGradeResource.objects.create(parent_grade=grade, quantity=sub_component.quantity,
+                                                   resource=self.get_resource(sub_component.name))
+
+        return assembly
+
+
+class ModuleAssemblyFlattenTests(BlueprintTestCase):
+    def test_master_raider_ride(self):
+        master_raider_ride = HelperFactory.get_master_raider_ride()
+        assembly = self.save_component(master_raider_ride)
+
+        started = time.perf_counter()
+        with self.assertNumQueries(4):
+            result = assembly.flatten()
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(result[Grade.Master].resources, master_raider_ride.collapse())
+        self.assertEqual(result[Grade.Master].mind, master_raider_ride.get_total_mind())
+        self.assertEqual(result[Grade.Master].time, master_raider_ride.get_total_time())
+        self.assertLess(elapsed, 0.1)
+
+    def test_parts_list_cache(self):
+        master_raider_ride = HelperFactory.get_master_raider_ride()
+        ride = self.save_component(master_raider_ride)
+        engine = self.get_assembly(MECHANICAL_ENGINE)
+        frame = self.get_assembly(MECHANICAL_AUTO_FRAME)
+        # saving the grades gave the blueprints new revisions, as a view reading them would see
+        for assembly in (ride, engine, frame):
+            assembly.refresh_from_db()
+
+        PartsListCache.get_many([ride, engine, frame])
+        self.assertEqual(ModuleAssemblyPartsList.objects.filter(module_assembly=ride).count(), 3)
+
+        with self.assertNumQueries(1):
+            cached = PartsListCache.get(ride)
+        self.assertEqual(cached[Grade.Master].resources, master_raider_ride.collapse())
+        self.assertEqual(cached[Grade.Master].mind, 180)
+
+        # a change deep in the engine invalidates the engine and the ride, but not the unrelated frame
+        basic_engine = self.grades[(MECHANICAL_ENGINE, Grade.Basic)]
+        hard_metal = ModuleGradeResource.objects.get(parent_grade=basic_engine, resource__name=HARD_METAL)
+        hard_metal.quantity += 1
+        hard_metal.save()
+
+        self.assertFalse(ModuleAssemblyPartsList.objects.filter(module_assembly=ride).exists())
+        self.assertFalse(ModuleAssemblyPartsList.objects.filter(module_assembly=engine).exists())
+        self.assertTrue(ModuleAssemblyPartsList.objects.filter(module_assembly=frame).exists())
+
+        # the master ride uses the basic engine three times: once per engine grade and once through the basic ride
+        refreshed = PartsListCache.get(ride)
+        self.assertEqual(refreshed[Grade.Master].resources[HARD_METAL], master_raider_ride.collapse()[HARD_METAL] + 3)
+
+    def test_parts_list_version(self):
+        ride = self.save_component(HelperFactory.get_basic_raider_ride())
+        PartsListCache.get(ride)
+
+        ModuleAssembly.objects.filter(pk=ride.pk).update(last_update_date=timezone.now())
+        ride.refresh_from_db()
+
+        # the stale row is recomputed and re-stamped on the next read
+        self.assertEqual(PartsListCache.get(ride)[Grade.Basic].mind, 20)
+        self.assertEqual(ModuleAssemblyPartsList.objects.get(module_assembly=ride).version, ride.last_update_date)
+        with self.assertNumQueries(1):
+            PartsListCache.get(ride)
+
+    def test_parts_list_edited_while_expanding(self):
+        ride = self.save_component(HelperFactory.get_basic_raider_ride())
+        load = CraftingGraph.load
+
+        def load_then_edit(assembly_ids):
+            graph = load(assembly_ids)
+            # an edit commits between reading the tree and storing its lists
+            PartsListCache.invalidate([ride.line_id])
+            return graph
+
+        with mock.patch.object(CraftingGraph, 'load', load_then_edit):
+            self.assertEqual(PartsListCache.get(ride)[Grade.Basic].mind, 20)
+        self.assertFalse(ModuleAssemblyPartsList.objects.filter(module_assembly=ride).exists())
+
+        ride.refresh_from_db()
+        PartsListCache.get(ride)
+        self.assertEqual(ModuleAssemblyPartsList.objects.get(module_assembly=ride).revision, ride.parts_revision)
+        with self.assertNumQueries(1):
+            PartsListCache.get(ride)
+
+
+if __name__ == '__main__':
+    unittest.main()
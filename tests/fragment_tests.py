@@ -0,0 +1,130 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date
+
+from necrotopia.models import Grade, ModuleAssembly, Rule, SkillItem, SkillRatings, UserProfile
+from tests.component_tests import HelperFactory, BASIC_SCRAP, GLITTER_GULCH_RAIDER_RIDE
+from tests.crafting_tests import BlueprintTestCase
+
+
+class FragmentCacheTests(BlueprintTestCase):
+    def setUp(self):
+        super(FragmentCacheTests, self).setUp()
+        cache.clear()
+        self.save_component(HelperFactory.get_master_raider_ride())
+        self.ride = self.assemblies[GLITTER_GULCH_RAIDER_RIDE]
+        self.rule = Rule.objects.create(name='Scavenging', text='Search the ruins', registrar=self.registrar)
+        self.skill = SkillItem.objects.create(name='Tinkering', registrar=self.registrar)
+        SkillRatings.objects.create(skill=self.skill, grade=Grade.Basic, description='Fix a simple machine')
+
+    def tearDown(self):
+        cache.clear()
+
+    def get_urls(self) -> list:
+        return ['/rule_view/{pk}'.format(pk=self.rule.pk), '/skill_view/{pk}'.format(pk=self.skill.pk),
+                '/resource_view/{pk}'.format(pk=self.resources[BASIC_SCRAP].pk),
+                '/blueprint_view/{pk}'.format(pk=self.ride.pk)]
+
+    def test_cached_pages(self):
+        for url in self.get_urls():
+            first = self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                second = self.client.get(url)
+
+            self.assertEqual(second.status_code, 200)
+            self.assertEqual(second.context['fragment'].html, first.context['fragment'].html)
+            # only the stamp of the object is read
+            self.assertEqual(len(queries), 1, url)
+
+        self.assertContains(self.client.get(self.get_urls()[3]), GLITTER_GULCH_RAIDER_RIDE)
+        self.assertEqual(self.client.get('/rule_view/0').status_code, 404)
+        self.assertEqual(self.client.get('/resource_view/0').status_code, 404)
+
+    def test_not_modified(self):
+        for url in self.get_urls():
+            response = self.client.get(url)
+            self.assertIn('no-cache', response['Cache-Control'])
+
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_etag_depends_on_user(self):
+        url = self.get_urls()[0]
+        anonymous = self.client.get(url)['ETag']
+        self.client.force_login(UserProfile.objects.create_user(email='player@necrotopia.test', password='password'))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=anonymous)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], anonymous)
+
+    def test_purged_by_edits(self):
+        rule_url, skill_url, resource_url, blueprint_url = self.get_urls()
+        etags = {url: self.client.get(url)['ETag'] for url in self.get_urls()}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rule.text = 'Search the ruins carefully'
+            self.rule.save()
+            SkillRatings.objects.create(skill=self.skill, grade=Grade.Proficient, description='Fix a harder machine')
+            scrap = self.resources[BASIC_SCRAP]
+            scrap.name = 'Salvaged Scrap'
+            scrap.save()
+
+        for url in self.get_urls():
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, 200, url)
+
+        self.assertContains(self.client.get(rule_url), 'Search the ruins carefully')
+        self.assertContains(self.client.get(skill_url), 'Fix a harder machine')
+        self.assertContains(self.client.get(resource_url), 'Salvaged Scrap')
+        # the ride is built from scrap, so its parts list shows the new name too
+        self.assertContains(self.client.get(blueprint_url), 'Salvaged Scrap')
+
+    def test_stale_in_other_processes(self):
+        # the purges run once the edits commit, and only reach the cache of the process making them; without them
+        # the pages are still rendered again, since the edits moved their stamps
+        urls = self.get_urls()
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+
+        self.rule.text = 'Search the ruins carefully'
+        self.rule.save()
+        SkillRatings.objects.create(skill=self.skill, grade=Grade.Proficient, description='Fix a harder machine')
+        scrap = self.resources[BASIC_SCRAP]
+        scrap.name = 'Salvaged Scrap'
+        scrap.save()
+
+        for url in urls:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, 200, url)
+        self.assertContains(self.client.get(urls[1]), 'Fix a harder machine')
+        self.assertContains(self.client.get(urls[3]), 'Salvaged Scrap')
+
+        self.skill.refresh_from_db()
+        self.assertEqual(self.client.get(urls[1])['Last-Modified'], http_date(self.skill.fragment_stamp.timestamp()))
+
+    def test_stamps_leave_update_dates(self):
+        self.ride.refresh_from_db()
+        self.skill.refresh_from_db()
+
+        scrap = self.resources[BASIC_SCRAP]
+        scrap.name = 'Salvaged Scrap'
+        scrap.save()
+        SkillRatings.objects.create(skill=self.skill, grade=Grade.Proficient, description='Fix a harder machine')
+
+        # the ride and the skill are only shown differently; their dates in the admin stay those of their own edits
+        ride = ModuleAssembly.objects.get(pk=self.ride.pk)
+        skill = SkillItem.objects.get(pk=self.skill.pk)
+        self.assertEqual(ride.last_update_date, self.ride.last_update_date)
+        self.assertGreater(ride.fragment_stamp, self.ride.fragment_stamp)
+        self.assertEqual(skill.modified_date, self.skill.modified_date)
+        self.assertGreater(skill.fragment_stamp, self.skill.fragment_stamp)
+
+    def test_deleted(self):
+        url = self.get_urls()[1]
+        self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.skill.delete()
+
+        self.assertEqual(self.client.get(url).status_code, 404)
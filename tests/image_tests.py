@@ -0,0 +1,114 @@
+import io
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.test import TestCase
+from PIL import Image as PilImage
+from PIL.JpegImagePlugin import JpegImageFile
+
+from necrotopia.fragments import FragmentCache
+from necrotopia.images import ImagePipeline
+from necrotopia.models import BackgroundJob, JobStatus, Rule, RulePicture, UserProfile
+from necrotopia.tools import ImageTool
+
+
+def make_image(width: int, height: int, image_format: str = 'JPEG', orientation: int = None) -> bytes:
+    pil_image = PilImage.new('RGBA' if image_format == 'PNG' else 'RGB', (width, height), (200, 40, 40, 128))
+    exif = PilImage.Exif()
+    if orientation is not None:
+        exif[0x0112] = orientation
+
+    with io.BytesIO() as output:
+        pil_image.save(output, format=image_format, exif=exif.tobytes()) if image_format == 'JPEG' \
+            else pil_image.save(output, format=image_format)
+        return output.getvalue()
+
+
+class RenditionTests(TestCase):
+    def test_rotated_jpeg(self):
+        # stored on its side, a portrait photo once turned upright
+        output = ImageTool.render_rendition(make_image(1200, 800, orientation=6), 320, 320, 80)
+
+        self.assertEqual((output['width'], output['height']), (213, 320))
+        self.assertEqual(output['extension'], 'jpg')
+        self.assertEqual(PilImage.open(io.BytesIO(output['webp'])).format, 'WEBP')
+        self.assertEqual(PilImage.open(io.BytesIO(output['fallback'])).size, (213, 320))
+
+    def test_draft_mode(self):
+        with mock.patch.object(JpegImageFile, 'draft', autospec=True, wraps=JpegImageFile.draft) as draft:
+            output = ImageTool.render_rendition(make_image(2000, 1000), 320, 320, 80)
+
+        self.assertEqual(draft.call_args.args[1:], ('RGB', (320, 320)))
+        self.assertEqual((output['width'], output['height']), (320, 160))
+
+    def test_transparent_png(self):
+        output = ImageTool.render_rendition(make_image(400, 200, 'PNG'), 320, 320, 80)
+
+        self.assertEqual((output['width'], output['height'], output['extension']), (320, 160, 'png'))
+        self.assertEqual(PilImage.open(io.BytesIO(output['fallback'])).mode, 'RGBA')
+
+
+class ImagePipelineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = FileSystemStorage(location=self.directory.name, base_url='/media/')
+        self.registrar = UserProfile.objects.create_user(email='registrar@necrotopia.test', password='password')
+        self.rule = Rule.objects.create(name='Scavenging', text='Search the ruins', registrar=self.registrar)
+
+    def tearDown(self):
+        cache.clear()
+        self.directory.cleanup()
+
+    def add_picture(self, data: bytes) -> RulePicture:
+        with self.captureOnCommitCallbacks(execute=True):
+            return RulePicture.objects.create(picture=ContentFile(data, name='ruins.jpg'), rule_item=self.rule)
+
+    def test_renditions(self):
+        with mock.patch.object(RulePicture._meta.get_field('picture'), 'storage', self.storage):
+            picture = self.add_picture(make_image(2400, 1600))
+            job = BackgroundJob.objects.get(kind='render_images')
+            self.assertFalse(picture.has_renditions())
+            self.assertEqual(picture.get_responsive_image().src, picture.picture.url)
+
+            self.assertNotContains(self.client.get('/rule_view/{pk}'.format(pk=self.rule.pk)), 'type="image/webp"')
+
+            # the worker only drops the fragment from its own cache, which is not the one the web server reads
+            with mock.patch.object(FragmentCache, 'purge'):
+                call_command('run_jobs', once=True, stdout=io.StringIO())
+
+            job.refresh_from_db()
+            self.assertEqual(job.status, JobStatus.Done, job.message)
+            picture.refresh_from_db()
+            self.assertTrue(picture.has_renditions())
+            self.assertEqual([(item['rendition'], item['width']) for item in picture.renditions['items']],
+                             [('thumbnail', 320), ('card', 800), ('full', 1920)])
+            for item in picture.renditions['items']:
+                self.assertTrue(self.storage.exists(item['webp']))
+                self.assertTrue(self.storage.exists(item['fallback']))
+
+            image = picture.get_responsive_image()
+            self.assertTrue(image.src.endswith('.card.jpg'))
+            self.assertIn('.thumbnail.webp 320w', image.webp_srcset)
+
+            response = self.client.get('/rule_view/{pk}'.format(pk=self.rule.pk))
+            self.assertContains(response, 'type="image/webp"')
+            self.assertContains(response, '.full.jpg 1920w')
+
+            # saving the row again does not queue the work again
+            with self.captureOnCommitCallbacks(execute=True):
+                picture.save()
+            self.assertEqual(BackgroundJob.objects.count(), 1)
+
+    def test_small_image(self):
+        with mock.patch.object(RulePicture._meta.get_field('picture'), 'storage', self.storage):
+            picture = self.add_picture(make_image(500, 300))
+            renditions = ImagePipeline().process(self.storage, picture.picture.name)
+
+        # the card and full renditions would both be the original size
+        self.assertEqual([(item['rendition'], item['width']) for item in renditions['items']],
+                         [('thumbnail', 320), ('card', 500)])
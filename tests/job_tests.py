@@ -0,0 +1,196 @@
+import io
+import threading
+from datetime import timedelta
+
+from django.contrib.auth.models import Permission
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from necrotopia.jobs import JobQueue
+from necrotopia.models import BackgroundJob, JobStatus, OutboundEmail, Rule, UserProfile
+
+
+@JobQueue.register('test_echo')
+def echo(job: BackgroundJob) -> str:
+    JobQueue.set_progress(job, 1, 1)
+    if 'error' in job.arguments:
+        raise ValueError(job.arguments['error'])
+
+    return job.arguments['text']
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.registrar = UserProfile.objects.create_user(email='registrar@necrotopia.test', password='password')
+
+    def test_run_in_order(self):
+        first = JobQueue.enqueue('test_echo', {'text': 'first'})
+        second = JobQueue.enqueue('test_echo', {'text': 'second'})
+
+        self.assertEqual(JobQueue.claim().pk, first.pk)
+        self.assertEqual(JobQueue.claim().pk, second.pk)
+        self.assertIsNone(JobQueue.claim())
+
+        first.refresh_from_db()
+        self.assertEqual(first.status, JobStatus.Running)
+        self.assertEqual(first.attempts, 1)
+
+        job = JobQueue.run(first)
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.Done)
+        self.assertEqual(job.message, 'first')
+        self.assertEqual(job.get_percent(), 100)
+
+    def test_failed(self):
+        JobQueue.enqueue('test_echo', {'error': 'no such blueprint'})
+        self.assertEqual(JobQueue.work(until_empty=True), 1)
+
+        job = BackgroundJob.objects.get()
+        self.assertEqual(job.status, JobStatus.Failed)
+        self.assertEqual(job.message, 'ValueError: no such blueprint')
+        self.assertTrue(job.is_finished())
+
+    def test_unknown_kind(self):
+        with self.assertRaises(KeyError):
+            JobQueue.enqueue('no_such_job', {})
+
+    def test_requeue_stale(self):
+        stale = JobQueue.enqueue('test_echo', {'text': 'stale'})
+        tried = JobQueue.enqueue('test_echo', {'text': 'tried'})
+        JobQueue.claim()
+        JobQueue.claim()
+        beat = timezone.now() - timedelta(minutes=20)
+        BackgroundJob.objects.filter(pk=stale.pk).update(heartbeat_date=beat)
+        BackgroundJob.objects.filter(pk=tried.pk).update(heartbeat_date=beat, attempts=JobQueue.max_attempts)
+
+        self.assertEqual(JobQueue.requeue_stale(timedelta(minutes=10)), 2)
+        self.assertEqual(BackgroundJob.objects.get(pk=stale.pk).status, JobStatus.Queued)
+        self.assertEqual(BackgroundJob.objects.get(pk=tried.pk).status, JobStatus.Failed)
+        self.assertEqual(JobQueue.requeue_stale(timedelta(minutes=10)), 0)
+
+    def test_stale_while_running(self):
+        slow = JobQueue.enqueue('test_echo', {'text': 'slow'})
+        first = JobQueue.claim()
+        BackgroundJob.objects.filter(pk=slow.pk).update(heartbeat_date=timezone.now() - timedelta(minutes=20))
+
+        # another worker finds the job stale while it still runs, and runs it again
+        stale = []
+        self.assertEqual(JobQueue.work(until_empty=True, stale_after=timedelta(minutes=10), on_stale=stale.append), 1)
+        self.assertEqual(stale, [1])
+        second = BackgroundJob.objects.get(pk=slow.pk)
+        self.assertEqual((second.status, second.attempts), (JobStatus.Done, 2))
+
+        # the first run finishing late leaves the result of the second alone
+        first.arguments = {'error': 'too late'}
+        JobQueue.run(first)
+        self.assertEqual(first.status, JobStatus.Done)
+        self.assertEqual(BackgroundJob.objects.get(pk=slow.pk).message, 'slow')
+
+    def test_bulk_tagging(self):
+        first = Rule.objects.create(name='Scavenging', text='Search the ruins', registrar=self.registrar,
+                                    tags='ruins')
+        second = Rule.objects.create(name='Tinkering', text='Fix a machine', registrar=self.registrar)
+        superuser = UserProfile.objects.create_superuser(email='admin@necrotopia.test', password='password')
+        self.client.force_login(superuser)
+
+        response = self.client.post('/admin/necrotopia/rule/',
+                                    {'action': 'bulk_tagging', '_selected_action': [first.pk, second.pk],
+                                     'new_tags': 'craft', 'apply': 'Apply'})
+        job = BackgroundJob.objects.get()
+        self.assertRedirects(response, '/admin/necrotopia/backgroundjob/{pk}/progress/'.format(pk=job.pk))
+        self.assertEqual(job.requested_by, superuser)
+        self.assertContains(self.client.get(response['Location']), '<meta http-equiv="refresh"')
+
+        call_command('run_jobs', once=True, stdout=io.StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.Done, job.message)
+        self.assertEqual((job.progress, job.total), (2, 2))
+        self.assertEqual(Rule.objects.get(pk=first.pk).tags, 'craft ruins')
+        self.assertEqual(Rule.objects.get(pk=second.pk).tags, 'craft')
+
+        response = self.client.get('/admin/necrotopia/backgroundjob/{pk}/progress/'.format(pk=job.pk))
+        self.assertContains(response, 'Changed tags on 2 items')
+        self.assertNotContains(response, '<meta http-equiv="refresh"')
+
+    def test_progress_permissions(self):
+        staff = UserProfile.objects.create_user(email='staff@necrotopia.test', password='password', is_staff=True)
+        other = UserProfile.objects.create_user(email='other@necrotopia.test', password='password', is_staff=True)
+        superuser = UserProfile.objects.create_superuser(email='admin@necrotopia.test', password='password')
+        own = JobQueue.enqueue('test_echo', {'text': 'own'}, user=staff)
+        others = JobQueue.enqueue('test_echo', {'text': 'others'}, user=other)
+        url = '/admin/necrotopia/backgroundjob/{pk}/progress/'
+
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(url.format(pk=own.pk)).status_code, 403)
+
+        staff.user_permissions.add(Permission.objects.get(codename='view_backgroundjob'))
+        self.assertEqual(self.client.get(url.format(pk=own.pk)).status_code, 200)
+        self.assertEqual(self.client.get(url.format(pk=others.pk)).status_code, 404)
+
+        self.client.force_login(superuser)
+        self.assertEqual(self.client.get(url.format(pk=others.pk)).status_code, 200)
+
+    def test_resend_registration_email(self):
+        user = UserProfile.objects.create_user(email='player@necrotopia.test', password='password')
+        superuser = UserProfile.objects.create_superuser(email='admin@necrotopia.test', password='password')
+        self.client.force_login(superuser)
+
+        self.client.post('/admin/auth/proxyuser/',
+                         {'action': 'resend_registration_email', '_selected_action': [user.pk]})
+        self.assertFalse(UserProfile.objects.get(pk=user.pk).is_active)
+        self.assertEqual(len(mail.outbox), 0)
+
+        call_command('run_jobs', once=True, stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+        call_command('send_queued_mail', once=True, stdout=io.StringIO())
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['player@necrotopia.test'])
+
+    def test_resend_registration_email_requeued(self):
+        users = [UserProfile.objects.create_user(email='player{index}@necrotopia.test'.format(index=index),
+                                                 password='password') for index in range(3)]
+        job = JobQueue.enqueue('resend_registration_email', {'domain': 'necrotopia.test',
+                                                             'user_ids': [user.pk for user in users]})
+        # the worker of the first attempt queued the email of the first user before it stopped
+        BackgroundJob.objects.filter(pk=job.pk).update(progress=1, total=3)
+
+        JobQueue.run(JobQueue.claim())
+
+        self.assertEqual(sorted(email.to[0] for email in OutboundEmail.objects.all()),
+                         ['player1@necrotopia.test', 'player2@necrotopia.test'])
+        self.assertEqual(BackgroundJob.objects.get(pk=job.pk).progress, 3)
+
+
+class JobClaimTests(TransactionTestCase):
+    def test_skip_locked(self):
+        first = JobQueue.enqueue('test_echo', {'text': 'first'})
+        second = JobQueue.enqueue('test_echo', {'text': 'second'})
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            try:
+                with transaction.atomic():
+                    BackgroundJob.objects.select_for_update().get(pk=first.pk)
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        worker = threading.Thread(target=hold_lock)
+        worker.start()
+        try:
+            self.assertTrue(locked.wait(10))
+            # another worker holds the first job, so this one takes the next instead of waiting
+            self.assertEqual(JobQueue.claim().pk, second.pk)
+            self.assertIsNone(JobQueue.claim())
+        finally:
+            release.set()
+            worker.join()
+
+        self.assertEqual(JobQueue.claim().pk, first.pk)
@@ -0,0 +1,141 @@
+import os
+import smtplib
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from necrotopia.mail import MailQueue
+from necrotopia.models import JobStatus, OutboundEmail, UserProfile
+
+
+class FlakyBackend(EmailBackend):
+    """
+        Refuses the first few messages it is given, the way a busy mail server does.
+    """
+
+    def __init__(self, failures: int = 1, **kwargs):
+        super(FlakyBackend, self).__init__(**kwargs)
+        self.failures = failures
+
+    def send_messages(self, messages):
+        if self.failures > 0:
+            self.failures -= 1
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+
+        return super(FlakyBackend, self).send_messages(messages)
+
+
+@override_settings(EMAIL_QUEUE_RATE=0, EMAIL_QUEUE_BATCH_SIZE=2, EMAIL_QUEUE_MAX_ATTEMPTS=3,
+                   EMAIL_QUEUE_RETRY_DELAY=60)
+class MailQueueTests(TestCase):
+    def enqueue(self, count: int) -> list:
+        return [MailQueue.enqueue('Welcome', '<p>Hello {index}</p>'.format(index=index),
+                                  ['player{index}@necrotopia.test'.format(index=index)]) for index in range(count)]
+
+    def test_send_over_one_connection(self):
+        self.enqueue(5)
+
+        with mock.patch('necrotopia.mail.get_connection', wraps=get_connection) as connect:
+            self.assertEqual(MailQueue.send_pending(until_empty=True), 5)
+
+        connect.assert_called_once()
+        self.assertEqual([message.to for message in mail.outbox],
+                         [['player{index}@necrotopia.test'.format(index=index)] for index in range(5)])
+        self.assertEqual(mail.outbox[0].content_subtype, 'html')
+        self.assertFalse(OutboundEmail.objects.exclude(status=JobStatus.Done).exists())
+
+    def test_retry_with_backoff(self):
+        email, = self.enqueue(1)
+
+        self.assertEqual(MailQueue.send_pending(FlakyBackend(failures=1), until_empty=True), 0)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (JobStatus.Queued, 1))
+        self.assertIn('SMTPServerDisconnected', email.last_error)
+        self.assertGreater(email.next_attempt_date, timezone.now() + timedelta(seconds=50))
+
+        OutboundEmail.objects.update(next_attempt_date=timezone.now())
+        self.assertEqual(MailQueue.send_pending(FlakyBackend(failures=0), until_empty=True), 1)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (JobStatus.Done, 2))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_give_up(self):
+        email, = self.enqueue(1)
+
+        for attempt in range(3):
+            OutboundEmail.objects.update(next_attempt_date=timezone.now())
+            MailQueue.send_pending(FlakyBackend(failures=1), until_empty=True)
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (JobStatus.Failed, 3))
+        self.assertEqual(MailQueue.get_retry_delay(3), timedelta(seconds=240))
+
+    @override_settings(EMAIL_QUEUE_RATE=4)
+    def test_rate(self):
+        self.enqueue(5)
+
+        with mock.patch('necrotopia.mail.time.sleep') as sleep:
+            MailQueue.send_pending(until_empty=True)
+
+        # the first message goes at once and the others a quarter of a second apart; sleeping is skipped here, so
+        # each wait is counted from the start
+        waits = [call.args[0] for call in sleep.call_args_list]
+        self.assertEqual(len(waits), 4)
+        for index, wait in enumerate(waits):
+            self.assertAlmostEqual(wait, 0.25 * (index + 1), delta=0.1)
+
+    @override_settings(EMAIL_QUEUE_BATCH_SIZE=100)
+    def test_batch_within_lease(self):
+        self.assertEqual(MailQueue.get_batch_size(0), 100)
+        self.assertEqual(MailQueue.get_batch_size(4), 100)
+        # at a message a minute only five of the ten minutes of the lease are filled
+        self.assertEqual(MailQueue.get_batch_size(1 / 60), 5)
+        self.assertEqual(MailQueue.get_batch_size(0.0001), 1)
+
+        self.enqueue(8)
+        with override_settings(EMAIL_QUEUE_RATE=1 / 60), \
+                mock.patch.object(MailQueue, 'claim', wraps=MailQueue.claim) as claim, \
+                mock.patch('necrotopia.mail.time.sleep'):
+            MailQueue.send_pending(until_empty=True)
+
+        self.assertEqual(claim.call_args_list[0].args, (5,))
+        self.assertEqual(len(mail.outbox), 8)
+
+    def test_requeue_stale(self):
+        email, = self.enqueue(1)
+        MailQueue.claim(10)
+        OutboundEmail.objects.update(next_attempt_date=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(MailQueue.requeue_stale(), 1)
+        self.assertEqual(OutboundEmail.objects.get(pk=email.pk).status, JobStatus.Queued)
+
+    def test_file_backend(self):
+        self.enqueue(2)
+
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(EMAIL_BACKEND='django.core.mail.backends.filebased.EmailBackend',
+                                  EMAIL_FILE_PATH=directory):
+            self.assertEqual(MailQueue.send_pending(until_empty=True), 2)
+            written = ''.join(open(os.path.join(directory, name)).read() for name in os.listdir(directory))
+
+        self.assertIn('player0@necrotopia.test', written)
+        self.assertIn('player1@necrotopia.test', written)
+
+    def test_registration_queues(self):
+        response = self.client.post('/register_user', {'email': 'player@necrotopia.test',
+                                                       'email_2': 'player@necrotopia.test',
+                                                       'password1': 'A long passphrase 1!',
+                                                       'password2': 'A long passphrase 1!'})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(UserProfile.objects.get(email='player@necrotopia.test').is_active)
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.to, ['player@necrotopia.test'])
+        self.assertIn('/activate/', email.body)
@@ -0,0 +1,204 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, override_settings
+
+from necrotopia.media_cache import MediaCache
+from necrotopia.storage_backends import PublicMediaStorage
+
+
+class Store:
+    """
+        Stands in for the object store: content by key, and the fetches made of it.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.objects = dict()
+        self.fetches = []
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    def put(self, key: str, data: bytes):
+        # the ETag of an object uploaded in one part is the MD5 of its content
+        self.objects[key] = ('"{etag}"'.format(etag=hashlib.md5(data).hexdigest()), data)
+
+    def fetcher(self, key: str):
+        def fetch(etag):
+            with self.lock:
+                self.fetches.append((key, etag))
+            time.sleep(self.delay)
+            current, data = self.objects[key]
+
+            return None if etag == current else (current, io.BytesIO(data))
+
+        return fetch
+
+
+class MediaCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = Store()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self, cache: MediaCache, key: str) -> bytes:
+        with cache.open(key, self.store.fetcher(key)) as blob:
+            return blob.read()
+
+    def test_read_through(self):
+        cache = MediaCache(self.directory.name, 1024, 60)
+        self.store.put('media/pdf/frame.pdf', b'frame')
+
+        self.assertEqual(self.read(cache, 'media/pdf/frame.pdf'), b'frame')
+        self.assertEqual(self.read(cache, 'media/pdf/frame.pdf'), b'frame')
+        self.assertEqual(self.store.fetches, [('media/pdf/frame.pdf', None)])
+
+    def test_revalidate(self):
+        cache = MediaCache(self.directory.name, 1024, 0)
+        self.store.put('media/pdf/frame.pdf', b'frame')
+        self.read(cache, 'media/pdf/frame.pdf')
+        etag = self.store.objects['media/pdf/frame.pdf'][0]
+
+        # unchanged, the store only answers that the ETag still matches
+        self.assertEqual(self.read(cache, 'media/pdf/frame.pdf'), b'frame')
+        self.assertEqual(self.store.fetches[-1], ('media/pdf/frame.pdf', etag))
+
+        self.store.put('media/pdf/frame.pdf', b'frame, second edition')
+        self.assertEqual(self.read(cache, 'media/pdf/frame.pdf'), b'frame, second edition')
+
+    def test_content_addressed(self):
+        cache = MediaCache(self.directory.name, 1024, 60)
+        self.store.put('media/pdf/frame.pdf', b'frame')
+        self.store.put('media/pdf/frame_copy.pdf', b'frame')
+        self.read(cache, 'media/pdf/frame.pdf')
+        self.read(cache, 'media/pdf/frame_copy.pdf')
+
+        blobs = [name for _, _, names in os.walk(os.path.join(self.directory.name, 'blobs')) for name in names]
+        self.assertEqual(len(blobs), 1)
+
+    def test_evict_least_recently_read(self):
+        cache = MediaCache(self.directory.name, 250, 60)
+        for name in ('first', 'second', 'third'):
+            self.store.put(name, name.encode('ascii') * (100 // len(name)))
+
+        self.read(cache, 'first')
+        self.read(cache, 'second')
+        self.read(cache, 'first')
+        self.read(cache, 'third')
+        self.assertEqual(len(self.store.fetches), 3)
+
+        self.read(cache, 'first')
+        self.read(cache, 'second')
+        self.assertEqual([key for key, _ in self.store.fetches], ['first', 'second', 'third', 'second'])
+
+    def test_evicted_once_stored(self):
+        cache = MediaCache(self.directory.name, 1024, 60)
+        self.store.put('media/pdf/frame.pdf', b'frame')
+        store = cache.store
+
+        def store_then_evict(stream):
+            digest, copy = store(stream)
+            # another process evicts the copy before this one reads it
+            os.remove(cache.get_blob_path(digest))
+            return digest, copy
+
+        with mock.patch.object(cache, 'store', store_then_evict):
+            self.assertEqual(self.read(cache, 'media/pdf/frame.pdf'), b'frame')
+
+    def test_lock_files(self):
+        cache = MediaCache(self.directory.name, 1024 * 1024, 60)
+        for index in range(600):
+            self.store.put(str(index), b'x')
+            self.read(cache, str(index))
+
+        self.assertLessEqual(len(os.listdir(os.path.join(self.directory.name, 'locks'))), 256 + 1)
+
+    def test_fill_once(self):
+        cache = MediaCache(self.directory.name, 1024, 60)
+        self.store = Store(delay=0.2)
+        self.store.put('media/static_images/ruins.jpg', b'ruins')
+
+        results = []
+        barrier = threading.Barrier(8)
+
+        def read():
+            barrier.wait()
+            results.append(self.read(MediaCache(self.directory.name, 1024, 60), 'media/static_images/ruins.jpg'))
+
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [b'ruins'] * 8)
+        self.assertEqual(len(self.store.fetches), 1)
+        self.assertEqual(self.read(cache, 'media/static_images/ruins.jpg'), b'ruins')
+
+
+class StorageTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(MEDIA_CACHE_DIR=self.directory.name, MEDIA_CACHE_MAX_SIZE=1024,
+                                                   MEDIA_CACHE_REVALIDATE=0)
+        self.settings_override.enable()
+        self.storage = PublicMediaStorage(access_key='test', secret_key='test', endpoint_url='http://localhost:9000',
+                                          bucket_name='necrotopia')
+        self.stubber = Stubber(self.storage.connection.meta.client)
+        self.stubber.activate()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+        self.settings_override.disable()
+        self.directory.cleanup()
+
+    def add_object(self, data: bytes, etag: str, expected: dict):
+        self.stubber.add_response('get_object', {'Body': StreamingBody(io.BytesIO(data), len(data)), 'ETag': etag},
+                                  expected)
+
+    def test_open(self):
+        self.add_object(b'%PDF-1.4', '"v1"', {'Bucket': 'necrotopia', 'Key': 'media/pdf/frame.pdf'})
+        self.stubber.add_client_error('get_object', service_error_code='304', http_status_code=304,
+                                      expected_params={'Bucket': 'necrotopia', 'Key': 'media/pdf/frame.pdf',
+                                                       'IfNoneMatch': '"v1"'})
+
+        with self.storage.open('pdf/frame.pdf') as first:
+            self.assertEqual(first.read(), b'%PDF-1.4')
+        file = self.storage.open('pdf/frame.pdf')
+        self.assertEqual(file.read(), b'%PDF-1.4')
+        file.close()
+
+        # evicted while the file was closed, so opening it again fetches it again
+        shutil.rmtree(os.path.join(self.directory.name, 'blobs'))
+        self.add_object(b'%PDF-1.4', '"v1"', {'Bucket': 'necrotopia', 'Key': 'media/pdf/frame.pdf'})
+        self.assertEqual(file.open('rb').read(), b'%PDF-1.4')
+        file.close()
+        self.stubber.assert_no_pending_responses()
+
+    def test_missing(self):
+        self.stubber.add_client_error('get_object', service_error_code='NoSuchKey', http_status_code=404)
+
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open('pdf/missing.pdf')
+
+    def test_save_forgets(self):
+        cache = MediaCache.get_default()
+        cache.set_entry(self.storage.get_cache_key('pdf/frame.pdf'), {'etag': '"v1"', 'digest': '0' * 64,
+                                                                       'checked': time.time()})
+        # the name is free, then the file is written
+        self.stubber.add_client_error('head_object', service_error_code='404', http_status_code=404)
+        self.stubber.add_response('put_object', {'ETag': '"v2"'})
+
+        self.storage.save('pdf/frame.pdf', ContentFile(b'%PDF-1.5'))
+
+        self.assertIsNone(cache.get_entry(self.storage.get_cache_key('pdf/frame.pdf')))
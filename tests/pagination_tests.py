@@ -0,0 +1,79 @@
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from necrotopia.models import ModuleAssembly, ResourceItem, Rule, SkillItem, UserProfile
+from necrotopia.pagination import KeysetPaginator
+
+
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        self.registrar = UserProfile.objects.create_user(email='registrar@necrotopia.test', password='password')
+        # repeated names make the primary key part of the ordering
+        Rule.objects.bulk_create(Rule(name='Rule {index:02}'.format(index=index // 2), registrar=self.registrar)
+                                 for index in range(25))
+        self.expected = list(Rule.objects.order_by('name', 'pk'))
+
+    def get_page(self, **parameters):
+        query = QueryDict(mutable=True)
+        query.update(parameters)
+
+        return KeysetPaginator(Rule.objects.all(), page_size=10).get_page(query)
+
+    def test_walk_forwards_and_back(self):
+        pages = [self.get_page()]
+        while pages[-1].has_next:
+            pages.append(self.get_page(after=pages[-1].next_cursor))
+
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([rule for page in pages for rule in page], self.expected)
+        self.assertFalse(pages[0].has_previous)
+
+        previous = self.get_page(before=pages[2].previous_cursor)
+        self.assertEqual(previous.items, pages[1].items)
+        self.assertEqual(self.get_page(before=previous.previous_cursor).items, pages[0].items)
+        self.assertFalse(self.get_page(before=previous.previous_cursor).has_previous)
+
+    def test_stable_cursor(self):
+        cursor = self.get_page().next_cursor
+        second = self.get_page(after=cursor)
+        Rule.objects.create(name='Rule 00', registrar=self.registrar)
+
+        self.assertEqual(self.get_page(after=cursor).items, second.items)
+
+    def test_bad_cursor(self):
+        for cursor in ('nonsense', KeysetPaginator.encode_cursor(Rule(name='x', pk=1))[:-2], 'WzEsMl0'):
+            self.assertEqual(self.get_page(after=cursor).items, self.expected[:10])
+
+    def test_list_views(self):
+        for model in (Rule, SkillItem, ResourceItem, ModuleAssembly):
+            model.objects.bulk_create(model(name=str(index), registrar=self.registrar) for index in range(60))
+
+        for url, model in (('/rules_list/', Rule), ('/skill_list', SkillItem), ('/resources_list', ResourceItem),
+                           ('/blueprint_list/', ModuleAssembly)):
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, 200)
+            self.assertEqual(len(first.context['page']), 50)
+            # the page size is not the number of matches, so it isn't shown as one
+            self.assertNotContains(first, '(50)')
+            self.assertNotContains(first, '50 rules Found')
+
+            # the first visit stores the parts lists of the blueprints on the page
+            self.client.get(url, {'after': first.context['page'].next_cursor})
+            with CaptureQueriesContext(connection) as queries:
+                last = self.client.get(url, {'after': first.context['page'].next_cursor})
+
+            self.assertEqual(len(last.context['page']), model.objects.count() - 50)
+            self.assertFalse(last.context['page'].has_next)
+            self.assertContains(last, '?before={cursor}'.format(cursor=last.context['page'].previous_cursor))
+            # one page query, plus the parts lists of the blueprints; no per-row queries for deferred columns
+            self.assertLessEqual(len(queries), 2)
+
+    def test_empty_list_views(self):
+        Rule.objects.all().delete()
+        for url in ('/rules_list/', '/skill_list', '/resources_list', '/blueprint_list/'):
+            response = self.client.get(url)
+            self.assertEqual(len(response.context['page']), 0)
+            self.assertNotContains(response, '(0)')
+            self.assertNotContains(response, '0 rules Found')
@@ -0,0 +1,257 @@
+import hashlib
+import io
+import tempfile
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.test import TestCase
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject, StreamObject
+
+from necrotopia.models import BackgroundJob, ComponentType, ItemPdf, JobStatus, ModuleAssembly, UserProfile
+from necrotopia.printing import PdfDeduplicator, PdfPrinter, PrintPack
+
+FONT_DATA = b'font program ' * 4096
+
+
+def make_pdf(text: str, font_data: bytes = FONT_DATA) -> bytes:
+    """
+        A one page PDF using an embedded font, the way the printed blueprint templates do.
+    """
+    writer = PdfWriter()
+    page = writer.add_blank_page(width=200, height=200)
+
+    font_file = DecodedStreamObject()
+    font_file.set_data(font_data)
+    descriptor = DictionaryObject({NameObject('/Type'): NameObject('/FontDescriptor'),
+                                   NameObject('/FontFile2'): writer._add_object(font_file)})
+    font = DictionaryObject({NameObject('/Type'): NameObject('/Font'), NameObject('/Subtype'): NameObject('/TrueType'),
+                             NameObject('/BaseFont'): NameObject('/Necrotopia'),
+                             NameObject('/FontDescriptor'): writer._add_object(descriptor)})
+    page[NameObject('/Resources')] = DictionaryObject({
+        NameObject('/Font'): DictionaryObject({NameObject('/F1'): writer._add_object(font)})})
+
+    contents = DecodedStreamObject()
+    contents.set_data('BT /F1 12 Tf 10 100 Td ({text}) Tj ET'.format(text=text).encode('latin-1'))
+    page[NameObject('/Contents')] = writer._add_object(contents)
+
+    with io.BytesIO() as output:
+        writer.write(output)
+        return output.getvalue()
+
+
+class PrintingTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = FileSystemStorage(location=self.directory.name)
+        self.registrar = UserProfile.objects.create_user(email='registrar@necrotopia.test', password='password')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def add_blueprint(self, name: str, *texts) -> ModuleAssembly:
+        blueprint = ModuleAssembly.objects.create(name=name, registrar=self.registrar)
+        for text in texts:
+            saved = self.storage.save('pdf/{text}.pdf'.format(text=text), ContentFile(make_pdf(text)))
+            ItemPdf.objects.create(pdf=saved, pdf_assembly_item=blueprint)
+
+        return blueprint
+
+    @staticmethod
+    def get_texts(document) -> list:
+        return [page.get_contents().get_data().decode('latin-1').split('(')[1].split(')')[0]
+                for page in PdfReader(document).pages]
+
+
+class PdfPrinterTests(PrintingTestCase):
+    def test_merge_in_order(self):
+        first = self.add_blueprint('Auto Frame', 'frame1', 'frame2')
+        second = self.add_blueprint('Raider Ride', 'ride')
+        self.add_blueprint('Not Printed', 'other')
+        ModuleAssembly.objects.create(name='Without PDF', registrar=self.registrar)
+
+        names = PdfPrinter.get_pdf_names([second.pk, first.pk])
+        self.assertEqual(names, ['pdf/ride.pdf', 'pdf/frame1.pdf', 'pdf/frame2.pdf'])
+
+        progress = []
+        with mock.patch.object(PdfPrinter, 'write_interval', 0):
+            merged = PdfPrinter(self.storage, max_workers=2).merge(names,
+                                                                   on_progress=lambda *step: progress.append(step))
+        self.assertEqual(self.get_texts(merged), ['ride', 'frame1', 'frame2'])
+        # the fetches and the writing report progress too, not only the merging
+        self.assertEqual(progress[:6], [(step, 7) for step in range(1, 7)])
+        self.assertGreater(len(progress), 7)
+        self.assertEqual(set(progress[6:-1]), {(6, 7)})
+        self.assertEqual(progress[-1], (7, 7))
+
+    def test_shared_fonts_stored_once(self):
+        names = [self.storage.save('pdf/{index}.pdf'.format(index=index), ContentFile(make_pdf(str(index))))
+                 for index in range(5)]
+
+        merged = PdfPrinter(self.storage).merge(names)
+        size = len(merged.read())
+        merged.seek(0)
+
+        reader = PdfReader(merged)
+        fonts = {page['/Resources'].raw_get('/Font').get_object().raw_get('/F1').idnum for page in reader.pages}
+        self.assertEqual(len(fonts), 1)
+        self.assertEqual(self.get_texts(reader.stream), ['0', '1', '2', '3', '4'])
+        # one copy of the font program rather than five
+        self.assertLess(size, 2 * len(FONT_DATA))
+
+    def test_different_fonts_kept(self):
+        writer = PdfWriter()
+        for index, font_data in enumerate((b'one font', b'another font', b'one font')):
+            for page in PdfReader(io.BytesIO(make_pdf(str(index), font_data))).pages:
+                writer.add_page(page)
+
+        self.assertGreater(PdfDeduplicator(writer).deduplicate(), 0)
+        fonts = [page['/Resources']['/Font'].raw_get('/F1').idnum for page in writer.pages]
+        self.assertEqual(fonts[0], fonts[2])
+        self.assertNotEqual(fonts[0], fonts[1])
+
+    def test_encoded_streams(self):
+        writer = PdfWriter()
+        streams = []
+        for data, image_filter in ((b'one image', '/FlateDecode'), (b'one image', '/FlateDecode'),
+                                   (b'one image', '/JBIG2Decode'), (b'one image', '/JBIG2Decode')):
+            page = writer.add_blank_page(width=200, height=200)
+            if image_filter == '/FlateDecode':
+                stream = DecodedStreamObject()
+                stream.set_data(data)
+                stream = stream.flate_encode()
+            else:
+                # pypdf cannot decode this one
+                stream = StreamObject.initialize_from_dictionary({
+                    '/Filter': NameObject(image_filter), '/Length': NumberObject(len(data)), '__streamdata__': data})
+            streams.append(stream)
+            page[NameObject('/Resources')] = DictionaryObject({
+                NameObject('/XObject'): DictionaryObject({NameObject('/X1'): writer._add_object(stream)})})
+
+        deduplicator = PdfDeduplicator(writer)
+        self.assertEqual(deduplicator.deduplicate(), 1)
+        images = [page['/Resources']['/XObject'].raw_get('/X1').idnum for page in writer.pages]
+        self.assertEqual(images[0], images[1])
+        self.assertEqual(len(set(images)), 3)
+        # the decoded copies made for the digests are not kept
+        self.assertIsNone(streams[0].decoded_self)
+
+        compacted = deduplicator.compact()
+        images = [page['/Resources']['/XObject'].raw_get('/X1').idnum for page in compacted.pages]
+        self.assertEqual(images[0], images[1])
+        self.assertEqual(compacted.pages[0]['/Resources']['/XObject']['/X1'].get_data(), b'one image')
+
+    def test_cycles(self):
+        # fonts whose descriptors refer back to them; the descriptors only differ by the font they refer to
+        writer = PdfWriter()
+        for font_data in (b'one font', b'another font'):
+            page = writer.add_blank_page(width=200, height=200)
+            font = DecodedStreamObject()
+            font.set_data(font_data)
+            font_reference = writer._add_object(font)
+            descriptor = DictionaryObject({NameObject('/Font'): font_reference})
+            font[NameObject('/FontDescriptor')] = writer._add_object(descriptor)
+            page[NameObject('/Resources')] = DictionaryObject({
+                NameObject('/Font'): DictionaryObject({NameObject('/F1'): font_reference}),
+                NameObject('/XObject'): DictionaryObject({NameObject('/X1'): font.raw_get('/FontDescriptor')})})
+
+        PdfDeduplicator(writer).deduplicate()
+
+        descriptors = [page['/Resources']['/XObject'].raw_get('/X1').idnum for page in writer.pages]
+        self.assertNotEqual(descriptors[0], descriptors[1])
+
+    def test_failed_fetch(self):
+        names = [self.storage.save('pdf/{index}.pdf'.format(index=index), ContentFile(make_pdf(str(index))))
+                 for index in range(3)]
+        printer = PdfPrinter(self.storage, max_workers=1)
+        fetched = []
+
+        def fetch(name):
+            fetched.append(PdfPrinter.fetch(printer, name))
+            return fetched[-1]
+
+        with mock.patch.object(printer, 'fetch', fetch), self.assertRaises(FileNotFoundError):
+            printer.merge([names[0], 'pdf/missing.pdf', names[1], names[2]])
+
+        self.assertEqual(len(fetched), 3)
+        self.assertTrue(all(source.closed for source in fetched))
+
+    def test_admin_action(self):
+        blueprint = self.add_blueprint('Auto Frame', 'frame')
+        superuser = UserProfile.objects.create_superuser(email='admin@necrotopia.test', password='password')
+        self.client.force_login(superuser)
+
+        response = self.client.post('/admin/necrotopia/moduleassembly/',
+                                    {'action': 'print_pdfs', '_selected_action': [blueprint.pk], 'proceed': 'Proceed'})
+        job = BackgroundJob.objects.get()
+        self.assertRedirects(response, '/admin/necrotopia/backgroundjob/{pk}/progress/'.format(pk=job.pk))
+        self.assertEqual(job.arguments, {'assembly_ids': [blueprint.pk]})
+
+        # the printer reads from the storage of ItemPdf.pdf and the job keeps its result in private storage, both
+        # on S3 outside of tests
+        with mock.patch.object(ItemPdf._meta.get_field('pdf'), 'storage', self.storage), \
+                mock.patch.object(BackgroundJob._meta.get_field('result'), 'storage', self.storage):
+            call_command('run_jobs', once=True, stdout=io.StringIO())
+
+            job.refresh_from_db()
+            self.assertEqual(job.status, JobStatus.Done)
+            self.assertTrue(job.result.name.startswith('print_packs/'))
+            with job.result.open('rb') as result:
+                self.assertEqual(self.get_texts(io.BytesIO(result.read())), ['frame'])
+
+
+class PrintPackTests(PrintingTestCase):
+    def get_pack(self) -> PrintPack:
+        return PrintPack(self.storage, PdfPrinter(self.storage))
+
+    def test_reused(self):
+        first = self.add_blueprint('Auto Frame', 'frame1', 'frame2')
+        second = self.add_blueprint('Raider Ride', 'ride')
+
+        name = self.get_pack().get([first.pk, second.pk])
+        with self.storage.open(name, 'rb') as pack:
+            self.assertEqual(self.get_texts(io.BytesIO(pack.read())), ['frame1', 'frame2', 'ride'])
+
+        with mock.patch.object(PdfPrinter, 'merge') as merge:
+            self.assertEqual(self.get_pack().get([first.pk, second.pk]), name)
+            merge.assert_not_called()
+
+        # another order is another print
+        self.assertNotEqual(self.get_pack().get([second.pk, first.pk]), name)
+
+    def test_digest(self):
+        blueprint = ModuleAssembly.objects.create(name='Auto Frame', registrar=self.registrar)
+        with mock.patch.object(ItemPdf._meta.get_field('pdf'), 'storage', self.storage):
+            item = ItemPdf.objects.create(pdf=ContentFile(make_pdf('frame'), name='frame.pdf'),
+                                          pdf_assembly_item=blueprint)
+            self.assertEqual(item.digest, hashlib.sha256(make_pdf('frame')).hexdigest())
+            name = self.get_pack().get([blueprint.pk])
+
+            item.pdf = ContentFile(make_pdf('frame2'), name='frame.pdf')
+            item.save()
+
+            name_changed = self.get_pack().get([blueprint.pk])
+            self.assertNotEqual(name_changed, name)
+            with self.storage.open(name_changed, 'rb') as pack:
+                self.assertEqual(self.get_texts(io.BytesIO(pack.read())), ['frame2'])
+
+            # pointing at a stored file forgets the digest of the old one
+            item.pdf = name
+            item.save()
+            self.assertEqual(item.digest, '')
+
+    def test_packs(self):
+        ride = ModuleAssembly.objects.create(name='Raider Ride', registrar=self.registrar, published=True,
+                                             item_type=ComponentType.Vehicle, crafting_tree='Mechanic')
+        frame = ModuleAssembly.objects.create(name='Auto Frame', registrar=self.registrar, published=True,
+                                              item_type=ComponentType.Vehicle, crafting_tree='Artisan')
+        ModuleAssembly.objects.create(name='Draft', registrar=self.registrar, item_type=ComponentType.Vehicle)
+
+        self.assertEqual(PrintPack.get_packs(), {
+            'Crafting tree: Artisan': [frame.pk],
+            'Crafting tree: Mechanic': [ride.pk],
+            'Item type: Vehicle': [frame.pk, ride.pk],
+            'Published': [frame.pk, ride.pk],
+        })
@@ -0,0 +1,73 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from necrotopia.models import ModuleAssembly, ResourceItem, Rule, SkillItem, SkillRatings
+from necrotopia.search import SearchIndex
+from tests.component_tests import HelperFactory, ALLOY_METAL, GLITTER_GULCH_RAIDER_RIDE, MECHANICAL_AUTO_FRAME
+from tests.crafting_tests import BlueprintTestCase
+
+
+class SearchIndexTests(BlueprintTestCase):
+    def setUp(self):
+        super().setUp()
+        self.save_component(HelperFactory.get_master_raider_ride())
+        self.frame = self.get_assembly(MECHANICAL_AUTO_FRAME)
+        self.ride = self.get_assembly(GLITTER_GULCH_RAIDER_RIDE)
+        self.ride.tags = 'vehicle frame'
+        self.ride.save()
+
+    def search(self, model, search_terms) -> list:
+        return list(SearchIndex.search(model, search_terms))
+
+    def test_vector_kept_on_save(self):
+        self.assertTrue(ModuleAssembly.objects.filter(pk=self.frame.pk, search_vector='frame').exists())
+
+        self.frame.name = 'Chassis'
+        self.frame.save()
+        self.assertFalse(ModuleAssembly.objects.filter(pk=self.frame.pk, search_vector='frame').exists())
+
+    def test_name_ranks_above_tags(self):
+        self.assertEqual(self.search(ModuleAssembly, 'frame'), [self.frame, self.ride])
+
+    def test_terms_are_ORed(self):
+        found = self.search(ModuleAssembly, 'engine, gear')
+        self.assertEqual({assembly.name for assembly in found}, {'Mechanical Engine', 'Mechanical Gear System'})
+
+    def test_misspelled_name(self):
+        self.assertEqual(self.search(ModuleAssembly, 'mechanicle auto fram'), [self.frame])
+        self.assertEqual(self.search(ResourceItem, 'aloy metal')[0], self.get_resource(ALLOY_METAL))
+
+    def test_rules(self):
+        rule = Rule.objects.create(name='Crafting', text='Blueprints are crafted at a workbench',
+                                   registrar=self.registrar)
+        Rule.objects.create(name='Combat', registrar=self.registrar)
+
+        self.assertEqual(self.search(Rule, 'workbenches'), [rule])
+
+    def test_skill_found_by_rating(self):
+        skill = SkillItem.objects.create(name='Tinkering', registrar=self.registrar)
+        SkillRatings.objects.create(skill=skill, description='Repair a broken vehicle in the field')
+        SkillItem.objects.create(name='Brawling', registrar=self.registrar)
+
+        self.assertEqual(self.search(SkillItem, 'repairing'), [skill])
+
+    def test_no_terms(self):
+        self.assertEqual(self.search(ModuleAssembly, ' , '), [])
+
+    def test_rebuild(self):
+        ModuleAssembly.objects.update(search_vector=None)
+        self.assertEqual(self.search(ModuleAssembly, 'vehicle'), [])
+
+        SearchIndex.rebuild()
+        self.assertEqual(self.search(ModuleAssembly, 'vehicle'), [self.ride])
+
+    def test_search_results_queries(self):
+        query_counts = []
+        for search_terms in ('frame', 'frame, engine, gear, scrap, metal'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/search_results/', {'search_terms': search_terms})
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, MECHANICAL_AUTO_FRAME)
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
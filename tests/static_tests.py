@@ -0,0 +1,181 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+from datetime import timezone as dt_timezone
+
+import brotli
+from botocore.awsrequest import AWSResponse
+from botocore.response import StreamingBody
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from tests.image_tests import make_image
+
+
+class FakeBucket:
+    """
+        Answers the S3 calls of a boto3 client from a dict, the way botocore's Stubber does, without requiring the
+        calls in a set order.
+    """
+
+    def __init__(self):
+        self.objects = dict()
+        self.calls = []
+
+    def attach(self, client):
+        client.meta.events.register('before-parameter-build.s3', self.keep_parameters)
+        client.meta.events.register('before-call.s3', self.respond)
+
+    @staticmethod
+    def keep_parameters(params, context, **kwargs):
+        context['fake_bucket_parameters'] = dict(params)
+
+    def respond(self, model, context, **kwargs):
+        parameters = context['fake_bucket_parameters']
+        self.calls.append((model.name, parameters.get('Key')))
+        status, response = getattr(self, model.name)(parameters)
+        response.setdefault('ResponseMetadata', {})['HTTPStatusCode'] = status
+
+        return AWSResponse(None, status, {}, None), response
+
+    @staticmethod
+    def not_found() -> tuple:
+        return 404, {'Error': {'Code': '404', 'Message': 'Not Found'}}
+
+    def ListObjectsV2(self, parameters: dict) -> tuple:
+        return 200, {'IsTruncated': False, 'Contents': [
+            {'Key': key, 'ETag': item['ETag'], 'LastModified': item['LastModified'], 'Size': len(item['Body'])}
+            for key, item in sorted(self.objects.items()) if key.startswith(parameters.get('Prefix', ''))]}
+
+    def PutObject(self, parameters: dict) -> tuple:
+        body = parameters['Body']
+        body = body.read() if hasattr(body, 'read') else body
+        self.objects[parameters['Key']] = dict(parameters, Body=body, ETag='"{etag}"'.format(
+            etag=hashlib.md5(body).hexdigest()), LastModified=timezone.now().astimezone(dt_timezone.utc))
+
+        return 200, {'ETag': self.objects[parameters['Key']]['ETag']}
+
+    def HeadObject(self, parameters: dict) -> tuple:
+        if parameters['Key'] not in self.objects:
+            return FakeBucket.not_found()
+
+        item = self.objects[parameters['Key']]
+
+        return 200, {'ContentLength': len(item['Body']), 'ETag': item['ETag'], 'LastModified': item['LastModified']}
+
+    def GetObject(self, parameters: dict) -> tuple:
+        if parameters['Key'] not in self.objects:
+            return FakeBucket.not_found()
+
+        item = self.objects[parameters['Key']]
+
+        return 200, {'Body': StreamingBody(io.BytesIO(item['Body']), len(item['Body'])),
+                     'ContentLength': len(item['Body']), 'ETag': item['ETag']}
+
+    def DeleteObject(self, parameters: dict) -> tuple:
+        self.objects.pop(parameters['Key'], None)
+
+        return 204, {}
+
+
+class StaticStorageTests(TestCase):
+    def setUp(self):
+        self.source = tempfile.TemporaryDirectory()
+        self.root = tempfile.TemporaryDirectory()
+        self.write('css/site.css', ''.join('.panel-{index} {{ background: url("../images/bg.png"); }}\n'.format(
+            index=index) for index in range(40)).encode('ascii'))
+        self.write('images/bg.png', make_image(40, 40, 'PNG'))
+        self.write('images/project_icon.png', make_image(16, 16, 'PNG'))
+
+        self.settings_override = override_settings(
+            STATICFILES_DIRS=[self.source.name], STATIC_ROOT=self.root.name,
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+            AWS_STORAGE_BUCKET_NAME='necrotopia', AWS_S3_ENDPOINT_URL='http://localhost:9000', AWS_LOCATION='static',
+            AWS_ACCESS_KEY_ID='test', AWS_SECRET_ACCESS_KEY='test')
+        self.settings_override.enable()
+        self.bucket = FakeBucket()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.source.cleanup()
+        self.root.cleanup()
+
+    def write(self, name: str, data: bytes):
+        os.makedirs(os.path.dirname(os.path.join(self.source.name, name)), exist_ok=True)
+        with open(os.path.join(self.source.name, name), 'wb') as source:
+            source.write(data)
+
+    def collect(self) -> list:
+        """
+            Run collectstatic the way a new deploy does, with a storage that has not seen the bucket yet.
+
+        :return: the names uploaded
+        """
+        # changing the setting starts over with a new storage, and again once it is back
+        with override_settings(STATIC_ROOT=self.root.name):
+            self.bucket.attach(staticfiles_storage.connection.meta.client)
+            self.bucket.calls.clear()
+            call_command('collectstatic', interactive=False, verbosity=0)
+
+        return sorted(key for operation, key in self.bucket.calls if operation == 'PutObject')
+
+    def get_manifest(self) -> dict:
+        with open(os.path.join(self.root.name, 'staticfiles.json')) as manifest:
+            return json.load(manifest)['paths']
+
+    def test_hashed_and_compressed(self):
+        # before collectstatic has run
+        self.assertEqual(staticfiles_storage.url('css/site.css'),
+                         'http://localhost:9000/necrotopia/static/css/site.css')
+
+        self.collect()
+
+        paths = self.get_manifest()
+        stylesheet = 'static/' + paths['css/site.css']
+        self.assertRegex(stylesheet, r'^static/css/site\.[0-9a-f]{12}\.css$')
+        item = self.bucket.objects[stylesheet]
+        self.assertEqual(item['CacheControl'], 'public, max-age=31536000, immutable')
+        self.assertIn(b'url("../' + paths['images/bg.png'].encode('ascii') + b'")', item['Body'])
+        self.assertEqual(self.bucket.objects['static/css/site.css']['CacheControl'], 'max-age=86400')
+
+        compressed = self.bucket.objects[stylesheet + '.gz']
+        self.assertEqual((compressed['ContentType'], compressed['ContentEncoding']), ('text/css', 'gzip'))
+        self.assertEqual(gzip.decompress(compressed['Body']), item['Body'])
+        compressed = self.bucket.objects[stylesheet + '.br']
+        self.assertEqual((compressed['ContentType'], compressed['ContentEncoding']), ('text/css', 'br'))
+        self.assertEqual(brotli.decompress(compressed['Body']), item['Body'])
+        self.assertNotIn('static/' + paths['images/bg.png'] + '.gz', self.bucket.objects)
+
+        with override_settings(STATIC_ROOT=self.root.name):
+            self.assertEqual(staticfiles_storage.url('css/site.css'), 'http://localhost:9000/necrotopia/' + stylesheet)
+
+            response = self.client.get('/favicon.ico')
+            self.assertRedirects(response, 'http://localhost:9000/necrotopia/static/' +
+                                 paths['images/project_icon.png'], fetch_redirect_response=False)
+            self.assertIn('max-age=86400', response['Cache-Control'])
+
+    def test_incremental(self):
+        first = self.collect()
+        self.assertEqual(len(first), 8)
+
+        # nothing changed: one listing of the bucket and no uploads
+        self.assertEqual(self.collect(), [])
+        self.assertEqual([operation for operation, _ in self.bucket.calls], ['ListObjectsV2'])
+
+        old_stylesheet = 'static/' + self.get_manifest()['css/site.css']
+        self.write('css/site.css', b'.panel { color: red; }\n' * 20)
+        # collectstatic compares modification times to the second, and the first upload was within it
+        modified_time = timezone.now().timestamp() + 60
+        os.utime(os.path.join(self.source.name, 'css/site.css'), (modified_time, modified_time))
+        uploaded = self.collect()
+
+        stylesheet = 'static/' + self.get_manifest()['css/site.css']
+        self.assertNotEqual(stylesheet, old_stylesheet)
+        self.assertEqual(uploaded, sorted(['static/css/site.css', stylesheet, stylesheet + '.br', stylesheet + '.gz']))
+        # pages cached before the deploy still find the stylesheet they name
+        self.assertIn(old_stylesheet, self.bucket.objects)
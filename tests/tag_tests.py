@@ -0,0 +1,129 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from necrotopia.models import ModuleAssembly, ResourceItem, Rule, SkillItem, UserProfile
+from necrotopia.tags import TagQuery
+
+
+class TagQueryTests(TestCase):
+    def setUp(self):
+        self.registrar = UserProfile.objects.create_user(email='registrar@necrotopia.test', password='password')
+        self.rules = dict()
+        for name, tags in (('Crafting', 'crafting workbench'), ('Repair', 'crafting vehicle'),
+                           ('Combat', 'combat'), ('Travel', 'vehicle')):
+            self.rules[name] = Rule.objects.create(name=name, tags=tags, registrar=self.registrar)
+
+        # warm the content type cache, a lookup is only made once per model
+        for model in (ModuleAssembly, ResourceItem, Rule, SkillItem):
+            ContentType.objects.get_for_model(model)
+
+    def get_names(self, queryset) -> set:
+        return {row.name for row in queryset}
+
+    def test_any(self):
+        with self.assertNumQueries(1):
+            found = self.get_names(Rule.objects.tagged('crafting, vehicle, unused'))
+
+        self.assertEqual(found, {'Crafting', 'Repair', 'Travel'})
+
+    def test_all(self):
+        with self.assertNumQueries(1):
+            found = self.get_names(Rule.objects.tagged(['crafting', 'vehicle'], match_all=True))
+
+        self.assertEqual(found, {'Repair'})
+        self.assertEqual(self.get_names(Rule.objects.tagged('crafting, unused', match_all=True)), set())
+
+    def test_chained_filter(self):
+        found = Rule.objects.filter(name__startswith='C').tagged('crafting vehicle').order_by('name')
+        self.assertEqual([rule.name for rule in found], ['Crafting'])
+
+    def test_no_tags(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(list(Rule.objects.tagged('')), [])
+
+    def test_other_models(self):
+        skill = SkillItem.objects.create(name='Tinkering', tags='crafting', registrar=self.registrar)
+        resource = ResourceItem.objects.create(name='Alloy Metal', tags='metal crafting', registrar=self.registrar)
+        blueprint = ModuleAssembly.objects.create(name='Mechanical Auto Frame', tags='crafting vehicle',
+                                                  registrar=self.registrar)
+
+        # the rules share object ids with the other models, the content type keeps them apart
+        self.assertEqual(list(SkillItem.objects.tagged('crafting')), [skill])
+        self.assertEqual(list(ResourceItem.objects.tagged('metal crafting', match_all=True)), [resource])
+        self.assertEqual(list(ModuleAssembly.objects.tagged(['vehicle'])), [blueprint])
+
+    def test_indexes(self):
+        with connection.cursor() as cursor:
+            indexes = connection.introspection.get_constraints(cursor, 'tagging_taggeditem')
+
+        for name, columns, included in TagQuery.indexes:
+            self.assertEqual(indexes[name]['columns'], list(columns + included))
+
+
+class SetTagsTests(TestCase):
+    def setUp(self):
+        self.registrar = UserProfile.objects.create_user(email='registrar@necrotopia.test', password='password')
+        ContentType.objects.get_for_model(Rule)
+
+    def add_rules(self, count: int, tags: str = '') -> list:
+        return [Rule.objects.create(name='Rule {index}'.format(index=index), tags=tags, registrar=self.registrar)
+                for index in range(count)]
+
+    def get_tags(self, rule: Rule) -> set:
+        return set(TagQuery.get_tag_names(Rule.objects.filter(pk=rule.pk).values_list('tags', flat=True).get()))
+
+    def test_add(self):
+        scavenging = Rule.objects.create(name='Scavenging', tags='ruins', registrar=self.registrar)
+        tinkering = Rule.objects.create(name='Tinkering', tags='workbench', registrar=self.registrar)
+
+        changed = TagQuery.set_tags(Rule.objects.all(), 'crafting', replace=False)
+
+        self.assertEqual(set(changed), {scavenging.pk, tinkering.pk})
+        self.assertEqual(self.get_tags(scavenging), {'crafting', 'ruins'})
+        # the tags of one row no longer carry over to the next
+        self.assertEqual(self.get_tags(tinkering), {'crafting', 'workbench'})
+        self.assertEqual(list(Rule.objects.tagged('ruins')), [scavenging])
+        self.assertEqual(set(Rule.objects.tagged('crafting')), {scavenging, tinkering})
+
+    def test_replace(self):
+        first, second = self.add_rules(2, 'ruins workbench')
+
+        TagQuery.set_tags(Rule.objects.filter(pk=first.pk), 'crafting, vehicle', replace=True)
+
+        self.assertEqual(self.get_tags(first), {'crafting', 'vehicle'})
+        self.assertEqual(self.get_tags(second), {'ruins', 'workbench'})
+        self.assertEqual(list(Rule.objects.tagged('ruins')), [second])
+        self.assertEqual(TagQuery.set_tags(Rule.objects.filter(pk=first.pk), 'vehicle crafting', replace=True), [])
+
+    def test_stamps(self):
+        rule, = self.add_rules(1)
+        resource = ResourceItem.objects.create(name='Scrap', registrar=self.registrar)
+
+        TagQuery.set_tags(Rule.objects.all(), 'ruins', replace=True)
+        TagQuery.set_tags(ResourceItem.objects.all(), 'ruins', replace=True)
+
+        # the fragments of the pages have to be rendered again, while the update date shown in the admin is kept
+        tagged_rule = Rule.objects.get(pk=rule.pk)
+        self.assertGreater(tagged_rule.fragment_stamp, rule.fragment_stamp)
+        self.assertEqual(tagged_rule.last_update_date, rule.last_update_date)
+        self.assertGreater(ResourceItem.objects.get(pk=resource.pk).fragment_stamp, resource.fragment_stamp)
+
+    def test_query_count(self):
+        self.add_rules(5, 'ruins')
+        with CaptureQueriesContext(connection) as few:
+            TagQuery.set_tags(Rule.objects.all(), 'crafting', replace=False)
+
+        self.add_rules(100, 'ruins')
+        with CaptureQueriesContext(connection) as many:
+            TagQuery.set_tags(Rule.objects.all(), 'vehicle', replace=False)
+
+        self.assertEqual(len(many), len(few))
+
+    def test_search_vector(self):
+        rule, = self.add_rules(1)
+
+        TagQuery.set_tags(Rule.objects.all(), 'scavenging', replace=True)
+
+        self.assertTrue(Rule.objects.filter(pk=rule.pk, search_vector='scavenging').exists())
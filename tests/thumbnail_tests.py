@@ -0,0 +1,95 @@
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image as PilImage
+
+from necrotopia.advertisements import AdvertisementCache
+from necrotopia.models import Advertisement, Rule, RulePicture, ThumbnailFile, UserProfile
+from tests.image_tests import make_image
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = FileSystemStorage(location=self.directory.name, base_url='/media/')
+        self.registrar = UserProfile.objects.create_user(email='registrar@necrotopia.test', password='password')
+
+        # the thumbnails are written to the default file storage, which is S3 outside of tests
+        self.settings_override = override_settings(IMAGEKIT_DEFAULT_FILE_STORAGE='django.core.files.storage.'
+                                                                                 'FileSystemStorage',
+                                                   MEDIA_ROOT=self.directory.name, MEDIA_URL='/media/')
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        cache.clear()
+        self.directory.cleanup()
+
+    def add_picture(self) -> RulePicture:
+        rule = Rule.objects.create(name='Scavenging', text='Search the ruins', registrar=self.registrar)
+
+        return RulePicture.objects.create(picture=ContentFile(make_image(2400, 1600), name='ruins.jpg'),
+                                          rule_item=rule)
+
+    def test_preview(self):
+        with mock.patch.object(RulePicture._meta.get_field('picture'), 'storage', self.storage):
+            picture = self.add_picture()
+            preview = picture.image_preview()
+
+            self.assertIn('href="{url}"'.format(url=picture.picture.url), preview)
+            self.assertIn('src="{url}"'.format(url=picture.thumbnail.url), preview)
+            self.assertNotEqual(picture.thumbnail.url, picture.picture.url)
+            with PilImage.open(picture.thumbnail.path) as thumbnail:
+                self.assertEqual(thumbnail.size, (300, 300))
+
+    def test_state_outlives_cache(self):
+        with mock.patch.object(RulePicture._meta.get_field('picture'), 'storage', self.storage):
+            picture = self.add_picture()
+            url = picture.thumbnail.url
+            self.assertTrue(ThumbnailFile.objects.filter(name=picture.thumbnail.name).exists())
+
+            cache.clear()
+            picture = RulePicture.objects.get(pk=picture.pk)
+            with mock.patch.object(FileSystemStorage, 'exists', side_effect=AssertionError('storage was asked')):
+                self.assertEqual(picture.thumbnail.url, url)
+
+    def test_admin(self):
+        superuser = UserProfile.objects.create_superuser(email='admin@necrotopia.test', password='password')
+        self.client.force_login(superuser)
+        with mock.patch.object(Advertisement._meta.get_field('image'), 'storage', self.storage):
+            advertisement = Advertisement.objects.create(name='Raider Rally', registrar=self.registrar,
+                                                         image=ContentFile(make_image(2000, 1000), name='rally.jpg'))
+
+            response = self.client.get('/admin/necrotopia/advertisement/')
+            self.assertContains(response, advertisement.thumbnail.url)
+            response = self.client.get('/admin/necrotopia/advertisement/{pk}/change/'.format(pk=advertisement.pk))
+            self.assertContains(response, advertisement.thumbnail.url)
+            self.assertNotContains(response, 'src="{url}"'.format(url=advertisement.image.url))
+
+    def test_carousel(self):
+        with mock.patch.object(Advertisement._meta.get_field('image'), 'storage', self.storage):
+            advertisement = Advertisement.objects.create(name='Raider Rally', registrar=self.registrar,
+                                                         published=True, start_date=timezone.localdate(),
+                                                         end_date=timezone.localdate(),
+                                                         image=ContentFile(make_image(2000, 1000), name='rally.jpg'))
+
+            # the carousel thumbnail was made on save, so nothing is resized while the page is served, and it is
+            # shown rather than the original until the renditions are made
+            with mock.patch('imagekit.specs.ImageSpec.generate', side_effect=AssertionError('resized')), \
+                    mock.patch.object(FileSystemStorage, 'exists', side_effect=AssertionError('storage was asked')):
+                active, = AdvertisementCache.get_active()
+            self.assertEqual(active.image_url, advertisement.carousel.url)
+            with PilImage.open(advertisement.carousel.path) as carousel:
+                self.assertEqual(carousel.size, (1600, 800))
+
+            # one whose thumbnail is not known to exist, saved before there was one, is shown by its original
+            ThumbnailFile.objects.all().delete()
+            cache.clear()
+            active, = AdvertisementCache.get_active()
+            self.assertEqual(active.image_url, advertisement.image.url)
@@ -0,0 +1,190 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import urllib3
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from necrotopia.models import Advertisement, BackgroundJob, ItemPdf, JobStatus, ModuleAssembly, UserProfile
+from necrotopia.storage_backends import PublicMediaStorage
+from necrotopia.uploads import DirectUpload
+from tests.image_tests import make_image
+
+
+def get_s3_storage(endpoint_url: str = 'http://localhost:9000', **kwargs) -> PublicMediaStorage:
+    return PublicMediaStorage(endpoint_url=endpoint_url, bucket_name=kwargs.pop('bucket_name', 'necrotopia'),
+                              access_key=kwargs.pop('access_key', 'test'), secret_key=kwargs.pop('secret_key', 'test'),
+                              **kwargs)
+
+
+class SlotTests(TestCase):
+    def test_presigned_post(self):
+        slot = DirectUpload.get_slot('necrotopia.itempdf.pdf', 'Auto Frame.pdf', 'application/pdf', 1024,
+                                     storage=get_s3_storage())
+
+        self.assertEqual(slot['url'], 'http://localhost:9000/necrotopia')
+        self.assertRegex(slot['name'], r'^pdf/[0-9a-f]{32}/Auto_Frame\.pdf$')
+        self.assertEqual(slot['fields']['key'], 'media/' + slot['name'])
+        self.assertEqual((slot['fields']['Content-Type'], slot['fields']['acl']), ('application/pdf', 'public-read'))
+
+        policy = json.loads(base64.b64decode(slot['fields']['policy']))
+        self.assertIn(['content-length-range', 1, DirectUpload.targets['necrotopia.itempdf.pdf'][1]],
+                      policy['conditions'])
+        self.assertIn({'key': slot['fields']['key']}, policy['conditions'])
+        self.assertEqual(signing.loads(slot['token'], salt=DirectUpload.salt),
+                         {'target': 'necrotopia.itempdf.pdf', 'name': slot['name']})
+
+    def test_refused(self):
+        storage = get_s3_storage()
+        with self.assertRaises(ValidationError):
+            DirectUpload.get_slot('necrotopia.itempdf.pdf', 'frame.exe', 'application/x-msdownload', 1024,
+                                  storage=storage)
+        with self.assertRaises(ValidationError):
+            DirectUpload.get_slot('necrotopia.itempdf.pdf', 'frame.pdf', 'application/pdf', 100 * 1024 * 1024,
+                                  storage=storage)
+        with self.assertRaises(ValidationError):
+            DirectUpload.get_slot('necrotopia.userprofile.email', 'frame.pdf', 'application/pdf', 1024,
+                                  storage=storage)
+
+    def test_long_name(self):
+        name = DirectUpload.get_name(ItemPdf._meta.get_field('pdf'), 'C:\\blueprints\\' + 'a' * 200 + '.pdf')
+
+        self.assertEqual(len(name), 100)
+        self.assertTrue(name.endswith('aaa.pdf'))
+
+    def test_view(self):
+        data = {'target': 'necrotopia.advertisement.image', 'filename': 'rally.jpg', 'content_type': 'image/jpeg',
+                'size': 2048}
+        response = self.client.post('/admin/uploads/slot', data)
+        self.assertEqual(response.status_code, 302)
+
+        staff = UserProfile.objects.create_superuser(email='admin@necrotopia.test', password='password')
+        self.client.force_login(staff)
+        with mock.patch.object(Advertisement._meta.get_field('image'), 'storage', get_s3_storage()):
+            response = self.client.post('/admin/uploads/slot', data)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json()['name'].startswith('advertisements/'))
+
+            response = self.client.post('/admin/uploads/slot', dict(data, content_type='text/html'))
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('text/html', response.json()['error'])
+
+
+class CompleteTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = FileSystemStorage(location=self.directory.name, base_url='/media/')
+        self.superuser = UserProfile.objects.create_superuser(email='admin@necrotopia.test', password='password')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def upload(self, target: str, filename: str, content_type: str, data: bytes) -> str:
+        """
+            Take a slot and store the file the way the browser would.
+        """
+        slot = DirectUpload.get_slot(target, filename, content_type, len(data), storage=get_s3_storage())
+        self.storage.save(slot['name'], ContentFile(data))
+
+        return slot['token']
+
+    def test_complete(self):
+        with mock.patch.object(ItemPdf._meta.get_field('pdf'), 'storage', self.storage):
+            token = self.upload('necrotopia.itempdf.pdf', 'frame.pdf', 'application/pdf', b'%PDF-1.4')
+            upload = DirectUpload.complete(token, 'necrotopia.itempdf.pdf')
+            self.assertEqual(upload.size, 8)
+            self.assertTrue(self.storage.exists(upload.name))
+
+            with self.assertRaises(ValidationError):
+                DirectUpload.complete(token, 'necrotopia.rulepicture.picture')
+            with self.assertRaises(ValidationError):
+                DirectUpload.complete(token + 'x', 'necrotopia.itempdf.pdf')
+
+            slot = DirectUpload.get_slot('necrotopia.itempdf.pdf', 'lost.pdf', 'application/pdf', 8,
+                                         storage=get_s3_storage())
+            with self.assertRaises(ValidationError):
+                DirectUpload.complete(slot['token'], 'necrotopia.itempdf.pdf')
+
+    def test_admin(self):
+        self.client.force_login(self.superuser)
+        response = self.client.get('/admin/necrotopia/advertisement/add/')
+        self.assertContains(response, 'data-direct-upload-target="necrotopia.advertisement.image"')
+        self.assertContains(response, 'name="image_token"')
+        self.assertContains(response, 'js/direct_upload.js')
+
+        with mock.patch.object(Advertisement._meta.get_field('image'), 'storage', self.storage), \
+                override_settings(IMAGEKIT_DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+                                  MEDIA_ROOT=self.directory.name, MEDIA_URL='/media/'):
+            token = self.upload('necrotopia.advertisement.image', 'rally.jpg', 'image/jpeg', make_image(400, 200))
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/admin/necrotopia/advertisement/add/', {
+                    'name': 'Raider Rally', 'slug': 'raider-rally', 'link': '', 'image_token': token,
+                    'start_date': '2026-01-01', 'end_date': '2026-02-01', 'registrar': self.superuser.pk,
+                    'registry_date_0': '2026-01-01', 'registry_date_1': '12:00:00'})
+
+            self.assertEqual(response.status_code, 302)
+            advertisement = Advertisement.objects.get()
+            self.assertEqual(advertisement.image.name, signing.loads(token, salt=DirectUpload.salt)['name'])
+            self.assertEqual(BackgroundJob.objects.get().kind, 'render_images')
+
+    def test_pdf_digest(self):
+        blueprint = ModuleAssembly.objects.create(name='Auto Frame', registrar=self.superuser)
+        with mock.patch.object(ItemPdf._meta.get_field('pdf'), 'storage', self.storage):
+            token = self.upload('necrotopia.itempdf.pdf', 'frame.pdf', 'application/pdf', b'%PDF-1.4')
+            with self.captureOnCommitCallbacks(execute=True):
+                item = ItemPdf.objects.create(pdf=DirectUpload.complete(token, 'necrotopia.itempdf.pdf'),
+                                              pdf_assembly_item=blueprint)
+            self.assertEqual(item.digest, '')
+
+            call_command('run_jobs', once=True, stdout=io.StringIO())
+
+        self.assertEqual(BackgroundJob.objects.get().status, JobStatus.Done)
+        item.refresh_from_db()
+        self.assertEqual(item.digest, hashlib.sha256(b'%PDF-1.4').hexdigest())
+
+
+@unittest.skipUnless(os.environ.get('NECROTOPIA_S3_TEST_ENDPOINT'), 'needs an S3 compatible store, such as the s3 '
+                                                                   'service of docker-compose')
+class ObjectStoreTests(TestCase):
+    """
+        Posts to a real store: NECROTOPIA_S3_TEST_ENDPOINT, with the bucket and keys of AWS_STORAGE_BUCKET_NAME,
+        AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY.
+    """
+
+    def setUp(self):
+        self.storage = get_s3_storage(os.environ['NECROTOPIA_S3_TEST_ENDPOINT'],
+                                      bucket_name=os.environ['AWS_STORAGE_BUCKET_NAME'],
+                                      access_key=os.environ['AWS_ACCESS_KEY_ID'],
+                                      secret_key=os.environ['AWS_SECRET_ACCESS_KEY'])
+
+    def post(self, slot: dict, data: bytes) -> int:
+        fields = list(slot['fields'].items()) + [('file', ('upload', data))]
+
+        return urllib3.PoolManager().request('POST', slot['url'], fields=fields).status
+
+    def test_upload(self):
+        with mock.patch.object(ItemPdf._meta.get_field('pdf'), 'storage', self.storage):
+            slot = DirectUpload.get_slot('necrotopia.itempdf.pdf', 'frame.pdf', 'application/pdf', 8)
+            self.assertEqual(self.post(slot, b'%PDF-1.4'), 204)
+            try:
+                self.assertEqual(DirectUpload.complete(slot['token'], 'necrotopia.itempdf.pdf').size, 8)
+            finally:
+                self.storage.delete(slot['name'])
+
+    def test_policy(self):
+        with mock.patch.object(ItemPdf._meta.get_field('pdf'), 'storage', self.storage):
+            slot = DirectUpload.get_slot('necrotopia.itempdf.pdf', 'frame.pdf', 'application/pdf', 8)
+            slot['fields']['Content-Type'] = 'text/html'
+
+            self.assertEqual(self.post(slot, b'<script>'), 403)
+            self.assertFalse(self.storage.exists(slot['name']))